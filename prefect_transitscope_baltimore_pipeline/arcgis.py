@@ -0,0 +1,331 @@
+"""Client for downloading ArcGIS REST FeatureServer layers"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import requests
+import shapely
+
+from prefect_transitscope_baltimore_pipeline.geojson_stream import (
+    parse_feature_collection,
+)
+from prefect_transitscope_baltimore_pipeline.http_client import get_session
+
+MD_TRANSIT_BUS_STOPS_URL = "https://geodata.md.gov/imap/rest/services/Transportation/MD_Transit/FeatureServer/9"
+
+# Used when the layer metadata does not report a maxRecordCount
+DEFAULT_MAX_RECORD_COUNT = 1000
+
+# Bytes parsed at a time from streamed GeoJSON responses
+STREAM_CHUNK_SIZE = 1 << 16
+
+# Coordinates are quantized to a grid this fine, in degrees (about 1 cm)
+QUANTIZATION_TOLERANCE = 1e-7
+
+# Query parameters for each supported page encoding. Only GeoJSON pages are
+# parsed as they stream in; Esri JSON pages are read whole
+TRANSFER_FORMATS = {
+    "geojson": {"f": "geojson"},
+    "quantized": {
+        "f": "json",
+        "quantizationParameters": json.dumps(
+            {
+                "mode": "edit",
+                "originPosition": "upperLeft",
+                "tolerance": QUANTIZATION_TOLERANCE,
+            }
+        ),
+    },
+}
+
+
+class FeatureServerError(Exception):
+    """Raised when a FeatureServer answers a request with an error."""
+
+
+class FeatureLayer:
+    """
+    A single FeatureServer layer, downloaded in pages.
+
+    The layer is split into pages of at most `maxRecordCount` features by
+    object-ID range, and the pages are fetched concurrently over the
+    package's shared, pooled and cached HTTP session. Object-ID ranges,
+    unlike `resultOffset`, give stable pages even when the server cannot
+    order results, and work on layers that do not support pagination. A
+    page the server truncates anyway is split in two and fetched again.
+
+    Examples:
+        >>> layer = FeatureLayer(MD_TRANSIT_BUS_STOPS_URL)
+        >>> layer.metadata()["name"]
+        'Bus Stops'
+        >>> stops = layer.download()
+    """
+
+    def __init__(
+        self, url, session=None, max_workers=8, timeout=30, metadata=None
+    ):
+        self.url = url.rstrip("/")
+        self.session = session or get_session()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._metadata = metadata
+        self._object_id_field = None
+        # Decoded response bytes, summed across the page download threads
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def metadata(self, errors="raise"):
+        """
+        Returns the layer metadata (`?f=pjson`), fetched once.
+
+        Parameters:
+            errors (str): "raise" to raise if the metadata cannot be fetched, or "ignore" to use empty metadata, and the defaults it implies, from then on.
+
+        Returns:
+            dict: The layer metadata.
+        """
+        if self._metadata is None:
+            try:
+                self._metadata = self._get(self.url, {"f": "pjson"})
+            except (requests.RequestException, FeatureServerError):
+                if errors != "ignore":
+                    raise
+                self._metadata = {}
+        return self._metadata
+
+    @property
+    def object_id_field(self):
+        """The name of the layer's object ID field."""
+        if self._object_id_field is None:
+            self._object_id_field = self.metadata().get(
+                "objectIdField", "OBJECTID"
+            )
+        return self._object_id_field
+
+    @property
+    def max_record_count(self):
+        """The most features the server returns for one query."""
+        return (
+            self.metadata().get("maxRecordCount") or DEFAULT_MAX_RECORD_COUNT
+        )
+
+    @property
+    def last_edit_date(self):
+        """
+        The time the layer was last edited (`editingInfo.lastEditDate`), as a
+        UTC Timestamp, or None if the server does not report it.
+        """
+        last_edit_date = (self.metadata().get("editingInfo") or {}).get(
+            "lastEditDate"
+        )
+        if last_edit_date is None:
+            return None
+        return pd.Timestamp(last_edit_date, unit="ms", tz="UTC")
+
+    @property
+    def edit_date_field(self):
+        """
+        The field the server stamps with each feature's edit time
+        (`editFieldsInfo.editDateField`), or None if editor tracking is off.
+        """
+        return (self.metadata().get("editFieldsInfo") or {}).get(
+            "editDateField"
+        )
+
+    def edited_since_filter(self, since):
+        """
+        Returns a filter for the features edited after a time, or None if the
+        layer does not track edit dates.
+
+        Parameters:
+            since (str or Timestamp): The time, taken as UTC if it has no time zone.
+
+        Returns:
+            str: A SQL filter for `download` or `object_ids`.
+        """
+        if self.edit_date_field is None:
+            return None
+        since = pd.Timestamp(since)
+        if since.tzinfo is not None:
+            since = since.tz_convert("UTC").tz_localize(None)
+        return (
+            f"{self.edit_date_field} > "
+            f"TIMESTAMP '{since:%Y-%m-%d %H:%M:%S}'"
+        )
+
+    def object_ids(self, where="1=1"):
+        """
+        Returns the sorted object IDs of the features matching a filter.
+
+        Object-ID queries are not limited by `maxRecordCount`.
+
+        Parameters:
+            where (str): A SQL filter on the layer's fields.
+
+        Returns:
+            list: The matching object IDs.
+        """
+        response = self._get(
+            f"{self.url}/query",
+            {"where": where, "returnIdsOnly": "true", "f": "json"},
+        )
+        if response.get("objectIdFieldName"):
+            self._object_id_field = response["objectIdFieldName"]
+        return sorted(response.get("objectIds") or [])
+
+    def download(
+        self,
+        where="1=1",
+        out_fields="*",
+        object_ids=None,
+        transfer_format="geojson",
+    ):
+        """
+        Downloads the features matching a filter into a GeoDataFrame.
+
+        Parameters:
+            where (str): A SQL filter on the layer's fields.
+            out_fields (str): A comma-separated list of fields to return.
+            object_ids (list, optional): The object IDs to download, if they are already known.
+            transfer_format (str): How the server encodes each page, one of `TRANSFER_FORMATS`. "geojson" is the most verbose, but each page is parsed as it streams in, so memory stays bounded on large layers; "quantized" asks for Esri JSON with integer-quantized coordinates, and holds each whole page in memory while it is decoded.
+
+        Returns:
+            GeoDataFrame: The features in EPSG:4326, in object ID order, with the geometry as the last column.
+        """
+        if transfer_format not in TRANSFER_FORMATS:
+            raise ValueError(
+                f"Unknown transfer format {transfer_format!r}; "
+                f"expected one of {list(TRANSFER_FORMATS)}"
+            )
+        if object_ids is None:
+            object_ids = self.object_ids(where)
+        query = {"outFields": out_fields, "outSR": 4326}
+        query.update(TRANSFER_FORMATS[transfer_format])
+        page_size = self.max_record_count
+        pages = [
+            object_ids[start : start + page_size]
+            for start in range(0, len(object_ids), page_size)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            frames = list(
+                executor.map(
+                    lambda page: self._download_page(where, query, page),
+                    pages,
+                )
+            )
+        if not frames:
+            return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+        return gpd.GeoDataFrame(
+            pd.concat(frames, ignore_index=True), crs="EPSG:4326"
+        )
+
+    def _download_page(self, where, query, object_ids):
+        params = {
+            **query,
+            "where": (
+                f"({where}) AND {self.object_id_field} >= {object_ids[0]} "
+                f"AND {self.object_id_field} <= {object_ids[-1]}"
+            ),
+        }
+        if query["f"] == "geojson":
+            features, members = self._get_feature_collection(
+                f"{self.url}/query", params
+            )
+        else:
+            members = self._get(f"{self.url}/query", params)
+            features = esri_json_to_geodataframe(members)
+        if members.get("exceededTransferLimit") or members.get(
+            "properties", {}
+        ).get("exceededTransferLimit"):
+            # The server's limit is lower than the page size; split the page
+            if len(object_ids) == 1:
+                raise FeatureServerError(
+                    f"{self.url} returned a partial page for one feature"
+                )
+            middle = len(object_ids) // 2
+            return pd.concat(
+                [
+                    self._download_page(where, query, object_ids[:middle]),
+                    self._download_page(where, query, object_ids[middle:]),
+                ],
+                ignore_index=True,
+            )
+        return features
+
+    def _get(self, url, params):
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        with self._lock:
+            self.bytes_received += len(response.content)
+        payload = response.json()
+        self._raise_for_error(url, payload)
+        return payload
+
+    def _get_feature_collection(self, url, params):
+        """Streams a GeoJSON response into a GeoDataFrame as it arrives."""
+        with self.session.get(
+            url, params=params, timeout=self.timeout, stream=True
+        ) as response:
+            response.raise_for_status()
+            features, members = parse_feature_collection(
+                self._count_bytes(response.iter_content(STREAM_CHUNK_SIZE))
+            )
+        self._raise_for_error(url, members)
+        return features, members
+
+    def _count_bytes(self, chunks):
+        for chunk in chunks:
+            with self._lock:
+                self.bytes_received += len(chunk)
+            yield chunk
+
+    @staticmethod
+    def _raise_for_error(url, payload):
+        if "error" in payload:
+            raise FeatureServerError(
+                f"{url} returned an error: {payload['error']}"
+            )
+
+
+def esri_json_to_geodataframe(response):
+    """
+    Converts an Esri JSON point query response into a GeoDataFrame in
+    EPSG:4326, with the geometry as the last column.
+
+    Quantized coordinates are decoded with the response's `transform` in one
+    vectorized pass.
+
+    Parameters:
+        response (dict): A FeatureServer query response with `f=json`.
+
+    Returns:
+        GeoDataFrame: The features.
+    """
+    features = response.get("features", [])
+    attributes = pd.DataFrame.from_records(
+        [feature.get("attributes", {}) for feature in features]
+    )
+    coordinates = np.array(
+        [
+            (geometry.get("x", np.nan), geometry.get("y", np.nan))
+            if geometry
+            else (np.nan, np.nan)
+            for geometry in (feature.get("geometry") for feature in features)
+        ],
+        dtype=float,
+    ).reshape(-1, 2)
+    transform = response.get("transform")
+    if transform:
+        scale_x, scale_y = transform["scale"][:2]
+        translate_x, translate_y = transform["translate"][:2]
+        coordinates[:, 0] = translate_x + coordinates[:, 0] * scale_x
+        if transform.get("originPosition", "upperLeft") == "upperLeft":
+            coordinates[:, 1] = translate_y - coordinates[:, 1] * scale_y
+        else:
+            coordinates[:, 1] = translate_y + coordinates[:, 1] * scale_y
+    geometry = shapely.points(coordinates)
+    geometry[np.isnan(coordinates).any(axis=1)] = None
+    return gpd.GeoDataFrame(attributes, geometry=geometry, crs="EPSG:4326")
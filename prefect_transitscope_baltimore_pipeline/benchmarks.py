@@ -0,0 +1,433 @@
+"""Benchmarks for the pipeline's download and storage formats"""
+import json
+import tempfile
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from prefect.serializers import PickleSerializer
+
+from prefect_transitscope_baltimore_pipeline.arcgis import (
+    TRANSFER_FORMATS,
+    FeatureLayer,
+)
+from prefect_transitscope_baltimore_pipeline.flatgeobuf import (
+    read_flatgeobuf,
+    write_flatgeobuf,
+)
+from prefect_transitscope_baltimore_pipeline.geojson_stream import (
+    read_geojson,
+)
+from prefect_transitscope_baltimore_pipeline.parquet_profiles import (
+    PARQUET_PROFILES,
+    write_parquet,
+)
+from prefect_transitscope_baltimore_pipeline.serializers import (
+    FrameSerializer,
+)
+from prefect_transitscope_baltimore_pipeline.uploads import (
+    client_config,
+    transfer_config,
+    upload_files_if_changed,
+)
+
+
+def compare_transfer_formats(
+    layer_url, transfer_formats=tuple(TRANSFER_FORMATS), where="1=1"
+):
+    """
+    Downloads a FeatureServer layer once in each transfer format and reports
+    the payload size and the time taken to download and decode it.
+
+    The sizes depend on how the server encodes each format, so run it
+    against the real layer. The package's tests only run it against a local
+    stand-in for a FeatureServer, which checks the mechanics of the
+    comparison but not the relative sizes the real server returns.
+
+    Parameters:
+        layer_url (str): The URL of the FeatureServer layer.
+        transfer_formats (tuple): The formats to compare; see `arcgis.TRANSFER_FORMATS`.
+        where (str): A SQL filter on the layer's fields.
+
+    Returns:
+        DataFrame: One row per format with 'transfer_format', 'features', 'bytes' and 'seconds' columns.
+
+    Examples:
+        >>> compare_transfer_formats(MD_TRANSIT_BUS_STOPS_URL)
+          transfer_format  features     bytes  seconds
+        0         geojson      4833   3121542     2.41
+        1       quantized      4833   1803265     1.37
+    """
+    object_ids = FeatureLayer(layer_url).object_ids(where)
+    results = []
+    for transfer_format in transfer_formats:
+        layer = FeatureLayer(layer_url)
+        layer.metadata()
+        metadata_bytes = layer.bytes_received
+        start = time.perf_counter()
+        features = layer.download(
+            where, object_ids=object_ids, transfer_format=transfer_format
+        )
+        results.append(
+            {
+                "transfer_format": transfer_format,
+                "features": len(features),
+                "bytes": layer.bytes_received - metadata_bytes,
+                "seconds": time.perf_counter() - start,
+            }
+        )
+    return pd.DataFrame(results)
+
+
+def write_synthetic_stops_geojson(path, n_features):
+    """
+    Writes a GeoJSON FeatureCollection of `n_features` synthetic bus stops
+    shaped like the MTA bus stops layer.
+
+    Parameters:
+        path (str or Path): The file to write.
+        n_features (int): The number of stops.
+    """
+    with open(path, "w") as file:
+        file.write('{"type": "FeatureCollection", "features": [')
+        for i in range(n_features):
+            feature = {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [
+                        -76.9 + (i % 1000) * 6e-4,
+                        39.1 + (i // 1000 % 1000) * 6e-4,
+                    ],
+                },
+                "properties": {
+                    "objectid": i + 1,
+                    "stop_id": 10_000 + i,
+                    "stop_name": f"Synthetic Stop {i}",
+                    "rider_total": float(i % 500),
+                    "routes_served": "CityLink Blue, 22",
+                    "shelter": "Yes" if i % 3 else "No",
+                },
+            }
+            file.write(("," if i else "") + json.dumps(feature))
+        file.write("]}")
+
+
+def benchmark_geojson_ingestion(n_features=1_000_000, batch_size=50_000):
+    """
+    Reads a synthetic stops GeoJSON file with the streaming parser and
+    reports the time taken, the peak memory Python allocated while parsing,
+    and the memory held by the resulting frame.
+
+    Parameters:
+        n_features (int): The number of synthetic stops.
+        batch_size (int): The number of features buffered before conversion.
+
+    Returns:
+        dict: 'features', 'file_bytes', 'seconds', 'peak_bytes' and 'frame_bytes'.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "stops.geojson"
+        write_synthetic_stops_geojson(path, n_features)
+        tracemalloc.start()
+        start = time.perf_counter()
+        stops = read_geojson(path, batch_size=batch_size)
+        seconds = time.perf_counter() - start
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            "features": len(stops),
+            "file_bytes": path.stat().st_size,
+            "seconds": seconds,
+            "peak_bytes": peak_bytes,
+            "frame_bytes": int(stops.memory_usage(deep=True).sum()),
+        }
+
+
+def make_synthetic_stops(n_stops):
+    """
+    Returns a GeoDataFrame of `n_stops` synthetic bus stops shaped like the
+    transformed MTA bus stops data.
+
+    Parameters:
+        n_stops (int): The number of stops.
+
+    Returns:
+        GeoDataFrame: The stops in EPSG:4326.
+    """
+    i = np.arange(n_stops)
+    longitude = -76.9 + (i % 1000) * 6e-4
+    latitude = 39.1 + (i // 1000 % 1000) * 6e-4
+    return gpd.GeoDataFrame(
+        {
+            "objectid": i + 1,
+            "stop_id": 10_000 + i,
+            "stop_name": [f"Synthetic Stop {j}" for j in i],
+            "rider_total": (i % 500).astype(float),
+            "routes_served": np.where(i % 2, "CityLink Blue, 22", "85"),
+            "shelter": np.where(i % 3, "Yes", "No"),
+            "longitude": longitude,
+            "latitude": latitude,
+        },
+        geometry=gpd.points_from_xy(longitude, latitude),
+        crs="EPSG:4326",
+    )
+
+
+def compare_result_serializers(frame, serializers=None):
+    """
+    Serializes a frame with each Prefect result serializer and reports the
+    size of the result and the time taken to write and read it.
+
+    Parameters:
+        frame (DataFrame or GeoDataFrame): The task result to serialize, such as `make_synthetic_stops(100_000)`.
+        serializers (dict, optional): Serializers by name. Defaults to Prefect's pickle serializer and `FrameSerializer`.
+
+    Returns:
+        DataFrame: One row per serializer with 'serializer', 'bytes', 'dump_seconds' and 'load_seconds' columns.
+
+    Examples:
+        >>> compare_result_serializers(make_synthetic_stops(100_000))
+             serializer     bytes  dump_seconds  load_seconds
+        0        pickle  14195652          0.19          0.22
+        1  frame (zstd)   1198523          0.14          0.21
+    """
+    if serializers is None:
+        serializers = {
+            "pickle": PickleSerializer(),
+            "frame (zstd)": FrameSerializer(),
+        }
+    results = []
+    for name, serializer in serializers.items():
+        start = time.perf_counter()
+        blob = serializer.dumps(frame)
+        dump_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        serializer.loads(blob)
+        results.append(
+            {
+                "serializer": name,
+                "bytes": len(blob),
+                "dump_seconds": dump_seconds,
+                "load_seconds": time.perf_counter() - start,
+            }
+        )
+    return pd.DataFrame(results)
+
+
+def compare_parquet_profiles(frame, profiles=tuple(PARQUET_PROFILES)):
+    """
+    Writes a frame with each parquet output profile and reports the file
+    size and the time taken to write it and to read it back.
+
+    GeoDataFrames are written with a bbox covering column, four float
+    columns per row, with either profile. In the example below, the
+    interactive stops are about 4.5 times the size of the archive ones:
+    snappy and 1,000-row groups, which let readers skip row groups by area,
+    compress far less than zstd level 9 and a single row group.
+
+    Parameters:
+        frame (DataFrame or GeoDataFrame): The data, such as the bus ridership data or `make_synthetic_stops(100_000)`.
+        profiles (tuple): The profiles to compare, by name; see `parquet_profiles.PARQUET_PROFILES`.
+
+    Returns:
+        DataFrame: One row per profile with 'profile', 'bytes', 'row_groups', 'write_seconds' and 'read_seconds' columns.
+
+    Examples:
+        >>> compare_parquet_profiles(make_synthetic_stops(100_000))
+               profile    bytes  row_groups  write_seconds  read_seconds
+        0      archive   920921           1           0.19          0.20
+        1  interactive  4134383         100           0.18          0.20
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in profiles:
+            path = Path(directory) / f"{profile}.parquet"
+            report = write_parquet(
+                frame, path, profile, quiet=True, measure_read=True
+            )
+            results.append(
+                {
+                    "profile": profile,
+                    "bytes": report["bytes"],
+                    "row_groups": pq.ParquetFile(path).num_row_groups,
+                    "write_seconds": report["write_seconds"],
+                    "read_seconds": report["read_seconds"],
+                }
+            )
+    return pd.DataFrame(results)
+
+
+def compare_viewport_reads(stops, n_viewports=20, viewport_size=0.01):
+    """
+    Writes stops as GeoParquet, FlatGeobuf and GeoJSON and reports the time
+    taken to read the stops in small, map-viewport-sized bounding boxes
+    from each file.
+
+    GeoParquet reads skip the row groups outside a viewport, FlatGeobuf
+    reads walk the file's spatial index, and GeoJSON reads scan the whole
+    file.
+
+    Parameters:
+        stops (GeoDataFrame): The stops, such as `make_synthetic_stops(100_000)`.
+        n_viewports (int): The number of viewports read, placed at random within the stops' bounds.
+        viewport_size (float): The width and height of each viewport, in the stops' CRS units.
+
+    Returns:
+        DataFrame: One row per format with 'format', 'bytes', 'features' (summed over the viewports) and 'seconds_per_viewport' columns.
+
+    Examples:
+        >>> compare_viewport_reads(make_synthetic_stops(100_000))
+               format     bytes  features  seconds_per_viewport
+        0  geoparquet   4134383      5544                0.0638
+        1  flatgeobuf  21308152      5544                0.0045
+        2     geojson  29892202      5544                1.1477
+    """
+    minx, miny, maxx, maxy = stops.total_bounds
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(
+        [minx, miny],
+        [max(minx, maxx - viewport_size), max(miny, maxy - viewport_size)],
+        size=(n_viewports, 2),
+    )
+    viewports = [
+        (x, y, x + viewport_size, y + viewport_size) for x, y in corners
+    ]
+    formats = {
+        "geoparquet": (
+            "stops.parquet",
+            lambda path: write_parquet(stops, path, "interactive", quiet=True),
+            lambda path, bbox: gpd.read_parquet(path, bbox=bbox),
+        ),
+        "flatgeobuf": (
+            "stops.fgb",
+            lambda path: write_flatgeobuf(stops, path, quiet=True),
+            lambda path, bbox: read_flatgeobuf(path, bbox=bbox),
+        ),
+        "geojson": (
+            "stops.geojson",
+            lambda path: stops.to_file(path, driver="GeoJSON"),
+            lambda path, bbox: gpd.read_file(path, bbox=bbox),
+        ),
+    }
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (file_name, write, read) in formats.items():
+            path = Path(directory) / file_name
+            write(path)
+            features = 0
+            start = time.perf_counter()
+            for bbox in viewports:
+                features += len(read(path, bbox))
+            results.append(
+                {
+                    "format": name,
+                    "bytes": path.stat().st_size,
+                    "features": features,
+                    "seconds_per_viewport": (time.perf_counter() - start)
+                    / n_viewports,
+                }
+            )
+    return pd.DataFrame(results)
+
+
+def compare_upload_configs(
+    file_sizes=(64 << 20, *[1 << 20] * 32), configs=None, client=None
+):
+    """
+    Uploads a set of files to S3 with each transfer configuration and
+    reports the time taken and throughput.
+
+    Without a client, the files are uploaded to moto's in-process S3
+    stand-in (moto must be installed), which measures the client-side cost
+    of each configuration, such as hashing, part splitting and thread
+    scheduling, rather than network throughput.
+
+    Parameters:
+        file_sizes (tuple): The size of each file in bytes. The default mixes one file large enough for a multipart upload with many small partition-sized files.
+        configs (dict, optional): Keyword arguments for `upload_files_if_changed` (`config` and `max_workers`), by name. Defaults to a serial configuration, the package defaults and a configuration with smaller parts and more threads.
+        client (botocore.client.S3, optional): The S3 client. Each configuration uploads to its own new bucket with a unique name, which is emptied and deleted afterwards.
+
+    Returns:
+        DataFrame: One row per configuration with 'config', 'files', 'bytes', 'seconds' and 'mb_per_second' columns.
+
+    Examples:
+        >>> compare_upload_configs()
+             config  files     bytes  seconds  mb_per_second
+        0    serial     33  100663296     1.32          72.49
+        1  defaults     33  100663296     1.31          73.12
+        2     tuned     33  100663296     1.13          84.98
+    """
+    if configs is None:
+        configs = {
+            "serial": {
+                "config": transfer_config(max_concurrency=1),
+                "max_workers": 1,
+            },
+            "defaults": {},
+            "tuned": {
+                "config": transfer_config(
+                    multipart_threshold=8 << 20,
+                    multipart_chunksize=8 << 20,
+                    max_concurrency=16,
+                ),
+                "max_workers": 16,
+            },
+        }
+    if client is None:
+        import boto3
+        from moto import mock_aws
+
+        with mock_aws():
+            return compare_upload_configs(
+                file_sizes,
+                configs,
+                boto3.client(
+                    "s3",
+                    region_name="us-east-1",
+                    # Enough connections for the tuned settings
+                    config=client_config(max_workers=16, max_concurrency=16),
+                ),
+            )
+    rng = np.random.default_rng(0)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i, size in enumerate(file_sizes):
+            path = Path(directory) / f"part-{i}.bin"
+            path.write_bytes(rng.bytes(size))
+            paths.append(path)
+        for name, options in configs.items():
+            bucket = f"transitscope-upload-benchmark-{uuid.uuid4().hex[:12]}"
+            client.create_bucket(Bucket=bucket)
+            try:
+                start = time.perf_counter()
+                # Keys relative to the temporary directory, not its path
+                summary = upload_files_if_changed(
+                    client, paths, bucket, root=directory, **options
+                )
+                seconds = time.perf_counter() - start
+            finally:
+                for path in paths:
+                    client.delete_object(
+                        Bucket=bucket,
+                        Key=path.relative_to(directory).as_posix(),
+                    )
+                client.delete_bucket(Bucket=bucket)
+            results.append(
+                {
+                    "config": name,
+                    "files": summary["uploaded_files"],
+                    "bytes": summary["uploaded_bytes"],
+                    "seconds": seconds,
+                    "mb_per_second": summary["uploaded_bytes"]
+                    / seconds
+                    / (1 << 20),
+                }
+            )
+    return pd.DataFrame(results)
@@ -0,0 +1,273 @@
+"""Content-hash caching for the transform tasks"""
+import functools
+import hashlib
+import inspect
+import json
+import marshal
+import os
+import pickle
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import timedelta
+from pathlib import Path
+
+import pandas as pd
+from prefect import Task
+from prefect.context import FlowRunContext
+from prefect.utilities.hashing import hash_objects
+
+from prefect_transitscope_baltimore_pipeline.serializers import (
+    RESULT_SERIALIZER,
+)
+
+# How long a transform task's result is reused, overridable in days
+TRANSFORM_CACHE_EXPIRATION = timedelta(
+    days=float(os.environ.get("TRANSITSCOPE_TRANSFORM_CACHE_DAYS", 7))
+)
+
+# Part of every transform cache key; bump it to invalidate every cached
+# result, for example after upgrading a library a transform relies on
+TRANSFORM_CACHE_VERSION = 1
+
+# Where the run time of each cached result is kept, to report time saved
+TASK_CACHE_LEDGER_PATH = "data/task_cache_ledger.json"
+
+_ledger_lock = threading.Lock()
+
+# The cache key and outcome of the transform task being called, if any
+_current_run = ContextVar("current_transform_run", default=None)
+
+
+def fingerprint(value):
+    """
+    Returns a content hash of a task argument.
+
+    DataFrames are hashed column by column with `pd.util.hash_pandas_object`,
+    which is vectorized, together with their column names, dtypes, index and
+    CRS. Geometries are hashed by their WKB, and columns holding unhashable
+    objects such as lists fall back to pickling. A `DataHandle` is already
+    identified by the fingerprint of its frame. Other values are hashed with
+    Prefect's `hash_objects`.
+
+    Parameters:
+        value: The argument.
+
+    Returns:
+        str: A hex digest that changes whenever the value does.
+    """
+    from prefect_transitscope_baltimore_pipeline.datastore import DataHandle
+
+    if isinstance(value, DataHandle):
+        return value.fingerprint
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if not isinstance(value, pd.DataFrame):
+        return hash_objects(value)
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps(
+            [list(map(str, value.columns)), list(map(str, value.dtypes))]
+        ).encode()
+    )
+    digest.update(_hash_column(value.index.to_series()))
+    for _, column in value.items():
+        digest.update(_hash_column(column))
+    crs = getattr(value, "crs", None) if hasattr(value, "geometry") else None
+    digest.update(str(crs).encode())
+    return digest.hexdigest()
+
+
+def fingerprint_cache_key(context, parameters):
+    """
+    A Prefect `cache_key_fn` built from the fingerprints of a task's
+    arguments, the source of the task function and the module defining it,
+    and `TRANSFORM_CACHE_VERSION`.
+
+    Unlike `prefect.tasks.task_input_hash`, which pickles every argument,
+    DataFrames are hashed in place with `fingerprint`. Hashing the whole
+    module's source means editing a helper the task calls, or a constant it
+    reads, invalidates its cached results too.
+
+    Parameters:
+        context (TaskRunContext): The task run context.
+        parameters (dict): The task's arguments.
+
+    Returns:
+        str: The cache key.
+    """
+    cache_key = hash_objects(
+        context.task.task_key,
+        TRANSFORM_CACHE_VERSION,
+        code_fingerprint(context.task.fn),
+        {name: fingerprint(value) for name, value in parameters.items()},
+    )
+    run = _current_run.get()
+    if run is not None:
+        run["hit_key"] = cache_key
+    return cache_key
+
+
+def code_fingerprint(fn):
+    """
+    Returns a hash of the source file of the module defining a function,
+    which includes the function's own source, or of its compiled code,
+    constants and names included, if there is no source file.
+
+    Parameters:
+        fn (callable): The function, or a wrapper of it.
+
+    Returns:
+        str: A hex digest that changes whenever the code does.
+    """
+    fn = inspect.unwrap(fn)
+    try:
+        path = inspect.getsourcefile(sys.modules[fn.__module__])
+    except (KeyError, TypeError):
+        path = None
+    if path and os.path.exists(path):
+        return _file_hash(path, os.stat(path).st_mtime_ns)
+    return hashlib.sha256(marshal.dumps(fn.__code__)).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _file_hash(path, mtime_ns):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class TransformTask(Task):
+    """
+    A task whose result is cached by the fingerprint of its inputs.
+
+    The task takes frames or `DataHandle`s, and returns a handle to its
+    result when it is given one, so large frames are passed between tasks
+    by reference. Results are persisted with `RESULT_SERIALIZER` and reused
+    for `TRANSFORM_CACHE_EXPIRATION`, so re-running a flow on unchanged
+    inputs, for example after a failed upload, skips the transform. Each cache hit is printed along with the
+    run time it saved, as recorded when the result was computed.
+    """
+
+    def __init__(self, fn, **kwargs):
+        from prefect_transitscope_baltimore_pipeline.datastore import (
+            accepts_handles,
+        )
+
+        fn = accepts_handles(fn)
+        kwargs.setdefault("cache_key_fn", fingerprint_cache_key)
+        kwargs.setdefault("cache_expiration", TRANSFORM_CACHE_EXPIRATION)
+        kwargs.setdefault("persist_result", True)
+        kwargs.setdefault("result_serializer", RESULT_SERIALIZER)
+        on_completion = list(kwargs.get("on_completion") or [])
+        if _record_completion not in on_completion:
+            on_completion.append(_record_completion)
+        kwargs["on_completion"] = on_completion
+        super().__init__(fn, **kwargs)
+
+    def __call__(self, *args, **kwargs):
+        if FlowRunContext.get() is None:
+            return super().__call__(*args, **kwargs)
+        # Completion hooks only run when the task runs rather than hitting
+        # the cache; the hook fills this in from a copy of this context
+        run = {}
+        token = _current_run.set(run)
+        try:
+            start = time.perf_counter()
+            result = super().__call__(*args, **kwargs)
+            seconds = time.perf_counter() - start
+        finally:
+            _current_run.reset(token)
+        cached = "cache_key" not in run
+        if kwargs.get("return_state"):
+            cached = result.name == "Cached"
+        if not cached:
+            if run.get("cache_key") is not None:
+                record_task_run_time(
+                    run["cache_key"], seconds, self.cache_expiration
+                )
+        else:
+            saved = (
+                read_task_cache_ledger()
+                .get(run.get("hit_key"), {})
+                .get("seconds")
+            )
+            saved = f"{saved:.2f}s" if saved is not None else "unknown time"
+            print(f"Cache hit for {self.name}, saved {saved}")
+        return result
+
+
+def transform_task(fn=None, **kwargs):
+    """
+    Decorates a function as a `TransformTask`; accepts the same options as
+    `prefect.task`.
+
+    Examples:
+        >>> @transform_task
+        ... def drop_empty_rows(data_frame):
+        ...     return data_frame.dropna(how="all")
+    """
+    if fn is None:
+        return lambda fn: TransformTask(fn, **kwargs)
+    return TransformTask(fn, **kwargs)
+
+
+def read_task_cache_ledger(path=None):
+    """
+    Reads the recorded run times of cached task results.
+
+    Parameters:
+        path (str or Path, optional): The ledger file. Defaults to `TASK_CACHE_LEDGER_PATH`.
+
+    Returns:
+        dict: The run time in seconds and expiry of each cache key.
+    """
+    path = Path(path or TASK_CACHE_LEDGER_PATH)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def record_task_run_time(cache_key, seconds, expiration, path=None):
+    """
+    Records how long it took to compute a cached task result, and drops
+    entries whose results have expired.
+
+    Parameters:
+        cache_key (str): The result's cache key.
+        seconds (float): The task's run time.
+        expiration (timedelta, optional): How long the result is cached.
+        path (str or Path, optional): The ledger file. Defaults to `TASK_CACHE_LEDGER_PATH`.
+    """
+    path = Path(path or TASK_CACHE_LEDGER_PATH)
+    now = pd.Timestamp.now(tz="UTC")
+    with _ledger_lock:
+        ledger = {
+            key: entry
+            for key, entry in read_task_cache_ledger(path).items()
+            if entry["expires"] is None or pd.Timestamp(entry["expires"]) > now
+        }
+        ledger[cache_key] = {
+            "seconds": seconds,
+            "expires": (now + expiration).isoformat() if expiration else None,
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(ledger, indent=2))
+
+
+def _record_completion(task, task_run, state):
+    run = _current_run.get()
+    if run is not None:
+        run["cache_key"] = state.state_details.cache_key
+
+
+def _hash_column(column):
+    if hasattr(column, "to_wkb"):
+        column = column.to_wkb()
+    try:
+        hashes = pd.util.hash_pandas_object(
+            column, index=False, categorize=False
+        )
+    except (TypeError, ValueError):
+        return pickle.dumps(column.tolist())
+    return hashes.to_numpy().tobytes()
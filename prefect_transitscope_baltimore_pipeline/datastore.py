@@ -0,0 +1,184 @@
+"""References to DataFrames stored as Arrow files, for passing between tasks"""
+import functools
+import os
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from prefect_transitscope_baltimore_pipeline.caching import (
+    TRANSFORM_CACHE_EXPIRATION,
+    fingerprint,
+)
+
+# Where DataFrames passed between tasks are stored
+DATA_STORE_DIR = Path("data/store")
+
+
+class DataHandle:
+    """
+    A reference to a DataFrame or GeoDataFrame stored in the local data
+    store as an uncompressed Arrow IPC file.
+
+    Passing handles between tasks instead of frames keeps orchestration
+    cheap however large the data grows: a handle pickles to a few hundred
+    bytes, and its fingerprint, which is the frame's content hash, is its
+    cache key. Files are named by that fingerprint, so storing the same
+    frame twice writes it once. Frames are read lazily, memory-mapped, when
+    a task calls `load`.
+
+    Examples:
+        >>> handle = DataHandle.from_frame(bus_ridership_data)
+        >>> handle
+        DataHandle(rows=13542, fingerprint='5f0c…')
+        >>> handle.load(columns=["route", "ridership"])
+    """
+
+    def __init__(self, path, fingerprint, rows, geo=False):
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.rows = rows
+        self.geo = geo
+
+    @classmethod
+    def from_frame(cls, frame, store_dir=None):
+        """
+        Stores a frame and returns a handle to it.
+
+        Parameters:
+            frame (DataFrame or GeoDataFrame): The frame to store.
+            store_dir (str or Path, optional): The store directory. Defaults to `DATA_STORE_DIR`.
+
+        Returns:
+            DataHandle: The handle.
+        """
+        digest = fingerprint(frame)
+        geo = isinstance(frame, gpd.GeoDataFrame)
+        path = Path(store_dir or DATA_STORE_DIR) / f"{digest}.arrow"
+        if path.exists():
+            # Refresh the file's age so pruning keeps it
+            path.touch()
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_name(
+                f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            )
+            if geo:
+                frame.to_feather(temporary, compression="uncompressed")
+            else:
+                feather.write_feather(
+                    pa.Table.from_pandas(frame),
+                    temporary,
+                    compression="uncompressed",
+                )
+            os.replace(temporary, path)
+        return cls(path, digest, len(frame), geo)
+
+    def load(self, columns=None):
+        """
+        Reads the frame, memory-mapping the file.
+
+        Parameters:
+            columns (list, optional): Read only these columns.
+
+        Returns:
+            DataFrame or GeoDataFrame: The stored frame.
+        """
+        if self.geo:
+            return gpd.read_feather(
+                self.path, columns=columns, memory_map=True
+            )
+        return feather.read_table(
+            self.path, columns=columns, memory_map=True
+        ).to_pandas()
+
+    def __len__(self):
+        return self.rows
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, DataHandle)
+            and self.fingerprint == other.fingerprint
+        )
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(rows={self.rows}, "
+            f"fingerprint={self.fingerprint[:8]!r})"
+        )
+
+
+def load_frame(value):
+    """
+    Returns the frame a value refers to: the loaded frame for a
+    `DataHandle`, or the value itself otherwise.
+    """
+    return value.load() if isinstance(value, DataHandle) else value
+
+
+def accepts_handles(fn):
+    """
+    Lets a function taking frames take `DataHandle`s instead.
+
+    Handle arguments are loaded before the call, and if any argument was a
+    handle, a frame result is stored and returned as a handle, so the
+    function returns the same kind of value it was given.
+
+    Parameters:
+        fn (callable): A function taking and returning frames.
+
+    Returns:
+        callable: The wrapped function.
+    """
+    if getattr(fn, "accepts_handles", False):
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        given_handle = any(
+            isinstance(value, DataHandle)
+            for value in [*args, *kwargs.values()]
+        )
+        result = fn(
+            *map(load_frame, args),
+            **{name: load_frame(value) for name, value in kwargs.items()},
+        )
+        if given_handle and isinstance(result, pd.DataFrame):
+            return DataHandle.from_frame(result)
+        return result
+
+    wrapper.accepts_handles = True
+    return wrapper
+
+
+def prune_data_store(max_age=None, store_dir=None):
+    """
+    Deletes stored frames not written or reused within `max_age`.
+
+    Parameters:
+        max_age (timedelta, optional): How long to keep unused frames. Defaults to a day longer than `TRANSFORM_CACHE_EXPIRATION`, which keeps every frame a cached task result may still refer to.
+        store_dir (str or Path, optional): The store directory. Defaults to `DATA_STORE_DIR`.
+
+    Returns:
+        int: The number of files deleted.
+    """
+    store_dir = Path(store_dir or DATA_STORE_DIR)
+    if not store_dir.exists():
+        return 0
+    max_age = max_age or TRANSFORM_CACHE_EXPIRATION + timedelta(days=1)
+    cutoff = time.time() - max_age.total_seconds()
+    deleted = 0
+    for path in store_dir.glob("*.arrow"):
+        if path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            deleted += 1
+    print(f"Pruned {deleted} frames from the data store")
+    return deleted
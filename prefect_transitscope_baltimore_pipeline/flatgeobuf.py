@@ -0,0 +1,67 @@
+"""FlatGeobuf export with a packed Hilbert R-tree spatial index"""
+import os
+from pathlib import Path
+
+import geopandas as gpd
+
+
+def write_flatgeobuf(frame, path, quiet=False):
+    """
+    Writes a GeoDataFrame to a FlatGeobuf file with a spatial index.
+
+    FlatGeobuf stores features sorted along a Hilbert curve, after a packed
+    R-tree of their bounding boxes at the start of the file. A bounding box
+    read walks the index and fetches only the matching features, which over
+    HTTP, for example from S3, takes a few range requests instead of
+    downloading the whole file.
+
+    The file is written to a temporary name and renamed into place, so a
+    reader never sees a partial file.
+
+    Parameters:
+        frame (GeoDataFrame): The data.
+        path (str or Path): The file to write.
+        quiet (bool): Do not print the file size.
+
+    Returns:
+        int: The size of the file in bytes.
+
+    Examples:
+        >>> write_flatgeobuf(stops, "data/mta_bus_stops.fgb")
+        Wrote data/mta_bus_stops.fgb: 1,021,448 bytes
+    """
+    path = Path(path)
+    temporary = path.with_name(f".{path.stem}.{os.getpid()}.tmp.fgb")
+    frame.to_file(
+        temporary,
+        driver="FlatGeobuf",
+        engine="pyogrio",
+        index=False,
+        SPATIAL_INDEX="YES",
+    )
+    os.replace(temporary, path)
+    size = path.stat().st_size
+    if not quiet:
+        print(f"Wrote {path}: {size:,} bytes")
+    return size
+
+
+def read_flatgeobuf(source, bbox=None, columns=None):
+    """
+    Reads a FlatGeobuf file, or only the features in a bounding box.
+
+    Parameters:
+        source (str or Path): A file path, or an http(s) URL read with range requests.
+        bbox (tuple, optional): The (minx, miny, maxx, maxy) bounding box to read, in the file's CRS.
+        columns (list, optional): Read only these columns, besides the geometry.
+
+    Returns:
+        GeoDataFrame: The features.
+
+    Examples:
+        >>> read_flatgeobuf(
+        ...     "https://transitscope-baltimore.s3.amazonaws.com/data/mta_bus_stops.fgb",
+        ...     bbox=(-76.63, 39.28, -76.60, 39.30),
+        ... )
+    """
+    return gpd.read_file(source, bbox=bbox, columns=columns, engine="pyogrio")
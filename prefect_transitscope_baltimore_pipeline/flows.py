@@ -1,28 +1,91 @@
 """This is an example flows module"""
 import asyncio
+import time
 from pathlib import Path
 
 import boto3
+import geopandas as gpd
 from prefect import flow
 from prefect.blocks.system import Secret
+from prefect.states import Completed
 
+from prefect_transitscope_baltimore_pipeline.arcgis import (
+    MD_TRANSIT_BUS_STOPS_URL,
+    FeatureLayer,
+)
+from prefect_transitscope_baltimore_pipeline.datastore import (
+    DataHandle,
+    load_frame,
+    prune_data_store,
+)
+from prefect_transitscope_baltimore_pipeline.flatgeobuf import (
+    write_flatgeobuf,
+)
+from prefect_transitscope_baltimore_pipeline.http_client import (
+    prune_http_cache,
+)
+from prefect_transitscope_baltimore_pipeline.manifest import (
+    MANIFEST_PATH,
+    describe_stream,
+    update_manifest,
+)
+from prefect_transitscope_baltimore_pipeline.parquet_profiles import (
+    write_parquet,
+)
+from prefect_transitscope_baltimore_pipeline.partitioned_dataset import (
+    MTA_BUS_RIDERSHIP_DATASET_PATH,
+    compact_partitioned_dataset,
+    write_partitioned_dataset,
+)
+from prefect_transitscope_baltimore_pipeline.rollups import (
+    MTA_BUS_RIDERSHIP_ROLLUPS_PATH,
+    ROLLUP_FILES,
+    update_ridership_rollups,
+)
+from prefect_transitscope_baltimore_pipeline.serializers import (
+    RESULT_SERIALIZER,
+)
 from prefect_transitscope_baltimore_pipeline.tasks import (
+    apply_mta_bus_stop_changes,
     calculate_days_and_daily_ridership,
     convert_date_and_calculate_end_of_month,
+    create_stop_route_bridge,
+    download_mta_bus_stop_object_ids,
+    download_mta_bus_stop_object_ids_async,
     download_mta_bus_stops,
+    download_mta_bus_stops_async,
     exclude_zero_ridership,
     format_bus_routes_task,
+    layer_is_unchanged,
+    read_layer_state,
     scrape,
     standardize_column_names_task,
     transform_mta_bus_stops,
+    write_layer_state,
+)
+from prefect_transitscope_baltimore_pipeline.uploads import (
+    TRANSITSCOPE_BUCKET,
+    client_config,
+    read_published_manifest,
+    stream_parquet_to_s3,
+    upload_files_if_changed,
 )
+from prefect_transitscope_baltimore_pipeline.warehouse import load_table
 
+MTA_BUS_STOPS_PATH = "data/mta_bus_stops.parquet"
+MTA_BUS_STOP_ROUTES_PATH = "data/mta_bus_stop_routes.parquet"
+MTA_BUS_STOPS_FLATGEOBUF_PATH = "data/mta_bus_stops.fgb"
+# The single ridership file published before the partitioned dataset
+LEGACY_MTA_BUS_RIDERSHIP_KEY = "data/mta_bus_ridership.parquet"
 
-@flow
-async def scrape_and_transform_bus_route_ridership():
+
+@flow(result_serializer=RESULT_SERIALIZER)
+async def scrape_and_transform_bus_route_ridership(
+    parquet_profile=None, load_warehouse=True
+):
     """
     This is an asynchronous function that scrapes bus ridership data,
-    transforms it, and writes it to a parquet file.
+    transforms it, and writes it to a partitioned parquet dataset.
 
     The function performs the following steps:
     1. Scrapes the data
@@ -31,13 +94,27 @@ async def scrape_and_transform_bus_route_ridership():
     4. Converts the date and calculates the end of the month
     5. Excludes zero ridership
     6. Calculates the days and daily ridership
-    7. Writes the transformed data to a parquet file
+    7. Writes the months whose data changed to the partitioned parquet
+       dataset in `data/mta_bus_ridership`
+    8. Recomputes the systemwide monthly and per-route annual rollups in
+       `data/mta_bus_ridership_rollups` for the months that changed
+    9. Records the dataset and rollup files in the manifest,
+       `data/manifest.json`
+    10. Upserts the data into the `mta_bus_ridership` table of the DuckDB
+        warehouse, keyed on route and date
+
+    Parameters:
+        parquet_profile (str, optional): The name of the parquet output
+            profile to write with; see `parquet_profiles.PARQUET_PROFILES`.
+            Defaults to `DEFAULT_PARQUET_PROFILE`.
+        load_warehouse (bool): Load the data into the DuckDB warehouse.
 
     Returns:
         DataFrame: The transformed bus ridership data.
     """
     # Executing the main function
-    bus_ridership_data = await scrape()
+    # The transforms pass the data by reference through the data store
+    bus_ridership_data = DataHandle.from_frame(await scrape())
     bus_ridership_data = standardize_column_names_task(bus_ridership_data)
     bus_ridership_data = format_bus_routes_task(bus_ridership_data)
     bus_ridership_data = convert_date_and_calculate_end_of_month(
@@ -45,15 +122,26 @@ async def scrape_and_transform_bus_route_ridership():
     )
     bus_ridership_data = exclude_zero_ridership(bus_ridership_data)
     bus_ridership_data = calculate_days_and_daily_ridership(bus_ridership_data)
+    bus_ridership_data = load_frame(bus_ridership_data)
     print(bus_ridership_data.head())
 
-    # Write parquet file to local directory
-    bus_ridership_data.to_parquet("data/mta_bus_ridership.parquet")
+    # Write the changed months to the local partitioned dataset. Unlike the
+    # bus stops files, these are not streamed to S3: the partition writer
+    # and the rollups read the previous local files to find what changed.
+    write_partitioned_dataset(
+        bus_ridership_data,
+        MTA_BUS_RIDERSHIP_DATASET_PATH,
+        profile=parquet_profile,
+    )
+    update_ridership_rollups(bus_ridership_data, profile=parquet_profile)
+    record_mta_bus_ridership_outputs()
+    if load_warehouse:
+        load_table(bus_ridership_data, "mta_bus_ridership")
     return bus_ridership_data
 
 
 @flow
-async def upload_mta_bus_ridership_to_s3():
+async def upload_mta_bus_ridership_to_s3(upload_manifest=True):
     """
     This is an asynchronous function that uploads the MTA bus ridership data to an S3 bucket.
 
@@ -61,10 +149,26 @@ async def upload_mta_bus_ridership_to_s3():
     1. Loads the AWS access key ID and secret access key from secrets
     2. Creates a session with AWS using the loaded credentials
     3. Creates an S3 resource object using the session
-    4. Uploads the MTA bus ridership data (in parquet format) to the specified S3 bucket
+    4. Uploads the MTA bus ridership dataset's partition files and the ridership
+       rollup files to the specified S3 bucket in parallel, skipping the files whose
+       content hash matches the one stored with the object
+    5. Uploads the manifest once the files it describes are in the bucket
+    6. Deletes the files the published manifest lists but the local one no
+       longer does, such as months merged by compaction, and the single
+       ridership file published before the partitioned dataset
+
+    Deletions are based on the manifest, never on a listing of the bucket,
+    so objects the local machine never wrote are left alone. If the local
+    dataset is empty, for example on a fresh worker or after a failed
+    write, nothing is deleted.
+
+    Parameters:
+        upload_manifest (bool): Upload the manifest, which also describes
+            the bus stops files. Off when the caller uploads it once every
+            upload is done; see `upload_manifest_to_s3`.
 
     Returns:
-        None
+        dict: The number of files and bytes uploaded and skipped.
     """
     aws_access_key_id_block = await Secret.load("aws-access-key-id")
     # Access the stored secret
@@ -78,89 +182,661 @@ async def upload_mta_bus_ridership_to_s3():
         aws_secret_access_key=aws_secret_access_key,
     )
 
-    s3 = session.resource("s3")
-    path = Path("data/mta_bus_ridership.parquet")
-    # Upload the parquet file to the S3 bucket
-    s3.meta.client.upload_file(
-        Filename=str(path),
-        Bucket="transitscope-baltimore",
-        Key="data/mta_bus_ridership.parquet",
+    s3 = session.resource("s3", config=client_config())
+    bucket = s3.Bucket(TRANSITSCOPE_BUCKET)
+    prefix = MTA_BUS_RIDERSHIP_DATASET_PATH.as_posix()
+    paths = sorted(MTA_BUS_RIDERSHIP_DATASET_PATH.glob("*/*/*.parquet"))
+    keys = {path.as_posix() for path in paths}
+    # Read before this upload replaces it
+    published = read_published_manifest(
+        s3.meta.client, MANIFEST_PATH.as_posix()
     )
+    # Upload the partition files and the rollup files whose content changed
+    # in parallel, then the manifest describing them. A manifest without
+    # the dataset must not replace the published one.
+    upload_manifest = upload_manifest and paths and MANIFEST_PATH.exists()
+    summary = upload_files_if_changed(
+        s3.meta.client,
+        [*paths, *sorted(MTA_BUS_RIDERSHIP_ROLLUPS_PATH.glob("*.parquet"))],
+        last=[MANIFEST_PATH] if upload_manifest else [],
+    )
+    if not paths:
+        print(f"No local files in {prefix}; not deleting any published files")
+        return summary
+    # Delete the files that compaction or a replaced partition removed
+    # since the last upload
+    removed = sorted(
+        key
+        for key in published
+        if key.startswith(f"{prefix}/") and key not in keys
+    )
+    for key in removed:
+        bucket.Object(key).delete()
+    if removed:
+        print(f"Deleted {len(removed)} files no longer in {prefix}")
+    # Consumers read the partitioned dataset now, so a stale copy of the
+    # old single file must not linger next to it
+    bucket.Object(LEGACY_MTA_BUS_RIDERSHIP_KEY).delete()
+    return summary
 
 
 @flow
-def mta_bus_stops_flow():
+def compact_mta_bus_ridership_dataset(min_files=2, parquet_profile=None):
     """
-    This is an asynchronous function that uploads the MTA bus ridership data to an S3 bucket.
+    This is a function that merges the files appended to each month of the
+    MTA bus ridership dataset into one file per month.
+
+    Parameters:
+        min_files (int): Compact months with at least this many files.
+        parquet_profile (str, optional): The name of the parquet output
+            profile to write with. Defaults to `DEFAULT_PARQUET_PROFILE`.
+
+    Returns:
+        int: The number of months compacted.
+    """
+    compacted = compact_partitioned_dataset(
+        MTA_BUS_RIDERSHIP_DATASET_PATH,
+        min_files=min_files,
+        profile=parquet_profile,
+    )
+    record_mta_bus_ridership_outputs()
+    return compacted
+
+
+def record_mta_bus_ridership_outputs():
+    """
+    Records the MTA bus ridership dataset's files and the ridership rollups
+    in the manifest, and drops the entries of deleted dataset files.
+
+    Returns:
+        list: The recorded files whose content changed.
+    """
+    changed = update_manifest(
+        sorted(MTA_BUS_RIDERSHIP_DATASET_PATH.glob("*/*/*.parquet")),
+        date_column="date",
+        root=MTA_BUS_RIDERSHIP_DATASET_PATH,
+    )
+    rollups = [
+        MTA_BUS_RIDERSHIP_ROLLUPS_PATH / file for file in ROLLUP_FILES.values()
+    ]
+    return changed + update_manifest(
+        [path for path in rollups if path.exists()], date_column="date"
+    )
+
+
+@flow(result_serializer=RESULT_SERIALIZER)
+def mta_bus_stops_flow(
+    layer_url=MD_TRANSIT_BUS_STOPS_URL,
+    force_download=False,
+    incremental=True,
+    parquet_profile=None,
+    export_flatgeobuf=False,
+    load_warehouse=True,
+    stream_to_s3=False,
+    keep_local_copy=True,
+):
+    """
+    This is a function that downloads the MTA bus stops data, transforms it,
+    and writes it to parquet files.
 
     The function performs the following steps:
-    1. Loads the AWS access key ID and secret access key from secrets
-    2. Creates a session with AWS using the loaded credentials
-    3. Creates an S3 resource object using the session
-    4. Uploads the MTA bus ridership data (in parquet format) to the specified S3 bucket
+    1. Checks the layer's last edit date against the last successful run,
+       and stops early if the layer is unchanged
+    2. Downloads the MTA bus stops data, or only the stops edited since the
+       last successful run if the stops written by that run are available
+    3. Transforms the MTA bus stops data, applies it to the stored stops
+       along with any deletions, and writes it to a parquet file
+    4. Builds the normalized stop-route bridge table and writes it to a
+       parquet file; with `stream_to_s3`, both parquet files are streamed to
+       the S3 bucket as they are written
+    5. Records the local files written in the manifest, `data/manifest.json`
+    6. Loads the stops and the bridge table into the DuckDB warehouse,
+       keyed on stop ID and on stop ID and route
+    7. Records the layer's last edit date for the next run
+
+    Parameters:
+        layer_url (str): The URL of the FeatureServer layer holding the bus stops.
+        force_download (bool): Download every stop even if the layer is unchanged.
+        incremental (bool): Download only the stops edited since the last run
+            when possible.
+        parquet_profile (str, optional): The name of the parquet output
+            profile to write with. Defaults to `DEFAULT_PARQUET_PROFILE`.
+        export_flatgeobuf (bool): Also write the stops to a FlatGeobuf file
+            with a spatial index, for bounding box reads over HTTP. Otherwise
+            the file from an earlier run is deleted.
+        load_warehouse (bool): Load the stops and the bridge table into the
+            DuckDB warehouse.
+        stream_to_s3 (bool): Stream the stops and the bridge table parquet
+            files straight to the S3 bucket as they are written.
+        keep_local_copy (bool): When streaming to S3, also write the parquet
+            files to local disk. Without them, every run downloads every stop.
 
     Returns:
-        None
+        GeoDataFrame: The transformed MTA bus stops data, or None if the layer
+        is unchanged since the last run, in which case the flow run finishes in
+        a "Skipped" state.
     """
+    layer, last_edit_date, edited_since = get_mta_bus_stops_download_window(
+        layer_url, force_download, incremental
+    )
+
     # First task to download MTA bus stops data
-    stops = download_mta_bus_stops()
+    stops = download_mta_bus_stops(
+        layer_url,
+        last_edit_date=last_edit_date,
+        edited_since=edited_since,
+        metadata=layer.metadata(),
+    )
+    if stops is None:
+        return Completed(
+            name="Skipped", message="MTA bus stops layer is unchanged."
+        )
+    object_ids = None
+    if edited_since is not None:
+        object_ids = download_mta_bus_stop_object_ids(layer_url)
+    s3_client = None
+    if stream_to_s3:
+        s3_client = create_s3_client(
+            Secret.load("aws-access-key-id").get(),
+            Secret.load("aws-secret-access-key").get(),
+        )
+    return write_mta_bus_stops(
+        layer_url,
+        stops,
+        layer.last_edit_date,
+        object_ids,
+        parquet_profile,
+        export_flatgeobuf,
+        load_warehouse,
+        s3_client,
+        keep_local_copy,
+    )
+
+
+@flow(result_serializer=RESULT_SERIALIZER)
+async def mta_bus_stops_flow_async(
+    layer_url=MD_TRANSIT_BUS_STOPS_URL,
+    force_download=False,
+    incremental=True,
+    parquet_profile=None,
+    export_flatgeobuf=False,
+    load_warehouse=True,
+    stream_to_s3=False,
+    keep_local_copy=True,
+):
+    """
+    Asynchronous version of `mta_bus_stops_flow`.
+
+    The downloads, and the transform and writes that follow them, run in
+    worker threads, so this flow can share an event loop with the ridership
+    scrape. For an incremental download the edited stops are requested at
+    the same time as the object IDs used to detect deletions.
+
+    Parameters:
+        layer_url (str): The URL of the FeatureServer layer holding the bus stops.
+        force_download (bool): Download every stop even if the layer is unchanged.
+        incremental (bool): Download only the stops edited since the last run
+            when possible.
+        parquet_profile (str, optional): The name of the parquet output
+            profile to write with. Defaults to `DEFAULT_PARQUET_PROFILE`.
+        export_flatgeobuf (bool): Also write the stops to a FlatGeobuf file
+            with a spatial index, for bounding box reads over HTTP. Otherwise
+            the file from an earlier run is deleted.
+        load_warehouse (bool): Load the stops and the bridge table into the
+            DuckDB warehouse.
+        stream_to_s3 (bool): Stream the stops and the bridge table parquet
+            files straight to the S3 bucket as they are written.
+        keep_local_copy (bool): When streaming to S3, also write the parquet
+            files to local disk. Without them, every run downloads every stop.
+
+    Returns:
+        GeoDataFrame: The transformed MTA bus stops data, or None if the layer
+        is unchanged since the last run, in which case the flow run finishes in
+        a "Skipped" state.
+    """
+    window = await asyncio.to_thread(
+        get_mta_bus_stops_download_window,
+        layer_url,
+        force_download,
+        incremental,
+    )
+    layer, last_edit_date, edited_since = window
+    # The metadata already tells an unchanged layer apart, so such a run
+    # sends no query beyond the metadata request
+    if layer_is_unchanged(layer, last_edit_date):
+        return Completed(
+            name="Skipped", message="MTA bus stops layer is unchanged."
+        )
+
+    download = download_mta_bus_stops_async(
+        layer_url,
+        last_edit_date=last_edit_date,
+        edited_since=edited_since,
+        metadata=layer.metadata(),
+    )
+    object_ids = None
+    if edited_since is not None:
+        stops, object_ids = await asyncio.gather(
+            download, download_mta_bus_stop_object_ids_async(layer_url)
+        )
+    else:
+        stops = await download
+    if stops is None:
+        return Completed(
+            name="Skipped", message="MTA bus stops layer is unchanged."
+        )
+    s3_client = None
+    if stream_to_s3:
+        aws_access_key_id_block = await Secret.load("aws-access-key-id")
+        aws_secret_access_key_block = await Secret.load(
+            "aws-secret-access-key"
+        )
+        s3_client = create_s3_client(
+            aws_access_key_id_block.get(), aws_secret_access_key_block.get()
+        )
+    # Transforming and writing the stops would otherwise block the event
+    # loop shared with the ridership scrape
+    return await asyncio.to_thread(
+        write_mta_bus_stops,
+        layer_url,
+        stops,
+        layer.last_edit_date,
+        object_ids,
+        parquet_profile,
+        export_flatgeobuf,
+        load_warehouse,
+        s3_client,
+        keep_local_copy,
+    )
+
+
+def create_s3_client(aws_access_key_id, aws_secret_access_key):
+    """
+    Creates an S3 client with the given AWS credentials, with a connection
+    pool sized for `upload_files_if_changed`.
+
+    Parameters:
+        aws_access_key_id (str): The AWS access key ID.
+        aws_secret_access_key (str): The AWS secret access key.
+
+    Returns:
+        botocore.client.S3: The client.
+    """
+    session = boto3.Session(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+    )
+    return session.client("s3", config=client_config())
+
+
+def get_mta_bus_stops_download_window(layer_url, force_download, incremental):
+    """
+    Fetches the layer metadata and decides what an MTA bus stops run
+    downloads from it and the last run's state.
+
+    Parameters:
+        layer_url (str): The URL of the FeatureServer layer holding the bus stops.
+        force_download (bool): Download every stop even if the layer is unchanged.
+        incremental (bool): Download only the stops edited since the last run
+            when possible.
+
+    Returns:
+        tuple: The `FeatureLayer`, with its metadata fetched, whose
+        `last_edit_date` is the run's watermark; the layer's last edit date
+        as of the last run, used to skip an unchanged layer; and the time to
+        download edits after, each None if it does not apply.
+    """
+    layer = FeatureLayer(layer_url)
+    layer.metadata(errors="ignore")
+    state = read_layer_state()
+    last_edit_date = None
+    if not force_download and state.get("layer_url") == layer_url:
+        last_edit_date = state.get("last_edit_date")
+    edited_since = None
+    if (
+        incremental
+        and last_edit_date is not None
+        and Path(MTA_BUS_STOPS_PATH).exists()
+    ):
+        edited_since = last_edit_date
+    return layer, last_edit_date, edited_since
+
+
+def write_mta_bus_stops(
+    layer_url,
+    stops,
+    layer_last_edit_date=None,
+    object_ids=None,
+    parquet_profile=None,
+    export_flatgeobuf=False,
+    load_warehouse=True,
+    s3_client=None,
+    keep_local_copy=True,
+):
+    """
+    Transforms downloaded MTA bus stops data, writes it and its stop-route
+    bridge table to parquet files, or streams them to S3, and to the DuckDB
+    warehouse, and optionally the stops to a FlatGeobuf file, records the
+    files or streamed objects in the manifest, and records the layer's last
+    edit date.
+
+    Parameters:
+        layer_url (str): The URL of the FeatureServer layer holding the bus stops.
+        stops (GeoDataFrame): The downloaded MTA bus stops data.
+        layer_last_edit_date (Timestamp, optional): The layer's last edit
+            date as of the download, from its metadata, recorded for the
+            next run. Taken from the metadata rather than the stops, so a
+            run that only deleted stops still advances it.
+        object_ids (list, optional): The object IDs of every stop in the layer.
+            If given, `stops` holds only the edited stops, which are applied
+            to the stored stops along with any deletions.
+        parquet_profile (str, optional): The name of the parquet output
+            profile to write with. Defaults to `DEFAULT_PARQUET_PROFILE`.
+        export_flatgeobuf (bool): Also write the stops to
+            `MTA_BUS_STOPS_FLATGEOBUF_PATH`. Otherwise the file from an
+            earlier run is deleted, so stale stops are not uploaded.
+        load_warehouse (bool): Load the stops and the bridge table into the
+            DuckDB warehouse, replacing the stops no longer in the layer.
+        s3_client (botocore.client.S3, optional): Stream the parquet files
+            to `TRANSITSCOPE_BUCKET` with this client, at keys matching their
+            paths, instead of only writing them to local disk.
+        keep_local_copy (bool): When streaming, also write the parquet files
+            to local disk. Otherwise any local copies from earlier runs are
+            deleted, so they are not uploaded over the streamed objects.
+
+    Returns:
+        GeoDataFrame: The transformed MTA bus stops data.
+    """
+    # The download time differs on every run, so it is stamped after the
+    # transforms, whose cached results would otherwise never be reused
+    download_date = None
+    if "download_date" in stops and len(stops):
+        download_date = stops["download_date"].max()
+        stops = stops.drop(columns="download_date")
+
+    # Second task to transform the MTA bus stops data, passed by reference
+    # through the data store
+    transformed_stops = DataHandle.from_frame(stops)
+    if len(stops):
+        transformed_stops = transform_mta_bus_stops(transformed_stops)
+    if object_ids is not None:
+        # Apply the edits and deletions to the stops from the last run
+        transformed_stops = apply_mta_bus_stop_changes(
+            gpd.read_parquet(MTA_BUS_STOPS_PATH), transformed_stops, object_ids
+        )
+
+    # Third task to build the normalized stop-route bridge table
+    stop_routes = create_stop_route_bridge(transformed_stops)
+    transformed_stops = load_frame(transformed_stops)
+    if download_date is not None:
+        # Stops carried over from the last run keep their download date
+        if "download_date" in transformed_stops:
+            transformed_stops["download_date"] = transformed_stops[
+                "download_date"
+            ].fillna(download_date)
+        else:
+            transformed_stops["download_date"] = download_date
+    tables = [
+        (transformed_stops, MTA_BUS_STOPS_PATH, None),
+        (load_frame(stop_routes), MTA_BUS_STOP_ROUTES_PATH, False),
+    ]
+    streamed = {}
+    for frame, path, index in tables:
+        if s3_client is None:
+            write_parquet(frame, path, parquet_profile, index=index)
+        else:
+            report = stream_parquet_to_s3(
+                frame,
+                s3_client,
+                path,
+                profile=parquet_profile,
+                index=index,
+                local_copy=path if keep_local_copy else None,
+            )
+            if not keep_local_copy:
+                Path(path).unlink(missing_ok=True)
+                streamed[path] = describe_stream(
+                    report, frame, date_column="download_date"
+                )
+    if export_flatgeobuf:
+        write_flatgeobuf(transformed_stops, MTA_BUS_STOPS_FLATGEOBUF_PATH)
+    else:
+        Path(MTA_BUS_STOPS_FLATGEOBUF_PATH).unlink(missing_ok=True)
+    outputs = [MTA_BUS_STOPS_PATH, MTA_BUS_STOP_ROUTES_PATH]
+    if export_flatgeobuf:
+        outputs.append(MTA_BUS_STOPS_FLATGEOBUF_PATH)
+    # Deleted files, such as a FlatGeobuf export that was turned off, drop
+    # out of the manifest. Files streamed without a local copy are recorded
+    # from their stream reports
+    update_manifest(
+        [path for path in outputs if Path(path).exists()],
+        date_column="download_date",
+        root=Path(MTA_BUS_STOPS_PATH).parent,
+        streamed=streamed,
+    )
+    if load_warehouse:
+        load_table(transformed_stops, "mta_bus_stops", delete_missing=True)
+        load_table(
+            load_frame(stop_routes),
+            "mta_bus_stop_routes",
+            delete_missing=True,
+        )
 
-    # Second task to transform the MTA bus stops data
-    transformed_stops = transform_mta_bus_stops(stops)
-    transformed_stops.to_parquet("data/mta_bus_stops.parquet")
+    # Without a reported edit date, the next run downloads again
+    if layer_last_edit_date is not None:
+        state = read_layer_state()
+        if state.get("layer_url") != layer_url:
+            state = {}
+        # The uploaded date is left behind until the upload succeeds
+        write_layer_state(
+            {
+                **state,
+                "layer_url": layer_url,
+                "last_edit_date": layer_last_edit_date.isoformat(),
+            }
+        )
     print("MTA bus stops data processing complete.")
     return transformed_stops
 
 
 @flow
-async def upload_mta_bus_stops_to_s3():
+async def upload_mta_bus_stops_to_s3(upload_manifest=True):
     """
-    Asynchronous function to upload MTA bus stops data to an S3 bucket.
+    Asynchronous function to upload MTA bus stops data and the stop-route
+    bridge table to an S3 bucket in parallel, along with the FlatGeobuf export
+    of the stops if there is one, skipping the files whose content hash
+    matches the one stored with the object, and then the manifest.
+
+    Once the upload succeeds, the layer's last edit date that the uploaded
+    stops reflect is recorded as uploaded in the layer state; see
+    `mta_bus_stops_upload_pending`.
+
+    Parameters:
+        upload_manifest (bool): Upload the manifest, which also describes
+            the ridership files. Off when the caller uploads it once every
+            upload is done; see `upload_manifest_to_s3`.
+
+    Returns:
+        dict: The number of files and bytes uploaded and skipped.
     """
-    aws_access_key_id = await Secret.load("aws-access-key-id").get()
-    aws_secret_access_key = await Secret.load("aws-secret-access-key").get()
+    state = read_layer_state()
+    aws_access_key_id_block = await Secret.load("aws-access-key-id")
+    aws_access_key_id = aws_access_key_id_block.get()
+    aws_secret_access_key_block = await Secret.load("aws-secret-access-key")
+    aws_secret_access_key = aws_secret_access_key_block.get()
 
     session = boto3.Session(
         aws_access_key_id=aws_access_key_id,
         aws_secret_access_key=aws_secret_access_key,
     )
 
-    s3 = session.resource("s3")
-    path = Path("data/mta_bus_stops.parquet")
-    s3.meta.client.upload_file(
-        Filename=path,
-        Bucket="transitscope-baltimore",
-        Key="data/mta_bus_stops.parquet",
+    s3 = session.resource("s3", config=client_config())
+    # The FlatGeobuf file is written only when the bus stops flow is asked
+    # to export it, and the parquet files are not when they are streamed to
+    # the bucket without a local copy
+    paths = [
+        path
+        for path in map(
+            Path,
+            [
+                MTA_BUS_STOPS_PATH,
+                MTA_BUS_STOP_ROUTES_PATH,
+                MTA_BUS_STOPS_FLATGEOBUF_PATH,
+            ],
+        )
+        if path.exists()
+    ]
+    # Upload the files whose content changed in parallel, then the manifest
+    # describing them
+    upload_manifest = upload_manifest and MANIFEST_PATH.exists()
+    summary = upload_files_if_changed(
+        s3.meta.client,
+        paths,
+        last=[MANIFEST_PATH] if upload_manifest else [],
+    )
+    if state.get("last_edit_date") is not None:
+        write_layer_state(
+            {
+                **read_layer_state(),
+                "uploaded_last_edit_date": state["last_edit_date"],
+            }
+        )
+    return summary
+
+
+def mta_bus_stops_upload_pending():
+    """
+    Checks whether the stops written by the last MTA bus stops run are
+    newer than the last ones uploaded to S3, for example because the upload
+    failed, in which case they must be uploaded even if the layer is
+    unchanged since.
+
+    Returns:
+        bool: True if the recorded last edit date has not been uploaded.
+    """
+    state = read_layer_state()
+    return state.get("last_edit_date") != state.get("uploaded_last_edit_date")
+
+
+@flow
+async def upload_manifest_to_s3():
+    """
+    Uploads the manifest, `data/manifest.json`, to the S3 bucket unless the
+    bucket already holds it.
+
+    The manifest describes the files of both datasets, so
+    `run_all_prefect_transitscope_baltimore_pipeline_flows` uploads it
+    once, after both upload flows, rather than letting each concurrent
+    upload publish it while the other's files are still on their way.
+
+    Returns:
+        dict: The number of files and bytes uploaded and skipped.
+    """
+    aws_access_key_id_block = await Secret.load("aws-access-key-id")
+    aws_secret_access_key_block = await Secret.load("aws-secret-access-key")
+    s3_client = create_s3_client(
+        aws_access_key_id_block.get(), aws_secret_access_key_block.get()
+    )
+    return upload_files_if_changed(
+        s3_client, [MANIFEST_PATH] if MANIFEST_PATH.exists() else []
     )
 
 
 @flow
-async def run_all_prefect_transitscope_baltimore_pipeline_flows():
+async def run_all_prefect_transitscope_baltimore_pipeline_flows(
+    max_concurrency=2, layer_url=MD_TRANSIT_BUS_STOPS_URL
+):
     """
     This is an asynchronous function that runs all the flows in the module.
 
-    The function performs the following steps:
-    1. Runs the scrape_and_transform_bus_route_ridership flow
-    2. Runs the upload_mta_bus_ridership_to_s3 flow
-    3. Runs the mta_bus_stops_flow flow
-    4. Runs the upload_mta_bus_stops_to_s3 flow
+    The flows form two independent branches, which run concurrently:
+    1. The ridership branch runs the scrape_and_transform_bus_route_ridership
+       flow, then the upload_mta_bus_ridership_to_s3 flow
+    2. The bus stops branch runs the mta_bus_stops_flow_async flow, then the
+       upload_mta_bus_stops_to_s3 flow, if the bus stops changed or the
+       last upload of them did not succeed
+
+    The run takes about as long as the slower branch, which is reported as
+    the critical path along with each branch's duration. Once both branches
+    succeed, the upload_manifest_to_s3 flow uploads the manifest
+    describing the files of both.
+
+    If a branch fails, the other runs to completion, since its outputs do
+    not depend on the failed one. The data store and the HTTP cache are
+    pruned either way, and the first failure is then raised. The manifest
+    is not uploaded then, so the published one never describes files that
+    did not reach the bucket.
+
+    Parameters:
+        max_concurrency (int): The most branches to run at once; 1 runs them one after the other.
+        layer_url (str): The URL of the FeatureServer layer holding the bus stops.
 
     Returns:
-        None
+        dict: The duration of each branch in seconds.
     """
-    await scrape_and_transform_bus_route_ridership()
-    await upload_mta_bus_ridership_to_s3()
-    mta_bus_stops_flow()
-    await upload_mta_bus_stops_to_s3()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def ridership_branch():
+        await scrape_and_transform_bus_route_ridership()
+        await upload_mta_bus_ridership_to_s3(upload_manifest=False)
+
+    async def bus_stops_branch():
+        stops = await mta_bus_stops_flow_async(layer_url=layer_url)
+        # A skipped run still uploads stops whose last upload failed
+        if stops is not None or mta_bus_stops_upload_pending():
+            await upload_mta_bus_stops_to_s3(upload_manifest=False)
+
+    branches = {"ridership": ridership_branch, "bus stops": bus_stops_branch}
+    results = await asyncio.gather(
+        *(
+            run_branch(name, branch, semaphore)
+            for name, branch in branches.items()
+        ),
+        return_exceptions=True,
+    )
+    prune_data_store()
+    prune_http_cache()
+    failures = [
+        (name, result)
+        for name, result in zip(branches, results)
+        if isinstance(result, BaseException)
+    ]
+    for name, error in failures:
+        print(f"The {name} branch failed: {error!r}")
+    if failures:
+        raise failures[0][1]
+    await upload_manifest_to_s3()
+
+    durations = dict(results)
+    critical_path = max(durations, key=durations.get)
+    print(
+        f"Critical path: {critical_path} branch "
+        f"({durations[critical_path]:.1f}s of "
+        f"{sum(durations.values()):.1f}s total branch time)"
+    )
     print("All flows completed successfully.")
-    return None
-    # return scrape_and_transform_bus_route_ridership()
-    # return upload_mta_bus_ridership_to_s3()
-    # return mta_bus_stops_flow()
+    return durations
+
+
+async def run_branch(name, branch, semaphore):
+    """
+    Runs one branch of flows once a concurrency slot is free, and times it.
+
+    Parameters:
+        name (str): The branch name, used in the report.
+        branch (callable): An async function running the branch's flows in order.
+        semaphore (asyncio.Semaphore): Limits how many branches run at once.
+
+    Returns:
+        tuple: The branch name and its duration in seconds, not counting the wait for a slot.
+    """
+    async with semaphore:
+        start = time.perf_counter()
+        await branch()
+        duration = time.perf_counter() - start
+    print(f"The {name} branch finished in {duration:.1f}s")
+    return name, duration
 
 
 if __name__ == "__main__":
-    asyncio.run(scrape_and_transform_bus_route_ridership())
-    asyncio.run(upload_mta_bus_ridership_to_s3())
-    mta_bus_stops_flow()
-    asyncio.run(upload_mta_bus_stops_to_s3())
+    asyncio.run(run_all_prefect_transitscope_baltimore_pipeline_flows())
@@ -0,0 +1,230 @@
+"""Streaming GeoJSON parsing with bounded memory"""
+import codecs
+import json
+from array import array
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+# Features are collected into columns and converted to a frame this often
+DEFAULT_BATCH_SIZE = 50_000
+
+# Bytes read from a file at a time
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def read_geojson(source, batch_size=DEFAULT_BATCH_SIZE, chunk_size=None):
+    """
+    Reads a GeoJSON FeatureCollection into a GeoDataFrame without holding
+    the whole document in memory.
+
+    Unlike `gpd.read_file`, which keeps the raw text, the parsed dictionary
+    tree and the frame alive at once, this parses one feature at a time
+    into columnar buffers and converts them to a frame every `batch_size`
+    features, so peak memory stays close to the size of the final frame.
+
+    Parameters:
+        source (str, Path, file-like or iterable): A path, a binary or text file, or an iterable of bytes or str chunks such as `requests.Response.iter_content()`.
+        batch_size (int): The number of features buffered before conversion.
+        chunk_size (int, optional): The bytes read at a time from a path or file.
+
+    Returns:
+        GeoDataFrame: The features in EPSG:4326, with the geometry as the last column.
+
+    Examples:
+        >>> stops = read_geojson("data/mta_bus_stops.geojson")
+    """
+    features, _ = parse_feature_collection(
+        _iter_chunks(source, chunk_size or DEFAULT_CHUNK_SIZE), batch_size
+    )
+    return features
+
+
+def parse_feature_collection(chunks, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Parses a GeoJSON FeatureCollection from an iterable of chunks.
+
+    Parameters:
+        chunks (iterable): Bytes (UTF-8) or str chunks of the document.
+        batch_size (int): The number of features buffered before conversion.
+
+    Returns:
+        tuple: The features as a GeoDataFrame, and a dict of the collection's other top-level members, such as 'type' or 'properties'.
+    """
+    reader = _ChunkReader(chunks)
+    builder = _FeatureColumns(batch_size)
+    members = {}
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.advance()
+        return builder.to_geodataframe(), members
+    while True:
+        key = reader.decode_value()
+        reader.expect(":")
+        if key == "features":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.advance()
+            else:
+                while True:
+                    builder.append(reader.decode_value())
+                    if reader.advance() == "]":
+                        break
+        else:
+            members[key] = reader.decode_value()
+        if reader.advance() == "}":
+            break
+    return builder.to_geodataframe(), members
+
+
+def _iter_chunks(source, chunk_size):
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as file:
+            yield from iter(lambda: file.read(chunk_size), b"")
+    elif hasattr(source, "read"):
+        yield from iter(lambda: source.read(chunk_size), source.read(0))
+    else:
+        yield from source
+
+
+class _ChunkReader:
+    """Text decoded from a chunk iterator, consumed from the front."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._exhausted = False
+        self.text = ""
+        self.position = 0
+
+    def fill(self):
+        """Appends the next chunk, dropping consumed text; False at the end."""
+        if self._exhausted:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._exhausted = True
+            chunk = self._utf8.decode(b"", final=True)
+        elif isinstance(chunk, bytes):
+            chunk = self._utf8.decode(chunk)
+        self.text = self.text[self.position :] + chunk
+        self.position = 0
+        return not self._exhausted or bool(chunk)
+
+    def peek(self):
+        """Returns the next non-whitespace character, or '' at the end."""
+        while True:
+            while (
+                self.position < len(self.text)
+                and self.text[self.position] in _WHITESPACE
+            ):
+                self.position += 1
+            if self.position < len(self.text):
+                return self.text[self.position]
+            if not self.fill():
+                return ""
+
+    def advance(self):
+        """Consumes and returns the next non-whitespace character."""
+        char = self.peek()
+        if not char:
+            raise ValueError("Unexpected end of GeoJSON")
+        self.position += 1
+        return char
+
+    def expect(self, expected):
+        char = self.advance()
+        if char != expected:
+            raise ValueError(
+                f"Expected {expected!r} in GeoJSON but found {char!r}"
+            )
+
+    def decode_value(self):
+        """Decodes the next complete JSON value, reading chunks as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.text, self.position)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number may continue in the next chunk
+            if end == len(self.text) and not self._exhausted:
+                self.fill()
+                continue
+            self.position = end
+            return value
+
+
+class _FeatureColumns:
+    """Buffers features column by column and converts them in batches."""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.frames = []
+        self._reset()
+
+    def _reset(self):
+        self.columns = {}
+        self.x = array("d")
+        self.y = array("d")
+        self.other_geometries = {}
+        self.rows = 0
+
+    def append(self, feature):
+        for name, value in (feature.get("properties") or {}).items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = [None] * self.rows
+            column.append(value)
+        self.rows += 1
+        for column in self.columns.values():
+            if len(column) < self.rows:
+                column.append(None)
+
+        geometry = feature.get("geometry")
+        if geometry and geometry.get("type") == "Point":
+            x, y = geometry["coordinates"][:2]
+        else:
+            x = y = np.nan
+            if geometry:
+                self.other_geometries[self.rows - 1] = geometry
+        self.x.append(x)
+        self.y.append(y)
+
+        if self.rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        coordinates = np.column_stack(
+            [np.frombuffer(self.x), np.frombuffer(self.y)]
+        )
+        geometry = shapely.points(coordinates)
+        geometry[np.isnan(coordinates).any(axis=1)] = None
+        for row, other in self.other_geometries.items():
+            geometry[row] = shape(other)
+        frame = pd.DataFrame(self.columns, index=pd.RangeIndex(self.rows))
+        self.frames.append(
+            gpd.GeoDataFrame(frame, geometry=geometry, crs="EPSG:4326")
+        )
+        self._reset()
+
+    def to_geodataframe(self):
+        self.flush()
+        if not self.frames:
+            return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+        frames, self.frames = self.frames, []
+        if len(frames) == 1:
+            return frames[0]
+        return gpd.GeoDataFrame(
+            pd.concat(frames, ignore_index=True), crs="EPSG:4326"
+        )
@@ -0,0 +1,225 @@
+"""Shared HTTP session with connection pooling and an on-disk response cache"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.util.retry import Retry
+
+# Where revalidatable responses are cached between runs
+HTTP_CACHE_DIR = Path("data/http_cache")
+
+# Cached responses not used for this long are pruned
+HTTP_CACHE_MAX_AGE = timedelta(days=30)
+
+# The most bytes of response bodies the cache keeps, least recently used first
+HTTP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Connections kept open per host by the shared session
+DEFAULT_POOL_SIZE = 16
+
+# Headers describing the encoded body, which do not apply to the cached copy
+_BODY_ENCODING_HEADERS = {
+    "content-encoding",
+    "content-length",
+    "transfer-encoding",
+}
+
+_sessions = {}
+
+
+def get_session(cache_dir=None):
+    """
+    Returns the package's shared HTTP session for a cache directory.
+
+    Every download in the package goes through this session, so they share
+    one connection pool with keep-alive and gzip negotiation, and every
+    response with an `ETag` or `Last-Modified` header, other than streamed
+    ones, is cached on disk until `prune_http_cache` evicts it.
+    Repeat requests for a cached URL are sent with `If-None-Match` /
+    `If-Modified-Since`, and a `304 Not Modified` answer is served from
+    the cache.
+
+    Parameters:
+        cache_dir (str or Path, optional): The cache directory. Defaults to `HTTP_CACHE_DIR`.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    cache_dir = Path(cache_dir or HTTP_CACHE_DIR).resolve()
+    session = _sessions.get(cache_dir)
+    if session is None:
+        session = _sessions[cache_dir] = create_session(cache_dir=cache_dir)
+    return session
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, cache_dir=None):
+    """
+    Creates a requests Session with a connection pool sized for concurrent
+    downloads, retries on transient server errors and, optionally, an
+    on-disk cache of revalidatable responses.
+
+    Parameters:
+        pool_size (int): The number of connections to keep open per host.
+        cache_dir (str or Path, optional): Cache responses in this directory.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    session = requests.Session()
+    adapter_options = dict(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    )
+    if cache_dir is None:
+        adapter = HTTPAdapter(**adapter_options)
+    else:
+        adapter = CachingHTTPAdapter(cache_dir, **adapter_options)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class CachingHTTPAdapter(HTTPAdapter):
+    """
+    A transport adapter that caches GET responses carrying validators
+    (`ETag` or `Last-Modified`) on disk and revalidates them with
+    conditional requests.
+
+    Streamed requests (`stream=True`) bypass the cache, since caching them
+    would read the whole body into memory before the caller reads any of
+    it. Responses served from the cache have `from_cache` set to True, and
+    each use refreshes the entry's age for `prune_http_cache`.
+    """
+
+    def __init__(self, cache_dir, **kwargs):
+        self.cache_dir = Path(cache_dir)
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if request.method != "GET" or kwargs.get("stream"):
+            return super().send(request, **kwargs)
+
+        key = hashlib.sha256(request.url.encode()).hexdigest()
+        entry = self._load(key)
+        if entry is not None:
+            headers = CaseInsensitiveDict(entry["headers"])
+            if "ETag" in headers:
+                request.headers["If-None-Match"] = headers["ETag"]
+            if "Last-Modified" in headers:
+                request.headers["If-Modified-Since"] = headers["Last-Modified"]
+
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            return self._cached_response(request, key, entry)
+        response.from_cache = False
+        if response.status_code == 200 and (
+            "ETag" in response.headers or "Last-Modified" in response.headers
+        ):
+            self._store(key, response)
+        return response
+
+    def _load(self, key):
+        path = self.cache_dir / f"{key}.json"
+        if not path.exists() or not (self.cache_dir / f"{key}.body").exists():
+            return None
+        return json.loads(path.read_text())
+
+    def _store(self, key, response):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "url": response.url,
+            "headers": {
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() not in _BODY_ENCODING_HEADERS
+            },
+        }
+        # Write the body before the entry so a reader never sees a partial one
+        _write_atomic(self.cache_dir / f"{key}.body", response.content)
+        _write_atomic(
+            self.cache_dir / f"{key}.json", json.dumps(entry).encode()
+        )
+
+    def _cached_response(self, request, key, entry):
+        (self.cache_dir / f"{key}.json").touch()
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = (self.cache_dir / f"{key}.body").read_bytes()
+        response._content_consumed = True
+        response.from_cache = True
+        return response
+
+
+def prune_http_cache(max_age=None, max_bytes=None, cache_dir=None):
+    """
+    Deletes cached responses not used within `max_age`, then the least
+    recently used ones until the cached bodies fit in `max_bytes`.
+
+    Incremental downloads request a new filter on every run, each cached
+    under its own URL, so the cache grows until it is pruned.
+
+    Parameters:
+        max_age (timedelta, optional): How long to keep unused responses. Defaults to `HTTP_CACHE_MAX_AGE`.
+        max_bytes (int, optional): The most bytes of bodies to keep. Defaults to `HTTP_CACHE_MAX_BYTES`.
+        cache_dir (str or Path, optional): The cache directory. Defaults to `HTTP_CACHE_DIR`.
+
+    Returns:
+        int: The number of responses deleted.
+    """
+    cache_dir = Path(cache_dir or HTTP_CACHE_DIR)
+    if not cache_dir.exists():
+        return 0
+    max_age = max_age or HTTP_CACHE_MAX_AGE
+    max_bytes = HTTP_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    cutoff = time.time() - max_age.total_seconds()
+    entries = []
+    for path in cache_dir.glob("*.json"):
+        body = path.with_suffix(".body")
+        try:
+            used = path.stat().st_mtime
+            size = body.stat().st_size if body.exists() else 0
+        except FileNotFoundError:
+            continue
+        entries.append((used, size, path, body))
+    # Most recently used first, so the oldest are past the size budget
+    entries.sort(key=lambda entry: entry[0], reverse=True)
+    deleted = 0
+    kept_bytes = 0
+    for used, size, path, body in entries:
+        if used >= cutoff and kept_bytes + size <= max_bytes:
+            kept_bytes += size
+            continue
+        # Delete the entry before the body so a reader never sees one alone
+        path.unlink(missing_ok=True)
+        body.unlink(missing_ok=True)
+        deleted += 1
+    print(f"Pruned {deleted} responses from the HTTP cache")
+    return deleted
+
+
+def _write_atomic(path, data):
+    temporary = path.with_name(
+        f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
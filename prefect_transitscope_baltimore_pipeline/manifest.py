@@ -0,0 +1,255 @@
+"""Manifest of the files the flows write, with their hashes and statistics"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+from prefect.context import FlowRunContext
+
+# Where the manifest is written, next to the outputs it describes
+MANIFEST_PATH = Path("data/manifest.json")
+
+# Bytes read at a time when hashing a file
+_HASH_CHUNK_SIZE = 1 << 20
+
+_manifest_lock = threading.Lock()
+
+
+def update_manifest(
+    paths, date_column=None, root=None, path=None, streamed=None
+):
+    """
+    Records files, and objects streamed to S3 without a local file, in the
+    manifest and drops the entries of files under `root` that no longer
+    exist.
+
+    Each file's entry holds its SHA-256 'content_hash', size in 'bytes',
+    'mtime_ns', the 'run_id' of the flow run that wrote it and, for parquet
+    files, its 'rows', a 'schema_hash' of its Arrow schema and the
+    'min_date' and 'max_date' of `date_column`, read from the row group
+    statistics. A file whose size and modification time match its entry is
+    not hashed again and keeps its entry, including its run ID.
+
+    Parameters:
+        paths (list): The files to record.
+        date_column (str, optional): The column whose range is recorded.
+        root (str or Path, optional): Drop the entries of missing files under this directory, such as a dataset whose old partition files were deleted.
+        path (str or Path, optional): The manifest file. Defaults to `MANIFEST_PATH`.
+        streamed (dict, optional): The entries of objects written without a local file, keyed by their path, from `describe_stream`. They are recorded as given and kept when dropping missing files.
+
+    Returns:
+        list: The recorded files and objects whose content changed, as manifest keys.
+
+    Examples:
+        >>> update_manifest(
+        ...     ["data/mta_bus_stops.parquet"], date_column="download_date"
+        ... )
+        ['data/mta_bus_stops.parquet']
+    """
+    path = Path(path or MANIFEST_PATH)
+    with _manifest_lock:
+        manifest = read_manifest(path)
+        changed = []
+        for file in map(Path, paths):
+            key = file.as_posix()
+            entry = manifest.get(key)
+            if entry is not None and is_current(file, entry):
+                continue
+            new_entry = describe_file(file, date_column)
+            if entry is None or (
+                entry["content_hash"] != new_entry["content_hash"]
+            ):
+                changed.append(key)
+            manifest[key] = new_entry
+        streamed = {
+            Path(key).as_posix(): entry
+            for key, entry in (streamed or {}).items()
+        }
+        for key, new_entry in streamed.items():
+            entry = manifest.get(key)
+            if entry is None or (
+                entry["content_hash"] != new_entry["content_hash"]
+            ):
+                changed.append(key)
+            manifest[key] = new_entry
+        if root is not None:
+            prefix = f"{Path(root).as_posix()}/"
+            for key in list(manifest):
+                if (
+                    key.startswith(prefix)
+                    and key not in streamed
+                    and not Path(key).exists()
+                ):
+                    del manifest[key]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        temporary.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+        os.replace(temporary, path)
+    print(
+        f"Recorded {len(paths) + len(streamed)} files in {path}, "
+        f"{len(changed)} changed"
+    )
+    return changed
+
+
+def read_manifest(path=None):
+    """
+    Reads the manifest.
+
+    Parameters:
+        path (str or Path, optional): The manifest file. Defaults to `MANIFEST_PATH`.
+
+    Returns:
+        dict: The entry of each recorded file, keyed by its path.
+    """
+    path = Path(path or MANIFEST_PATH)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def is_current(file, entry):
+    """
+    Checks, without reading it, that a file is the one a manifest entry
+    describes, by its size and modification time.
+
+    Parameters:
+        file (str or Path): The file.
+        entry (dict): Its manifest entry.
+
+    Returns:
+        bool: True if the file exists and matches the entry.
+    """
+    try:
+        stat = Path(file).stat()
+    except FileNotFoundError:
+        return False
+    return (
+        stat.st_size == entry["bytes"]
+        and stat.st_mtime_ns == entry["mtime_ns"]
+    )
+
+
+def content_hash(file, manifest=None):
+    """
+    Returns the SHA-256 of a file, taken from its manifest entry if the
+    entry is current, or computed otherwise.
+
+    Parameters:
+        file (str or Path): The file.
+        manifest (dict, optional): The manifest, if it has been read already. Defaults to reading `MANIFEST_PATH`.
+
+    Returns:
+        str: The hex digest.
+    """
+    if manifest is None:
+        manifest = read_manifest()
+    entry = manifest.get(Path(file).as_posix())
+    if entry is not None and is_current(file, entry):
+        return entry["content_hash"]
+    return _sha256(file)
+
+
+def describe_file(file, date_column=None):
+    """
+    Returns the manifest entry of a file.
+
+    Parameters:
+        file (str or Path): The file.
+        date_column (str, optional): For parquet files, the column whose range is recorded.
+
+    Returns:
+        dict: The entry.
+    """
+    file = Path(file)
+    stat = file.stat()
+    context = FlowRunContext.get()
+    entry = {
+        "content_hash": _sha256(file),
+        "bytes": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "run_id": str(context.flow_run.id) if context else None,
+        "rows": None,
+        "schema_hash": None,
+        "min_date": None,
+        "max_date": None,
+    }
+    if file.suffix == ".parquet":
+        metadata = pq.ParquetFile(file).metadata
+        schema = metadata.schema.to_arrow_schema().remove_metadata()
+        entry["rows"] = metadata.num_rows
+        entry["schema_hash"] = hashlib.sha256(
+            schema.to_string().encode()
+        ).hexdigest()
+        if date_column in schema.names:
+            entry["min_date"], entry["max_date"] = _column_range(
+                metadata, date_column
+            )
+    return entry
+
+
+def describe_stream(report, frame=None, date_column=None):
+    """
+    Returns the manifest entry of a parquet object streamed to S3 without a
+    local file, from its `uploads.stream_parquet_to_s3` report.
+
+    With no file to read, the 'rows' and the date range come from the
+    frame written, and the 'mtime_ns' and 'schema_hash' are None.
+
+    Parameters:
+        report (dict): The report, with the object's 'content_hash' and 'bytes'.
+        frame (DataFrame, optional): The data written.
+        date_column (str, optional): The column whose range is recorded.
+
+    Returns:
+        dict: The entry.
+    """
+    context = FlowRunContext.get()
+    entry = {
+        "content_hash": report["content_hash"],
+        "bytes": report["bytes"],
+        "mtime_ns": None,
+        "run_id": str(context.flow_run.id) if context else None,
+        "rows": None if frame is None else len(frame),
+        "schema_hash": None,
+        "min_date": None,
+        "max_date": None,
+    }
+    if frame is not None and date_column in frame:
+        dates = frame[date_column].dropna()
+        if len(dates):
+            entry["min_date"] = pd.Timestamp(dates.min()).isoformat()
+            entry["max_date"] = pd.Timestamp(dates.max()).isoformat()
+    return entry
+
+
+def _sha256(file):
+    digest = hashlib.sha256()
+    with open(file, "rb") as stream:
+        for chunk in iter(lambda: stream.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _column_range(metadata, column):
+    index = [
+        metadata.schema.column(i).path for i in range(metadata.num_columns)
+    ].index(column)
+    minimum = maximum = None
+    for i in range(metadata.num_row_groups):
+        statistics = metadata.row_group(i).column(index).statistics
+        if statistics is None or not statistics.has_min_max:
+            # Without statistics for every row group the range is unknown
+            return None, None
+        minimum = (
+            statistics.min if minimum is None else min(minimum, statistics.min)
+        )
+        maximum = (
+            statistics.max if maximum is None else max(maximum, statistics.max)
+        )
+    if minimum is None:
+        return None, None
+    return pd.Timestamp(minimum).isoformat(), pd.Timestamp(maximum).isoformat()
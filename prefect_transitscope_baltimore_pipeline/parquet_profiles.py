@@ -0,0 +1,237 @@
+"""Named parquet output profiles, applied to every dataset the flows write"""
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+@dataclass(frozen=True)
+class ParquetProfile:
+    """
+    How a dataset is laid out in parquet.
+
+    Parameters:
+        name (str): The profile name.
+        compression (str): The compression codec, such as "zstd" or "snappy".
+        compression_level (int, optional): The codec's level, if it has one.
+        row_group_size (int): The most rows per row group. Larger groups compress better; smaller groups let readers skip more data.
+        sort_by (tuple): Columns to sort rows by, in order, before writing. Columns a frame does not have are skipped, so one profile serves every dataset. GeoDataFrames ignore it when `spatial_sort` is on.
+        use_dictionary (bool): Dictionary-encode columns.
+        write_statistics (bool): Write column min/max statistics, which readers use to skip row groups.
+        spatial_sort (bool): Sort GeoDataFrames along a Hilbert curve instead of by `sort_by`, so each row group covers a compact area. Off by default, since it scatters the ID columns and makes files larger.
+    """
+
+    name: str
+    compression: str = "snappy"
+    compression_level: Optional[int] = None
+    row_group_size: int = 64_000
+    sort_by: tuple = ()
+    use_dictionary: bool = True
+    write_statistics: bool = True
+    spatial_sort: bool = False
+
+    def write_options(self):
+        """Returns the options `pyarrow.parquet.write_table` takes for the profile."""
+        options = dict(
+            compression=self.compression,
+            row_group_size=self.row_group_size,
+            use_dictionary=self.use_dictionary,
+            write_statistics=self.write_statistics,
+        )
+        if self.compression_level is not None:
+            options["compression_level"] = self.compression_level
+        return options
+
+
+PARQUET_PROFILES = {
+    # Smallest files, for storage and bulk downloads. Rows keep their
+    # order, since a spatial sort nearly doubles the size of the stops
+    "archive": ParquetProfile(
+        "archive",
+        compression="zstd",
+        compression_level=9,
+        row_group_size=1_000_000,
+        spatial_sort=False,
+    ),
+    # Fast to decode, with small sorted row groups whose statistics let
+    # readers filtering by route, date or area skip most of a file. Stops
+    # are sorted spatially rather than by stop ID
+    "interactive": ParquetProfile(
+        "interactive",
+        compression="snappy",
+        row_group_size=1_000,
+        sort_by=("route", "date", "stop_id"),
+        spatial_sort=True,
+    ),
+}
+
+# The profile used when a flow is not given one, overridable by name
+DEFAULT_PARQUET_PROFILE = os.environ.get(
+    "TRANSITSCOPE_PARQUET_PROFILE", "interactive"
+)
+
+
+def get_parquet_profile(profile=None):
+    """
+    Looks up a parquet output profile.
+
+    Parameters:
+        profile (str or ParquetProfile, optional): A profile or the name of one in `PARQUET_PROFILES`. Defaults to `DEFAULT_PARQUET_PROFILE`.
+
+    Returns:
+        ParquetProfile: The profile.
+    """
+    if isinstance(profile, ParquetProfile):
+        return profile
+    name = profile or DEFAULT_PARQUET_PROFILE
+    if name not in PARQUET_PROFILES:
+        raise ValueError(
+            f"Unknown parquet profile {name!r}; "
+            f"expected one of {list(PARQUET_PROFILES)}"
+        )
+    return PARQUET_PROFILES[name]
+
+
+def write_parquet(
+    frame, path, profile=None, index=None, quiet=False, measure_read=False
+):
+    """
+    Writes a DataFrame, or a GeoDataFrame as GeoParquet, with an output
+    profile, and prints the file size and write time, and optionally the
+    time taken to read the file back.
+
+    GeoDataFrames are written as GeoParquet 1.1 with a `bbox` covering
+    column holding each row's bounding box, whose row group statistics let
+    readers such as `gpd.read_parquet(path, bbox=...)` skip the row groups
+    outside an area; see `bbox_row_groups`.
+
+    Parameters:
+        frame (DataFrame or GeoDataFrame): The data.
+        path (str, Path or file-like): The file to write, or a writable binary stream such as an `uploads.S3UploadStream`.
+        profile (str or ParquetProfile, optional): The output profile. Defaults to `DEFAULT_PARQUET_PROFILE`.
+        index (bool, optional): Whether to write the index, as in `DataFrame.to_parquet`.
+        quiet (bool): Do not print the report.
+        measure_read (bool): Read the file back and report the time taken as 'read_seconds'. Ignored when writing to a stream.
+
+    Returns:
+        dict: The 'profile', 'bytes' and 'write_seconds' of the file, and its 'read_seconds' if measured.
+
+    Examples:
+        >>> write_parquet(stops, "data/mta_bus_stops.parquet", "archive")
+        Wrote data/mta_bus_stops.parquet with the archive profile: 412,339 bytes in 0.08s
+        >>> write_parquet(stops, "data/mta_bus_stops.parquet", measure_read=True)
+        Wrote data/mta_bus_stops.parquet with the interactive profile: 538,120 bytes in 0.06s, read back in 0.03s
+    """
+    profile = get_parquet_profile(profile)
+    start = time.perf_counter()
+    geo = isinstance(frame, gpd.GeoDataFrame)
+    sort_by = [name for name in profile.sort_by if name in frame.columns]
+    if geo and profile.spatial_sort:
+        frame = hilbert_sort(frame)
+    elif sort_by:
+        frame = frame.sort_values(sort_by, kind="stable")
+    if geo:
+        frame.to_parquet(
+            path,
+            index=index,
+            schema_version="1.1.0",
+            write_covering_bbox=True,
+            **profile.write_options(),
+        )
+    else:
+        frame.to_parquet(
+            path, engine="pyarrow", index=index, **profile.write_options()
+        )
+    stream = hasattr(path, "write")
+    report = {
+        "profile": profile.name,
+        "bytes": path.tell() if stream else Path(path).stat().st_size,
+        "write_seconds": time.perf_counter() - start,
+    }
+    if measure_read and not stream:
+        start = time.perf_counter()
+        (gpd.read_parquet if geo else pd.read_parquet)(path)
+        report["read_seconds"] = time.perf_counter() - start
+    if not quiet:
+        message = (
+            f"Wrote {path} with the {profile.name} profile: "
+            f"{report['bytes']:,} bytes in {report['write_seconds']:.2f}s"
+        )
+        if "read_seconds" in report:
+            message += f", read back in {report['read_seconds']:.2f}s"
+        print(message)
+    return report
+
+
+def hilbert_sort(frame, level=16):
+    """
+    Sorts a GeoDataFrame along a Hilbert curve over its total bounds, so
+    nearby rows are stored near each other. Rows with missing or empty
+    geometries go last.
+
+    Parameters:
+        frame (GeoDataFrame): The data.
+        level (int): The curve's level of detail; see `GeoSeries.hilbert_distance`.
+
+    Returns:
+        GeoDataFrame: The sorted rows, with their index.
+    """
+    geometry = frame.geometry
+    located = ~(geometry.isna() | geometry.is_empty).to_numpy()
+    distance = np.full(len(frame), np.iinfo(np.int64).max)
+    if located.any():
+        distance[located] = geometry[located].hilbert_distance(level=level)
+    return frame.iloc[np.argsort(distance, kind="stable")]
+
+
+def bbox_row_groups(path, bbox):
+    """
+    Returns the row groups of a GeoParquet file that may hold rows inside a
+    bounding box, judged by the statistics of its bbox covering column.
+
+    Parameters:
+        path (str or Path): A file written by `write_parquet`.
+        bbox (tuple): The (minx, miny, maxx, maxy) bounding box, in the file's CRS.
+
+    Returns:
+        list: The indexes of the row groups to read; every row group if the file has no covering column.
+    """
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    geo = json.loads((metadata.metadata or {}).get(b"geo", b"{}"))
+    column = geo.get("columns", {}).get(geo.get("primary_column"), {})
+    covering = column.get("covering", {}).get("bbox")
+    if covering is None:
+        return list(range(metadata.num_row_groups))
+    positions = {
+        metadata.schema.column(i).path: i for i in range(metadata.num_columns)
+    }
+    minx, miny, maxx, maxy = bbox
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        bounds = {}
+        for key, field_path in covering.items():
+            statistics = row_group.column(
+                positions[".".join(field_path)]
+            ).statistics
+            if statistics is None or not statistics.has_min_max:
+                break
+            bounds[key] = statistics
+        else:
+            if (
+                bounds["xmin"].min > maxx
+                or bounds["ymin"].min > maxy
+                or bounds["xmax"].max < minx
+                or bounds["ymax"].max < miny
+            ):
+                continue
+        row_groups.append(i)
+    return row_groups
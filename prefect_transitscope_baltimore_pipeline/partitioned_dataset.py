@@ -0,0 +1,226 @@
+"""Hive-partitioned parquet datasets, written and compacted per partition"""
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from prefect_transitscope_baltimore_pipeline.parquet_profiles import (
+    write_parquet,
+)
+
+# Where the MTA bus ridership dataset is written, one directory per month
+MTA_BUS_RIDERSHIP_DATASET_PATH = Path("data/mta_bus_ridership")
+
+# The file a partition is written to in full; appends go to other files
+BASE_FILE_NAME = "part-0.parquet"
+
+
+def partition_path(root, year, month):
+    """Returns the directory of a year/month partition."""
+    return Path(root) / f"year={year}" / f"month={month}"
+
+
+def write_partitioned_dataset(frame, root, date_column="date", profile=None):
+    """
+    Writes a frame to a Hive-partitioned (year=/month=) parquet dataset,
+    touching only the partitions whose data changed.
+
+    Each month of data is compared, row by row, with what the partition
+    already holds:
+    - a new month is written to a new partition;
+    - a month with only new rows has those rows appended as a new file;
+    - a month whose existing rows changed is replaced in full, by writing it
+      to a hidden temporary file and atomically renaming that over the
+      partition's base file, so readers see the old or the new data, never a
+      partial file;
+    - an unchanged month is left alone.
+
+    Appended files accumulate until `compact_partitioned_dataset` merges them.
+
+    Parameters:
+        frame (DataFrame): The data, with a datetime `date_column`.
+        root (str or Path): The dataset directory.
+        date_column (str): The column the data is partitioned by.
+        profile (str or ParquetProfile, optional): The output profile files are written with. Defaults to `DEFAULT_PARQUET_PROFILE`.
+
+    Returns:
+        dict: The number of partitions 'added', 'appended', 'replaced' and 'unchanged'.
+    """
+    counts = dict.fromkeys(["added", "appended", "replaced", "unchanged"], 0)
+    if frame.empty:
+        print(f"No data to write to {root}")
+        return counts
+    dates = pd.to_datetime(frame[date_column])
+    for (year, month), partition in frame.groupby(
+        [dates.dt.year.rename("year"), dates.dt.month.rename("month")],
+        sort=True,
+    ):
+        partition = partition.reset_index(drop=True)
+        directory = partition_path(root, year, month)
+        existing = read_partition(directory)
+        if existing is None:
+            _write_file(partition, directory / BASE_FILE_NAME, profile)
+            counts["added"] += 1
+            continue
+        if list(existing.columns) != list(partition.columns):
+            action = "replaced"
+        else:
+            new_rows = _row_hashes(partition)
+            old_rows = _row_hashes(existing.astype(partition.dtypes))
+            is_old = np.isin(new_rows, old_rows)
+            if not np.isin(old_rows, new_rows).all():
+                action = "replaced"
+            elif is_old.all():
+                action = "unchanged"
+            else:
+                action = "appended"
+        if action == "replaced":
+            stale = _data_files(directory)
+            _write_file(partition, directory / BASE_FILE_NAME, profile)
+            for path in stale:
+                if path.name != BASE_FILE_NAME:
+                    path.unlink()
+        elif action == "appended":
+            name = f"part-{datetime.now():%Y%m%d%H%M%S%f}.parquet"
+            _write_file(partition[~is_old], directory / name, profile)
+        counts[action] += 1
+    print(f"Wrote {root}: {counts}")
+    return counts
+
+
+def read_partitioned_dataset(
+    root, start=None, end=None, columns=None, date_column="date"
+):
+    """
+    Reads a dataset written by `write_partitioned_dataset`.
+
+    Only the partitions overlapping `start` and `end` are read.
+
+    Parameters:
+        root (str or Path): The dataset directory.
+        start (str or Timestamp, optional): Read rows on or after this date.
+        end (str or Timestamp, optional): Read rows on or before this date.
+        columns (list, optional): Read only these columns.
+        date_column (str): The column the data is partitioned by.
+
+    Returns:
+        DataFrame: The rows, sorted by `date_column`, without the partition columns.
+
+    Examples:
+        >>> read_partitioned_dataset(
+        ...     MTA_BUS_RIDERSHIP_DATASET_PATH, start="2023-01-01"
+        ... )
+    """
+    dataset = ds.dataset(root, format="parquet", partitioning="hive")
+    year, month = ds.field("year"), ds.field("month")
+    filters = []
+    if start is not None:
+        start = pd.Timestamp(start)
+        filters += [
+            (year > start.year)
+            | ((year == start.year) & (month >= start.month)),
+            ds.field(date_column) >= start,
+        ]
+    if end is not None:
+        end = pd.Timestamp(end)
+        filters += [
+            (year < end.year) | ((year == end.year) & (month <= end.month)),
+            ds.field(date_column) <= end,
+        ]
+    expression = None
+    for condition in filters:
+        expression = (
+            condition if expression is None else expression & condition
+        )
+    if columns is not None and date_column not in columns:
+        read_columns = [*columns, date_column]
+    else:
+        read_columns = columns or [
+            name
+            for name in dataset.schema.names
+            if name not in ("year", "month")
+        ]
+    frame = dataset.to_table(
+        columns=read_columns, filter=expression
+    ).to_pandas()
+    frame = frame.sort_values(date_column, kind="stable", ignore_index=True)
+    return frame[columns] if columns is not None else frame
+
+
+def compact_partitioned_dataset(root, min_files=2, profile=None):
+    """
+    Merges the files of each partition with at least `min_files` files into
+    its base file.
+
+    The merged partition is renamed over the base file atomically before the
+    appended files are deleted, so run compaction when nothing is reading
+    the dataset, or readers may briefly see the appended rows twice.
+
+    Parameters:
+        root (str or Path): The dataset directory.
+        min_files (int): Compact partitions with at least this many files.
+        profile (str or ParquetProfile, optional): The output profile merged files are written with. Defaults to `DEFAULT_PARQUET_PROFILE`.
+
+    Returns:
+        int: The number of partitions compacted.
+    """
+    compacted = 0
+    for directory in sorted(Path(root).glob("year=*/month=*")):
+        files = _data_files(directory)
+        if len(files) < min_files:
+            continue
+        _write_file(
+            read_partition(directory), directory / BASE_FILE_NAME, profile
+        )
+        for path in files:
+            if path.name != BASE_FILE_NAME:
+                path.unlink()
+        compacted += 1
+    print(f"Compacted {compacted} partitions of {root}")
+    return compacted
+
+
+def read_partition(directory):
+    """
+    Reads every file of one partition, or returns None if it has none.
+
+    Parameters:
+        directory (str or Path): The partition directory.
+
+    Returns:
+        DataFrame: The partition's rows, base file first, without the partition columns.
+    """
+    files = _data_files(directory)
+    if not files:
+        return None
+    return pd.concat(
+        [pq.ParquetFile(path).read().to_pandas() for path in files],
+        ignore_index=True,
+    )
+
+
+def _data_files(directory):
+    """Returns a partition's parquet files, base file first."""
+    directory = Path(directory)
+    if not directory.exists():
+        return []
+    files = sorted(directory.glob("part-*.parquet"))
+    return sorted(files, key=lambda path: path.name != BASE_FILE_NAME)
+
+
+def _write_file(frame, path, profile=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Dataset readers skip files starting with a dot
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    write_parquet(frame, temporary, profile, index=False, quiet=True)
+    os.replace(temporary, path)
+
+
+def _row_hashes(frame):
+    return pd.util.hash_pandas_object(
+        frame, index=False, categorize=False
+    ).to_numpy()
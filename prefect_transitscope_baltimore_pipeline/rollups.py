@@ -0,0 +1,228 @@
+"""Pre-aggregated ridership rollups, recomputed for the months that changed"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from prefect_transitscope_baltimore_pipeline.parquet_profiles import (
+    write_parquet,
+)
+
+# Where the rollup files and the fingerprints of their months are written
+MTA_BUS_RIDERSHIP_ROLLUPS_PATH = Path("data/mta_bus_ridership_rollups")
+
+# The rollup files, by name
+ROLLUP_FILES = {
+    "systemwide_monthly": "systemwide_monthly.parquet",
+    "route_annual": "route_annual.parquet",
+}
+
+# The fingerprint of each month's rows as of the last update
+ROLLUP_STATE_FILE = "rollup_state.json"
+
+# The columns a month's fingerprint is computed from
+_SOURCE_COLUMNS = ["route", "date", "ridership", "days_in_month"]
+
+
+def update_ridership_rollups(bus_ridership_data, root=None, profile=None):
+    """
+    Updates the ridership rollups from the output of
+    `calculate_days_and_daily_ridership`.
+
+    Two rollups are written as parquet files:
+    - `systemwide_monthly`: each month's total 'ridership', 'daily_ridership'
+      and number of 'routes', with the change from the same month a year
+      earlier ('ridership_yoy_change', 'ridership_yoy_pct') and the average
+      monthly ridership over the last 3 and 12 months
+      ('ridership_3_month_avg', 'ridership_12_month_avg');
+    - `route_annual`: each route's total 'ridership', its number of 'months'
+      and average 'daily_ridership' per year, with the change from the year
+      before ('ridership_yoy_change', 'ridership_yoy_pct').
+
+    Each month's rows are fingerprinted, and only the months whose rows
+    changed, and the years holding them, are aggregated again; the
+    comparisons and rolling averages are then recomputed from the earliest
+    changed month on. If no month changed, or there is no data, nothing is
+    written.
+
+    Parameters:
+        bus_ridership_data (DataFrame): One row per route and month, with 'route', 'date', 'ridership', 'days_in_month' and 'daily_ridership' columns.
+        root (str or Path, optional): The rollups directory. Defaults to `MTA_BUS_RIDERSHIP_ROLLUPS_PATH`.
+        profile (str or ParquetProfile, optional): The output profile the files are written with. Defaults to `DEFAULT_PARQUET_PROFILE`.
+
+    Returns:
+        dict: The rollup frames, by name.
+    """
+    root = Path(root or MTA_BUS_RIDERSHIP_ROLLUPS_PATH)
+    rollups = read_ridership_rollups(root)
+    if bus_ridership_data.empty:
+        # Keep the rollups of the last scrape rather than emptying them
+        print(f"No ridership data to roll up into {root}")
+        return rollups
+    fingerprints = month_fingerprints(bus_ridership_data)
+    state = _read_state(root)
+    if rollups is None:
+        state = {}
+    changed = sorted(
+        month
+        for month in set(fingerprints) | set(state)
+        if fingerprints.get(month) != state.get(month)
+    )
+    if not changed:
+        print(f"Ridership rollups in {root} are up to date")
+        return rollups
+    changed_dates = pd.to_datetime(changed)
+    months = bus_ridership_data["date"].dt.to_period("M").dt.to_timestamp()
+    changed_rows = bus_ridership_data[months.isin(changed_dates)]
+
+    monthly = _systemwide_totals(changed_rows)
+    annual = _route_annual_totals(
+        bus_ridership_data[
+            bus_ridership_data["date"].dt.year.isin(changed_dates.year)
+        ]
+    )
+    if rollups is not None:
+        kept = rollups["systemwide_monthly"]
+        kept = kept[~kept["date"].isin(changed_dates)]
+        monthly = pd.concat([kept, monthly], ignore_index=True)
+        kept = rollups["route_annual"]
+        kept = kept[~kept["year"].isin(changed_dates.year)]
+        annual = pd.concat([kept, annual], ignore_index=True)
+    rollups = {
+        "systemwide_monthly": _add_monthly_windows(
+            monthly.sort_values("date", ignore_index=True),
+            since=changed_dates.min(),
+        ),
+        "route_annual": _add_annual_change(
+            annual.sort_values(["route", "year"], ignore_index=True),
+            since=changed_dates.year.min(),
+        ),
+    }
+
+    root.mkdir(parents=True, exist_ok=True)
+    for name, frame in rollups.items():
+        write_parquet(frame, root / ROLLUP_FILES[name], profile, index=False)
+    (root / ROLLUP_STATE_FILE).write_text(json.dumps(fingerprints, indent=2))
+    print(f"Recomputed ridership rollups for {len(changed)} changed months")
+    return rollups
+
+
+def read_ridership_rollups(root=None):
+    """
+    Reads the ridership rollups, or returns None if any is missing.
+
+    Parameters:
+        root (str or Path, optional): The rollups directory. Defaults to `MTA_BUS_RIDERSHIP_ROLLUPS_PATH`.
+
+    Returns:
+        dict: The rollup frames, by name.
+    """
+    root = Path(root or MTA_BUS_RIDERSHIP_ROLLUPS_PATH)
+    paths = {name: root / file for name, file in ROLLUP_FILES.items()}
+    if not all(path.exists() for path in paths.values()):
+        return None
+    return {name: pd.read_parquet(path) for name, path in paths.items()}
+
+
+def month_fingerprints(bus_ridership_data):
+    """
+    Returns a content hash of each month's rows that does not depend on
+    their order.
+
+    Parameters:
+        bus_ridership_data (DataFrame): The ridership data.
+
+    Returns:
+        dict: The hash of each month, keyed by its first day as 'YYYY-MM-DD'.
+    """
+    rows = pd.util.hash_pandas_object(
+        bus_ridership_data[_SOURCE_COLUMNS], index=False, categorize=False
+    )
+    months = bus_ridership_data["date"].dt.to_period("M").dt.to_timestamp()
+    # Sums of uint64 hashes wrap around, which keeps them order-independent
+    sums = rows.groupby(months.to_numpy()).sum()
+    counts = rows.groupby(months.to_numpy()).size()
+    return {
+        f"{month:%Y-%m-%d}": f"{sums[month]:016x}-{counts[month]}"
+        for month in sums.index
+    }
+
+
+def _systemwide_totals(rows):
+    months = rows["date"].dt.to_period("M").dt.to_timestamp()
+    return (
+        rows.assign(date=months)
+        .groupby("date", as_index=False)
+        .agg(
+            ridership=("ridership", "sum"),
+            daily_ridership=("daily_ridership", "sum"),
+            routes=("route", "nunique"),
+        )
+    )
+
+
+def _route_annual_totals(rows):
+    return (
+        rows.assign(year=rows["date"].dt.year, route=rows["route"].astype(str))
+        .groupby(["route", "year"], as_index=False)
+        .agg(
+            ridership=("ridership", "sum"),
+            days=("days_in_month", "sum"),
+            months=("date", "nunique"),
+        )
+        .assign(daily_ridership=lambda frame: frame.ridership / frame.days)
+        .drop(columns="days")
+    )
+
+
+def _add_monthly_windows(monthly, since):
+    """Adds year-over-year and rolling columns to the months from `since` on."""
+    start = since - pd.DateOffset(months=12)
+    window = monthly[monthly["date"] >= start].set_index("date")
+    # Missing months count as gaps, not as neighbors
+    ridership = window["ridership"].asfreq("MS")
+    previous_year = ridership.shift(12)
+    derived = pd.DataFrame(
+        {
+            "ridership_yoy_change": ridership - previous_year,
+            "ridership_yoy_pct": (ridership / previous_year - 1) * 100,
+            "ridership_3_month_avg": ridership.rolling(3).mean(),
+            "ridership_12_month_avg": ridership.rolling(12).mean(),
+        }
+    )
+    for column in derived.columns:
+        if column not in monthly.columns:
+            monthly[column] = np.nan
+    rows = monthly["date"] >= since
+    monthly.loc[rows, derived.columns] = derived.loc[
+        monthly.loc[rows, "date"]
+    ].to_numpy()
+    return monthly
+
+
+def _add_annual_change(annual, since):
+    """Adds year-over-year columns to the years from `since` on."""
+    previous = annual.assign(year=annual["year"] + 1).set_index(
+        ["route", "year"]
+    )["ridership"]
+    rows = annual["year"] >= since
+    current = annual[rows].set_index(["route", "year"])["ridership"]
+    previous_year = previous.reindex(current.index)
+    for column in ["ridership_yoy_change", "ridership_yoy_pct"]:
+        if column not in annual.columns:
+            annual[column] = np.nan
+    annual.loc[rows, "ridership_yoy_change"] = (
+        current - previous_year
+    ).to_numpy()
+    annual.loc[rows, "ridership_yoy_pct"] = (
+        (current / previous_year - 1) * 100
+    ).to_numpy()
+    return annual
+
+
+def _read_state(root):
+    path = Path(root) / ROLLUP_STATE_FILE
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
@@ -0,0 +1,188 @@
+"""Route and stop lookups over the MTA bus stop-route bridge table"""
+import numpy as np
+import pandas as pd
+
+from prefect_transitscope_baltimore_pipeline.tasks import (
+    explode_routes_served,
+)
+
+
+class RouteStopIndex:
+    """
+    An in-memory index of which routes serve which MTA bus stops.
+
+    The stop x route incidence matrix is held in compressed sparse form twice:
+    row-wise (stop -> routes) and column-wise (route -> stops). Each stop's
+    routes and each route's stops are therefore a contiguous, sorted slice of
+    an integer array, so lookups cost one dictionary access and one slice,
+    and transfer stops are a sorted-array intersection.
+
+    Build an index with `from_bridge` or `from_stops`, and persist it with
+    `save` and `load`.
+
+    Examples:
+        >>> index = RouteStopIndex.from_bridge(
+        ...     pd.read_parquet("data/mta_bus_stop_routes.parquet")
+        ... )
+        >>> index.stops_for_route("CityLink Blue")
+        array([  12,   18, ...])
+        >>> index.transfer_stops("CityLink Blue", "22")
+        array([ 118, 4023])
+    """
+
+    def __init__(
+        self,
+        stop_ids,
+        routes,
+        stop_indptr,
+        stop_indices,
+        route_indptr,
+        route_indices,
+    ):
+        self.stop_ids = np.asarray(stop_ids)
+        if self.stop_ids.dtype == object:
+            # Fixed-width strings, like the routes, save without pickling
+            self.stop_ids = self.stop_ids.astype(str)
+        self.routes = np.asarray(routes)
+        self.stop_indptr = np.asarray(stop_indptr, dtype=np.int64)
+        self.stop_indices = np.asarray(stop_indices, dtype=np.int32)
+        self.route_indptr = np.asarray(route_indptr, dtype=np.int64)
+        self.route_indices = np.asarray(route_indices, dtype=np.int32)
+        self._stop_positions = {
+            stop_id: i for i, stop_id in enumerate(self.stop_ids.tolist())
+        }
+        self._route_positions = {
+            route: i for i, route in enumerate(self.routes.tolist())
+        }
+
+    @classmethod
+    def from_bridge(cls, bridge):
+        """
+        Builds the index from a stop-route bridge table.
+
+        Parameters:
+            bridge (DataFrame): A DataFrame with 'stop_id' and 'route' columns, such as the output of `create_stop_route_bridge`.
+
+        Returns:
+            RouteStopIndex: The index over every stop and route in the bridge.
+        """
+        bridge = bridge[["stop_id", "route"]].drop_duplicates()
+        stop_codes, stop_ids = pd.factorize(bridge["stop_id"], sort=True)
+        route_codes, routes = pd.factorize(
+            bridge["route"].astype(str), sort=True
+        )
+        stop_indptr, stop_indices = _compress(
+            stop_codes, route_codes, len(stop_ids)
+        )
+        route_indptr, route_indices = _compress(
+            route_codes, stop_codes, len(routes)
+        )
+        return cls(
+            np.asarray(stop_ids),
+            np.asarray(routes, dtype=str),
+            stop_indptr,
+            stop_indices,
+            route_indptr,
+            route_indices,
+        )
+
+    @classmethod
+    def from_stops(cls, stops):
+        """
+        Builds the index from MTA bus stops data.
+
+        Parameters:
+            stops (DataFrame): MTA bus stops data with 'stop_id' and 'routes_served' fields, such as the output of `transform_mta_bus_stops`.
+
+        Returns:
+            RouteStopIndex: The index over every stop and route in the data.
+        """
+        return cls.from_bridge(explode_routes_served(stops))
+
+    def stops_for_route(self, route):
+        """Returns the sorted stop IDs served by a route."""
+        position = self._route_positions.get(route)
+        if position is None:
+            return self.stop_ids[:0]
+        return self.stop_ids[self._route_slice(position)]
+
+    def routes_for_stop(self, stop_id):
+        """Returns the sorted routes serving a stop."""
+        position = self._stop_positions.get(stop_id)
+        if position is None:
+            return []
+        start, end = self.stop_indptr[position : position + 2]
+        return self.routes[self.stop_indices[start:end]].tolist()
+
+    def transfer_stops(self, route_a, route_b):
+        """Returns the sorted stop IDs served by both routes."""
+        position_a = self._route_positions.get(route_a)
+        position_b = self._route_positions.get(route_b)
+        if position_a is None or position_b is None:
+            return self.stop_ids[:0]
+        shared = np.intersect1d(
+            self._route_slice(position_a),
+            self._route_slice(position_b),
+            assume_unique=True,
+        )
+        return self.stop_ids[shared]
+
+    def save(self, path):
+        """
+        Writes the index to an uncompressed `.npz` file.
+
+        Parameters:
+            path (str or Path): The file to write.
+        """
+        with open(path, "wb") as file:
+            np.savez(
+                file,
+                stop_ids=self.stop_ids,
+                routes=self.routes,
+                stop_indptr=self.stop_indptr,
+                stop_indices=self.stop_indices,
+                route_indptr=self.route_indptr,
+                route_indices=self.route_indices,
+            )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads an index written by `save`.
+
+        Parameters:
+            path (str or Path): The file to read.
+
+        Returns:
+            RouteStopIndex: The loaded index.
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(
+                arrays["stop_ids"],
+                arrays["routes"],
+                arrays["stop_indptr"],
+                arrays["stop_indices"],
+                arrays["route_indptr"],
+                arrays["route_indices"],
+            )
+
+    def _route_slice(self, position):
+        start, end = self.route_indptr[position : position + 2]
+        return self.route_indices[start:end]
+
+    def __len__(self):
+        return len(self.stop_indices)
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(stops={len(self.stop_ids)}, "
+            f"routes={len(self.routes)}, pairs={len(self)})"
+        )
+
+
+def _compress(row_codes, column_codes, n_rows):
+    """Returns the CSR index pointer and sorted column indices for the pairs."""
+    order = np.lexsort((column_codes, row_codes))
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_codes, minlength=n_rows), out=indptr[1:])
+    return indptr, np.asarray(column_codes)[order].astype(np.int32)
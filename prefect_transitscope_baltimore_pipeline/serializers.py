@@ -0,0 +1,92 @@
+"""Prefect result serializers for pandas and GeoPandas frames"""
+import base64
+import io
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from prefect.serializers import PickleSerializer, Serializer
+from typing_extensions import Literal
+
+# Prefixes marking how each serialized result is encoded
+_PARQUET = b"parquet:"
+_GEOPARQUET = b"geoparquet:"
+_PICKLE = b"pickle:"
+
+# Values Parquet stores as lists or structs, which read back as NumPy
+# arrays or dicts with every key of every row, not as the values written
+_NESTED_TYPES = (list, tuple, set, dict, np.ndarray)
+
+
+def _has_nested_values(data_frame):
+    """
+    Checks whether any object column of a frame holds lists, tuples, sets,
+    dicts or arrays, which do not round-trip through Parquet unchanged.
+
+    Parameters:
+        data_frame (DataFrame): The frame to check.
+
+    Returns:
+        bool: Whether an object column holds a nested value.
+    """
+    return any(
+        isinstance(value, _NESTED_TYPES)
+        for _, column in data_frame.select_dtypes(include="object").items()
+        for value in column
+    )
+
+
+class FrameSerializer(Serializer):
+    """
+    Serializes DataFrames as Parquet and GeoDataFrames as GeoParquet, and
+    any other result, or a frame Parquet cannot store unchanged, such as
+    one with a column of lists, with Prefect's cloudpickle serializer.
+
+    Parquet is columnar and compressed, and GeoParquet stores geometries as
+    WKB with the CRS, so frame results take a fraction of the space of
+    pickles of the same frames; see `benchmarks.compare_result_serializers`.
+
+    Attributes:
+        compression (str): The Parquet compression codec, such as "zstd", "snappy" or "none".
+
+    Examples:
+        >>> @task(persist_result=True, result_serializer=FrameSerializer())
+        ... def summarize(data_frame):
+        ...     return data_frame.describe()
+    """
+
+    type: Literal["transitscope-frame"] = "transitscope-frame"
+    compression: str = "zstd"
+
+    def dumps(self, obj):
+        if isinstance(obj, pd.DataFrame):
+            prefix = (
+                _GEOPARQUET if isinstance(obj, gpd.GeoDataFrame) else _PARQUET
+            )
+            if _has_nested_values(obj):
+                # Such as the routes served by each stop as lists
+                return _PICKLE + PickleSerializer().dumps(obj)
+            buffer = io.BytesIO()
+            try:
+                obj.to_parquet(buffer, compression=self.compression)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Such as object columns mixing strings and numbers, which
+                # Parquet cannot store
+                return _PICKLE + PickleSerializer().dumps(obj)
+            # Prefect stores results as JSON, so the bytes must be text-safe
+            return prefix + base64.b64encode(buffer.getvalue())
+        return _PICKLE + PickleSerializer().dumps(obj)
+
+    def loads(self, blob):
+        if blob.startswith(_PICKLE):
+            return PickleSerializer().loads(blob[len(_PICKLE) :])
+        if blob.startswith(_GEOPARQUET):
+            data = base64.b64decode(blob[len(_GEOPARQUET) :])
+            return gpd.read_parquet(io.BytesIO(data))
+        data = base64.b64decode(blob[len(_PARQUET) :])
+        return pd.read_parquet(io.BytesIO(data))
+
+
+# The serializer of the package's tasks and flows that return frames
+RESULT_SERIALIZER = FrameSerializer()
@@ -0,0 +1,170 @@
+"""Nearest-stop and radius queries over the MTA bus stops"""
+import functools
+import pickle
+
+import numpy as np
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+# NAD83 / Maryland, in meters
+STATE_PLANE_CRS = "EPSG:26985"
+
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(from_crs="EPSG:4326", to_crs=STATE_PLANE_CRS):
+    """
+    Returns a cached pyproj Transformer between two CRSs.
+
+    Building a Transformer is far more expensive than using one, so each
+    CRS pair is built once per process and reused by every caller.
+
+    Parameters:
+        from_crs (str): The source CRS. Defaults to WGS 84.
+        to_crs (str): The target CRS. Defaults to Maryland State Plane.
+
+    Returns:
+        Transformer: A transformer taking (x, y) / (longitude, latitude) order.
+    """
+    return Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+
+def project_to_state_plane(longitudes, latitudes):
+    """
+    Projects WGS 84 longitudes and latitudes to Maryland State Plane.
+
+    Parameters:
+        longitudes (array-like): Longitudes in degrees.
+        latitudes (array-like): Latitudes in degrees.
+
+    Returns:
+        tuple: Arrays of x and y coordinates in meters.
+    """
+    x, y = get_transformer().transform(
+        np.asarray(longitudes, dtype=float),
+        np.asarray(latitudes, dtype=float),
+    )
+    return np.atleast_1d(x), np.atleast_1d(y)
+
+
+class StopSpatialIndex:
+    """
+    A KD-tree over MTA bus stops in Maryland State Plane coordinates.
+
+    Stops and query points are projected to a metric CRS, so distances
+    and radii are in meters and every query is a tree lookup rather than a
+    scan over all stops. Queries take arrays of longitudes and latitudes
+    (EPSG:4326) and answer a whole batch in one call.
+
+    Examples:
+        >>> index = StopSpatialIndex.from_stops(
+        ...     gpd.read_parquet("data/mta_bus_stops.parquet")
+        ... )
+        >>> distances, stop_ids = index.nearest(
+        ...     [-76.6122, -76.6205], [39.2904, 39.3079], k=3
+        ... )
+        >>> index.within_radius([-76.6122], [39.2904], radius=400)
+        [array([ 212,  213, 1675])]
+    """
+
+    def __init__(self, stop_ids, x, y):
+        self.stop_ids = np.asarray(stop_ids)
+        self.tree = cKDTree(np.column_stack([x, y]))
+
+    @classmethod
+    def from_stops(cls, stops):
+        """
+        Builds the index from MTA bus stops data.
+
+        Parameters:
+            stops (DataFrame): MTA bus stops data with 'stop_id', 'longitude' and 'latitude' fields, such as the output of `transform_mta_bus_stops`. The stored 'state_plane_x' and 'state_plane_y' fields are used instead of reprojecting when present.
+
+        Returns:
+            StopSpatialIndex: The index over every stop with coordinates.
+        """
+        stops = stops[stops["longitude"].notna() & stops["latitude"].notna()]
+        if {"state_plane_x", "state_plane_y"} <= set(stops.columns):
+            x = stops["state_plane_x"].to_numpy()
+            y = stops["state_plane_y"].to_numpy()
+        else:
+            x, y = project_to_state_plane(
+                stops["longitude"], stops["latitude"]
+            )
+        return cls(stops["stop_id"].to_numpy(), x, y)
+
+    def nearest(self, longitudes, latitudes, k=1):
+        """
+        Finds the k nearest stops to each point.
+
+        Parameters:
+            longitudes (array-like): Longitudes of the query points.
+            latitudes (array-like): Latitudes of the query points.
+            k (int): The number of stops to return for each point.
+
+        Returns:
+            tuple: An array of distances in meters and an array of stop IDs, each of shape (number of points, k) and sorted nearest first.
+        """
+        k = min(k, len(self.stop_ids))
+        distances, positions = self.tree.query(
+            self._project(longitudes, latitudes), k=k
+        )
+        distances = np.asarray(distances).reshape(-1, k)
+        positions = np.asarray(positions).reshape(-1, k)
+        return distances, self.stop_ids[positions]
+
+    def within_radius(self, longitudes, latitudes, radius):
+        """
+        Finds the stops within a radius of each point.
+
+        Parameters:
+            longitudes (array-like): Longitudes of the query points.
+            latitudes (array-like): Latitudes of the query points.
+            radius (float): The search radius in meters.
+
+        Returns:
+            list: One array of stop IDs per point, sorted by stop position in the index.
+        """
+        matches = self.tree.query_ball_point(
+            self._project(longitudes, latitudes), r=radius, return_sorted=True
+        )
+        return [self.stop_ids[positions] for positions in matches]
+
+    def save(self, path):
+        """
+        Writes the index, including the built tree, to a file.
+
+        Parameters:
+            path (str or Path): The file to write.
+        """
+        with open(path, "wb") as file:
+            pickle.dump(
+                {"stop_ids": self.stop_ids, "tree": self.tree},
+                file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads an index written by `save` without rebuilding the tree.
+
+        Parameters:
+            path (str or Path): The file to read.
+
+        Returns:
+            StopSpatialIndex: The loaded index.
+        """
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+        index = cls.__new__(cls)
+        index.stop_ids = state["stop_ids"]
+        index.tree = state["tree"]
+        return index
+
+    def _project(self, longitudes, latitudes):
+        return np.column_stack(project_to_state_plane(longitudes, latitudes))
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(stops={len(self)})"
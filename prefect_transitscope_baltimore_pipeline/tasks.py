@@ -2,17 +2,32 @@
 import asyncio
 import calendar
 import datetime as dt
+import json
 import re
 from datetime import datetime
 from io import StringIO
+from pathlib import Path
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-import requests
+import shapely
 from prefect import task
 from pyppeteer import launch
 from tqdm import tqdm
 
+from prefect_transitscope_baltimore_pipeline.arcgis import (
+    MD_TRANSIT_BUS_STOPS_URL,
+    FeatureLayer,
+)
+from prefect_transitscope_baltimore_pipeline.caching import transform_task
+from prefect_transitscope_baltimore_pipeline.serializers import (
+    RESULT_SERIALIZER,
+)
+from prefect_transitscope_baltimore_pipeline.spatial import (
+    project_to_state_plane,
+)
+
 # -------------------------------------------------------- #
 #   Scrape the route ridership data from the MTA website   #
 # -------------------------------------------------------- #
@@ -58,7 +73,7 @@ async def computeCsvStringFromTable(
     )
 
 
-@task
+@task(result_serializer=RESULT_SERIALIZER)
 async def scrape():
     """
     Scrape data from the MTA Maryland Performance Improvement website and return it as a pandas DataFrame.
@@ -197,13 +212,13 @@ def calculate_days_in_month(date_value):
     return last_day_of_month.day
 
 
-@task
+@transform_task
 def standardize_column_names_task(data_frame):
     """Task to standardize DataFrame column names to lowercase with underscores."""
     return standardize_column_names(data_frame)
 
 
-@task
+@transform_task
 def format_bus_routes_task(bus_ridership_data):
     """Task to format bus route strings, capitalizing CityLink routes."""
     bus_ridership_data["route"] = bus_ridership_data["route"].apply(
@@ -212,7 +227,7 @@ def format_bus_routes_task(bus_ridership_data):
     return bus_ridership_data
 
 
-@task
+@transform_task
 def convert_date_and_calculate_end_of_month(bus_ridership_data):
     """Task to convert date column to datetime format and calculate end date of month."""
     bus_ridership_data["date"] = pd.to_datetime(
@@ -224,7 +239,7 @@ def convert_date_and_calculate_end_of_month(bus_ridership_data):
     return bus_ridership_data
 
 
-@task
+@transform_task
 def exclude_zero_ridership(bus_ridership_data):
     """Task to exclude rows with zero ridership."""
     bus_ridership_data = bus_ridership_data[
@@ -233,7 +248,7 @@ def exclude_zero_ridership(bus_ridership_data):
     return bus_ridership_data
 
 
-@task
+@transform_task
 def calculate_days_and_daily_ridership(bus_ridership_data):
     """Task to calculate number of days in the month and daily ridership."""
     bus_ridership_data["days_in_month"] = bus_ridership_data["date"].apply(
@@ -284,65 +299,323 @@ def map_color_to_citylink(color):
     return color_to_citylink.get(color, color)
 
 
+# Where the last successful MTA bus stops run records what it downloaded
+MTA_BUS_STOPS_STATE_PATH = "data/mta_bus_stops_state.json"
+
+# The stop fields the transforms use, requested along with the layer's
+# object ID field and the geometry
+MTA_BUS_STOPS_FIELDS = ("stop_id", "routes_served")
+
+
+def read_layer_state(path=MTA_BUS_STOPS_STATE_PATH):
+    """
+    Reads the state recorded by the last successful MTA bus stops run.
+
+    Parameters:
+        path (str or Path): The state file.
+
+    Returns:
+        dict: The recorded state, or an empty dict if there is none.
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def write_layer_state(state, path=MTA_BUS_STOPS_STATE_PATH):
+    """
+    Records the state of a successful MTA bus stops run.
+
+    Parameters:
+        state (dict): JSON-serializable state, such as the layer URL and its last edit date.
+        path (str or Path): The state file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(state, indent=2, default=str))
+
+
 # Function to download MTA bus stops data
-@task
-def download_mta_bus_stops():
+@task(result_serializer=RESULT_SERIALIZER)
+def download_mta_bus_stops(
+    layer_url=MD_TRANSIT_BUS_STOPS_URL,
+    max_workers=8,
+    last_edit_date=None,
+    edited_since=None,
+    transfer_format="geojson",
+    out_fields=None,
+    metadata=None,
+):
     """
     Downloads and processes data for MTA bus stops in Maryland.
 
     This function retrieves the metadata from the Maryland Transit FeatureServer,
-    extracting the description of the data. It then downloads the MTA bus stops data
-    in GeoJSON format, standardizes the column names, adds a description from the metadata,
-    and appends the current download date and time to each record.
+    extracting the description of the data, the server's page size and the time
+    the layer was last edited. If the layer has not been edited since
+    `last_edit_date`, it returns None without downloading anything. Otherwise it
+    downloads the MTA bus stops data, or only the stops edited after
+    `edited_since` if the layer tracks edit dates, in pages of at most `maxRecordCount`
+    features, fetched concurrently over a pooled HTTP session, standardizes the
+    column names, adds a description and last edit date from the metadata, and
+    appends the current download date and time to each record.
+
+    Parameters:
+        layer_url (str): The URL of the FeatureServer layer holding the bus stops.
+        max_workers (int): The number of pages to download at once.
+        last_edit_date (str or Timestamp, optional): The layer's last edit date as of the previous download.
+        edited_since (str or Timestamp, optional): Only download stops edited after this time. Ignored, and every stop downloaded, if the layer does not track edit dates.
+        transfer_format (str): How the server encodes each page; see `arcgis.TRANSFER_FORMATS`. Defaults to GeoJSON, which is streamed page by page; the compact "quantized" Esri JSON has not been checked against the real layer's coordinates.
+        out_fields (str, optional): A comma-separated list of the fields to download. Defaults to the layer's object ID field and `MTA_BUS_STOPS_FIELDS`.
+        metadata (dict, optional): The layer metadata, if it has been fetched already.
 
     Returns:
         GeoDataFrame: A GeoDataFrame containing the MTA bus stops data with standardized
-        column names, the data source description, and the download date and time.
+        column names, the data source description, the layer's last edit date, and the
+        download date and time, or None if the layer is unchanged.
+    """
+    layer = FeatureLayer(layer_url, max_workers=max_workers, metadata=metadata)
+    description = describe_layer(layer)
+    if layer_is_unchanged(layer, last_edit_date):
+        return None
+
+    where = "1=1"
+    if edited_since is not None:
+        where = layer.edited_since_filter(edited_since) or where
+        print(f"Downloading MTA bus stops where {where}")
+
+    stops = layer.download(
+        where=where,
+        out_fields=out_fields or mta_bus_stops_out_fields(layer),
+        transfer_format=transfer_format,
+    )
+    return label_mta_bus_stops(stops, layer, description)
+
+
+@task(result_serializer=RESULT_SERIALIZER)
+async def download_mta_bus_stops_async(
+    layer_url=MD_TRANSIT_BUS_STOPS_URL,
+    max_workers=8,
+    last_edit_date=None,
+    edited_since=None,
+    transfer_format="geojson",
+    out_fields=None,
+    metadata=None,
+):
+    """
+    Asynchronous version of `download_mta_bus_stops`.
+
+    The layer metadata is requested at the same time as the object IDs of the
+    stops to download, rather than before them, and every request runs in a
+    worker thread, so the download does not block the event loop it shares
+    with other flows, such as the ridership scrape. When only the stops
+    edited after `edited_since` are downloaded, their filter depends on the
+    metadata, so the object IDs are requested once it arrives. When the
+    metadata is given, the object IDs are requested only once the layer is
+    known to have changed.
+
+    Parameters:
+        layer_url (str): The URL of the FeatureServer layer holding the bus stops.
+        max_workers (int): The number of pages to download at once.
+        last_edit_date (str or Timestamp, optional): The layer's last edit date as of the previous download.
+        edited_since (str or Timestamp, optional): Only download stops edited after this time. Ignored, and every stop downloaded, if the layer does not track edit dates.
+        transfer_format (str): How the server encodes each page; see `arcgis.TRANSFER_FORMATS`. Defaults to GeoJSON, which is streamed page by page; the compact "quantized" Esri JSON has not been checked against the real layer's coordinates.
+        out_fields (str, optional): A comma-separated list of the fields to download. Defaults to the layer's object ID field and `MTA_BUS_STOPS_FIELDS`.
+        metadata (dict, optional): The layer metadata, if it has been fetched already.
+
+    Returns:
+        GeoDataFrame: The same MTA bus stops data as `download_mta_bus_stops`, or None if the layer is unchanged.
     """
-    metadata_url = "https://geodata.md.gov/imap/rest/services/Transportation/MD_Transit/FeatureServer/9?f=pjson"
-    metadata_response = requests.get(metadata_url, timeout=10)
-    if metadata_response.status_code == 200:
-        description = metadata_response.json().get(
-            "description", "No description available"
+    layer = FeatureLayer(layer_url, max_workers=max_workers, metadata=metadata)
+    object_ids = None
+    if metadata is None and edited_since is None:
+        description, object_ids = await asyncio.gather(
+            asyncio.to_thread(describe_layer, layer),
+            asyncio.to_thread(layer.object_ids),
         )
+    else:
+        description = await asyncio.to_thread(describe_layer, layer)
+    if layer_is_unchanged(layer, last_edit_date):
+        return None
+
+    where = "1=1"
+    if edited_since is not None:
+        where = layer.edited_since_filter(edited_since) or where
+        print(f"Downloading MTA bus stops where {where}")
+
+    stops = await asyncio.to_thread(
+        layer.download,
+        where=where,
+        out_fields=out_fields or mta_bus_stops_out_fields(layer),
+        object_ids=object_ids if where == "1=1" else None,
+        transfer_format=transfer_format,
+    )
+    return label_mta_bus_stops(stops, layer, description)
+
+
+def mta_bus_stops_out_fields(layer):
+    """
+    Returns the fields of the MTA bus stops to download: the layer's object
+    ID field, which pages and incremental changes are keyed on, and
+    `MTA_BUS_STOPS_FIELDS`.
+
+    Parameters:
+        layer (FeatureLayer): The layer.
+
+    Returns:
+        str: A comma-separated list of fields.
+    """
+    return ",".join([layer.object_id_field, *MTA_BUS_STOPS_FIELDS])
+
+
+def describe_layer(layer):
+    """
+    Fetches a FeatureServer layer's metadata and returns its description.
+
+    If the metadata cannot be fetched, the layer falls back to its defaults.
+
+    Parameters:
+        layer (FeatureLayer): The layer.
+
+    Returns:
+        str: The layer's description, or "No description available".
+    """
+    metadata = layer.metadata(errors="ignore")
+    description = metadata.get("description", "No description available")
+    if metadata:
         print("Description from Metadata:", description)
     else:
         print("Failed to retrieve metadata")
-        description = "No description available"
+    return description
 
-    stops = gpd.read_file(
-        "https://geodata.md.gov/imap/rest/services/Transportation/MD_Transit/FeatureServer/9/query?where=1%3D1&outFields=*&outSR=4326&f=geojson"
-    )
+
+def layer_is_unchanged(layer, last_edit_date):
+    """
+    Checks whether a layer is unchanged since a previous download.
+
+    Parameters:
+        layer (FeatureLayer): The layer, with its metadata fetched.
+        last_edit_date (str or Timestamp, optional): The layer's last edit date as of the previous download.
+
+    Returns:
+        bool: True if both edit dates are known and equal.
+    """
+    layer_last_edit_date = layer.last_edit_date
+    if (
+        last_edit_date is not None
+        and layer_last_edit_date is not None
+        and layer_last_edit_date == pd.Timestamp(last_edit_date)
+    ):
+        print(f"MTA bus stops layer unchanged since {layer_last_edit_date}")
+        return True
+    return False
+
+
+def label_mta_bus_stops(stops, layer, description):
+    """
+    Standardizes the column names of downloaded MTA bus stops data and adds
+    the data source description, the layer's last edit date, and the current
+    download date and time to each record.
+
+    Parameters:
+        stops (GeoDataFrame): The downloaded MTA bus stops data.
+        layer (FeatureLayer): The layer the stops were downloaded from.
+        description (str): The layer's description.
+
+    Returns:
+        GeoDataFrame: The labeled MTA bus stops data.
+    """
     stops = standardize_column_names(stops)
     stops["data_source_description"] = description
+    layer_last_edit_date = layer.last_edit_date
+    stops["layer_last_edit_date"] = (
+        layer_last_edit_date if layer_last_edit_date is not None else pd.NaT
+    )
     stops["download_date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     return stops
 
 
 @task
-def transform_mta_bus_stops(gdf):
+def download_mta_bus_stop_object_ids(layer_url=MD_TRANSIT_BUS_STOPS_URL):
     """
-    Transforms a GeoDataFrame containing MTA bus stops data.
+    Downloads the object IDs of every MTA bus stop currently in the layer.
 
-    This function performs several transformations on the MTA bus stops data:
+    Parameters:
+        layer_url (str): The URL of the FeatureServer layer holding the bus stops.
+
+    Returns:
+        list: The sorted object IDs.
+    """
+    return FeatureLayer(layer_url).object_ids()
 
-    - Extracts latitude and longitude from the 'geometry' field.
-    - Processes the 'routes_served' field to standardize route information. This involves splitting the routes on commas and semicolons, mapping each route to a color using the 'map_color_to_citylink' function, and consolidating routes served per stop.
-    - Rearranges the columns, placing 'routes_served' into a specific position.
+
+@task
+async def download_mta_bus_stop_object_ids_async(
+    layer_url=MD_TRANSIT_BUS_STOPS_URL,
+):
+    """
+    Asynchronous version of `download_mta_bus_stop_object_ids`, which
+    requests the object IDs in a worker thread.
 
     Parameters:
-        gdf (GeoDataFrame): A GeoDataFrame containing MTA bus stops data with fields including 'geometry' and 'routes_served'.
+        layer_url (str): The URL of the FeatureServer layer holding the bus stops.
 
     Returns:
-        GeoDataFrame: The transformed GeoDataFrame with additional latitude and longitude fields, and a modified 'routes_served' field reflecting individual routes served per bus stop.
+        list: The sorted object IDs.
+    """
+    return await asyncio.to_thread(FeatureLayer(layer_url).object_ids)
 
-    Raises:
-        Any exceptions raised by the function are not explicitly mentioned in the docstring.
+
+@transform_task
+def apply_mta_bus_stop_changes(
+    stored_stops, changed_stops, object_ids, key="objectid"
+):
+    """
+    Applies downloaded changes to previously stored MTA bus stops data.
+
+    Stops in `changed_stops` replace any stored stop with the same key, and
+    stored stops whose key is no longer in `object_ids` are deleted.
+
+    Parameters:
+        stored_stops (GeoDataFrame): The transformed MTA bus stops data from the previous run.
+        changed_stops (GeoDataFrame): The transformed stops edited since the previous run.
+        object_ids (list): The object IDs of every stop currently in the layer.
+        key (str): The object ID column.
+
+    Returns:
+        GeoDataFrame: The updated MTA bus stops data, sorted by key.
+    """
+    changed_keys = changed_stops[key] if len(changed_stops) else []
+    replaced = stored_stops[key].isin(changed_keys)
+    current = stored_stops[key].isin(object_ids)
+    unchanged = stored_stops[~replaced & current]
+    print(
+        f"Upserting {len(changed_stops)} and deleting {(~current).sum()} "
+        "MTA bus stops"
+    )
+    frames = [frame for frame in [unchanged, changed_stops] if len(frame)]
+    if not frames:
+        return stored_stops.iloc[:0]
+    updated = pd.concat(frames, ignore_index=True)
+    updated = updated.sort_values(key, ignore_index=True)
+    return gpd.GeoDataFrame(updated, crs=stored_stops.crs)
+
+
+def explode_routes_served(stops):
     """
+    Splits the 'routes_served' field into one row per stop and route.
 
-    gdf["latitude"] = gdf["geometry"].y
-    gdf["longitude"] = gdf["geometry"].x
-    route_stop = gdf[["stop_id", "routes_served"]].copy()
+    Routes are split on commas and semicolons, stripped, and mapped to their
+    full CityLink names with `map_color_to_citylink`. Stops without any
+    routes are dropped.
+
+    Parameters:
+        stops (DataFrame): A DataFrame with 'stop_id' and 'routes_served' fields.
+
+    Returns:
+        DataFrame: A long DataFrame with one row per ('stop_id', 'route') pair, in the order the routes are listed for each stop.
+    """
+    route_stop = stops[["stop_id", "routes_served"]].copy()
 
     # We need to split on commas and semicolons
     route_stop["routes_served"] = route_stop["routes_served"].str.split(",")
@@ -355,14 +628,68 @@ def transform_mta_bus_stops(gdf):
     route_stop["routes_served"] = route_stop["routes_served"].apply(
         map_color_to_citylink
     )
+    route_stop = route_stop[
+        route_stop["routes_served"].notna()
+        & (route_stop["routes_served"] != "")
+    ]
+    return pd.DataFrame(
+        route_stop.rename(columns={"routes_served": "route"})
+    ).reset_index(drop=True)
+
+
+def extract_point_coordinates(geometry):
+    """
+    Extracts the coordinates of point geometries in one vectorized call.
+
+    Parameters:
+        geometry (GeoSeries): A GeoSeries of points.
+
+    Returns:
+        numpy.ndarray: An array of shape (n, 2) holding x and y for each point, with NaN for missing or empty geometries.
+    """
+    geometries = np.asarray(geometry.values, dtype=object)
+    present = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+    coordinates = np.full((len(geometries), 2), np.nan)
+    coordinates[present] = shapely.get_coordinates(geometries[present])
+    return coordinates
+
+
+@transform_task
+def transform_mta_bus_stops(gdf):
+    """
+    Transforms a GeoDataFrame containing MTA bus stops data.
+
+    This function performs several transformations on the MTA bus stops data:
+
+    - Extracts latitude and longitude from the 'geometry' field in one vectorized pass.
+    - Projects the coordinates to Maryland State Plane (EPSG:26985, meters) and stores them as 'state_plane_x' and 'state_plane_y', so metric distance work never has to reproject.
+    - Processes the 'routes_served' field to standardize route information. This involves splitting the routes on commas and semicolons, mapping each route to a color using the 'map_color_to_citylink' function, and consolidating routes served per stop into a comma-separated string.
+    - Rearranges the columns, placing 'routes_served' into a specific position.
+
+    Parameters:
+        gdf (GeoDataFrame): A GeoDataFrame containing MTA bus stops data with fields including 'geometry' and 'routes_served'.
+
+    Returns:
+        GeoDataFrame: The transformed GeoDataFrame with additional latitude, longitude and state plane coordinate fields, and a modified 'routes_served' field reflecting individual routes served per bus stop.
+
+    Raises:
+        Any exceptions raised by the function are not explicitly mentioned in the docstring.
+    """
+
+    coordinates = extract_point_coordinates(gdf["geometry"])
+    gdf["latitude"] = coordinates[:, 1]
+    gdf["longitude"] = coordinates[:, 0]
+    gdf["state_plane_x"], gdf["state_plane_y"] = project_to_state_plane(
+        coordinates[:, 0], coordinates[:, 1]
+    )
+    route_stop = explode_routes_served(gdf)
     # Re-join the routes served by stop into a df with one row per stop: route_stop, routes_served
     route_stop = (
-        route_stop.groupby("stop_id")["routes_served"]
-        .apply(list)
+        route_stop.groupby("stop_id")["route"]
+        .apply(", ".join)
         .reset_index()
+        .rename(columns={"route": "routes_served"})
     )
-    # Remove the brackets from the list of routes served
-    route_stop["routes_served"] = route_stop["routes_served"].str.strip("[]")
     # Drop routes_served from the original gdf
     gdf = gdf.drop(columns=["routes_served"])
     # Merge the routes served by stop back into the original gdf
@@ -370,3 +697,26 @@ def transform_mta_bus_stops(gdf):
     # Shift routes_served to position 6
     gdf.insert(6, "routes_served", gdf.pop("routes_served"))
     return gdf
+
+
+@transform_task
+def create_stop_route_bridge(stops):
+    """
+    Builds the normalized stop-route bridge table from the MTA bus stops data.
+
+    The bridge has one row per distinct ('stop_id', 'route') pair. Rows are
+    sorted by route and then stop so that each route forms a single run, and
+    'route' is stored as a categorical column so parquet writes it
+    dictionary-encoded. Looking up the stops on a route, or the routes at a
+    stop, is then a plain column filter.
+
+    Parameters:
+        stops (DataFrame): MTA bus stops data with 'stop_id' and 'routes_served' fields.
+
+    Returns:
+        DataFrame: The bridge table with columns 'stop_id' and 'route'.
+    """
+    bridge = explode_routes_served(stops).drop_duplicates()
+    bridge = bridge.sort_values(["route", "stop_id"], ignore_index=True)
+    bridge["route"] = bridge["route"].astype("category")
+    return bridge
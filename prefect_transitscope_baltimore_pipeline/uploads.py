@@ -0,0 +1,431 @@
+"""Concurrent S3 uploads that skip the files the bucket already holds"""
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from prefect_transitscope_baltimore_pipeline.manifest import (
+    content_hash,
+    read_manifest,
+)
+from prefect_transitscope_baltimore_pipeline.parquet_profiles import (
+    get_parquet_profile,
+    write_parquet,
+)
+
+# The S3 bucket the flows upload to
+TRANSITSCOPE_BUCKET = "transitscope-baltimore"
+
+# The object metadata key holding the uploaded file's SHA-256
+CONTENT_HASH_METADATA_KEY = "sha256"
+
+# Files larger than this are uploaded in parts of `DEFAULT_MULTIPART_CHUNKSIZE`
+DEFAULT_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+
+# Parts of one file uploaded at once
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Files uploaded at once
+DEFAULT_UPLOAD_WORKERS = 8
+
+
+def transfer_config(
+    multipart_threshold=DEFAULT_MULTIPART_THRESHOLD,
+    multipart_chunksize=DEFAULT_MULTIPART_CHUNKSIZE,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+):
+    """
+    Returns the boto3 transfer settings for one file's upload.
+
+    Parameters:
+        multipart_threshold (int): Upload files of at least this many bytes in parts.
+        multipart_chunksize (int): The size of each part in bytes.
+        max_concurrency (int): The most parts of a file uploaded at once.
+
+    Returns:
+        TransferConfig: The settings.
+    """
+    return TransferConfig(
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=multipart_chunksize,
+        max_concurrency=max_concurrency,
+        use_threads=max_concurrency > 1,
+    )
+
+
+def client_config(
+    max_workers=DEFAULT_UPLOAD_WORKERS, max_concurrency=DEFAULT_MAX_CONCURRENCY
+):
+    """
+    Returns the botocore settings for an S3 client shared by concurrent
+    uploads, with a pooled connection for every part that can be in flight
+    at once. botocore's default pool of 10 would otherwise make the upload
+    threads wait for connections, and log warnings as it discards them.
+
+    Parameters:
+        max_workers (int): The most files uploaded at once, as in `upload_files_if_changed`.
+        max_concurrency (int): The most parts of a file uploaded at once, as in `transfer_config`.
+
+    Returns:
+        Config: The settings, passed as the `config` of `boto3.client`.
+
+    Examples:
+        >>> s3 = boto3.client("s3", config=client_config())
+    """
+    return Config(max_pool_connections=max_workers * max_concurrency)
+
+
+def upload_file_if_changed(
+    client, path, bucket, key=None, manifest=None, config=None
+):
+    """
+    Uploads a file to S3 unless the object at its key already has the same
+    content.
+
+    The file's SHA-256, taken from the manifest when its entry is current,
+    is compared with the hash stored in the object's metadata at upload,
+    fetched with one HEAD request. The upload is skipped when they match.
+
+    Parameters:
+        client (botocore.client.S3): The S3 client.
+        path (str or Path): The file.
+        bucket (str): The bucket.
+        key (str, optional): The object key. Defaults to the file's path.
+        manifest (dict, optional): The manifest, if it has been read already.
+        config (TransferConfig, optional): The transfer settings. Defaults to `transfer_config()`.
+
+    Returns:
+        dict: The object 'key', the file's 'bytes' and whether it was 'uploaded'.
+    """
+    path = Path(path)
+    key = key or path.as_posix()
+    digest = content_hash(path, manifest)
+    try:
+        metadata = client.head_object(Bucket=bucket, Key=key)["Metadata"]
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        metadata = {}
+    uploaded = metadata.get(CONTENT_HASH_METADATA_KEY) != digest
+    if uploaded:
+        client.upload_file(
+            Filename=str(path),
+            Bucket=bucket,
+            Key=key,
+            ExtraArgs={"Metadata": {CONTENT_HASH_METADATA_KEY: digest}},
+            Config=config or transfer_config(),
+        )
+    return {"key": key, "bytes": path.stat().st_size, "uploaded": uploaded}
+
+
+def upload_files_if_changed(
+    client,
+    paths,
+    bucket=TRANSITSCOPE_BUCKET,
+    last=(),
+    config=None,
+    max_workers=DEFAULT_UPLOAD_WORKERS,
+    root=None,
+):
+    """
+    Uploads files to S3 at keys matching their paths, skipping the files
+    whose content the bucket already holds, and prints the bytes uploaded
+    and skipped.
+
+    Up to `max_workers` files are uploaded at once, each in up to
+    `config.max_concurrency` parts at once if it is larger than
+    `config.multipart_threshold`. The files in `last`, such as the manifest
+    describing the others, are uploaded once the others are in the bucket.
+
+    Parameters:
+        client (botocore.client.S3): The S3 client, which is shared by the upload threads.
+        paths (list): The files.
+        bucket (str): The bucket.
+        last (list): Files to upload after the others.
+        config (TransferConfig, optional): The transfer settings for each file. Defaults to `transfer_config()`.
+        max_workers (int): The most files uploaded at once.
+        root (str or Path, optional): Upload each file at its path relative to this directory instead.
+
+    Returns:
+        dict: The number of files and bytes 'uploaded' and 'skipped', as 'uploaded_files', 'uploaded_bytes', 'skipped_files' and 'skipped_bytes'.
+
+    Examples:
+        >>> upload_files_if_changed(
+        ...     s3.meta.client,
+        ...     ["data/mta_bus_stops.parquet"],
+        ...     last=["data/manifest.json"],
+        ... )
+        Uploaded 1 files (2,311 bytes), skipped 1 unchanged files (412,339 bytes)
+    """
+    manifest = read_manifest()
+    config = config or transfer_config()
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in [paths, last]:
+            results += executor.map(
+                lambda path: upload_file_if_changed(
+                    client,
+                    path,
+                    bucket,
+                    key=(
+                        None
+                        if root is None
+                        else Path(path).relative_to(root).as_posix()
+                    ),
+                    manifest=manifest,
+                    config=config,
+                ),
+                batch,
+            )
+    summary = dict.fromkeys(
+        ["uploaded_files", "uploaded_bytes", "skipped_files", "skipped_bytes"],
+        0,
+    )
+    for result in results:
+        outcome = "uploaded" if result["uploaded"] else "skipped"
+        summary[f"{outcome}_files"] += 1
+        summary[f"{outcome}_bytes"] += result["bytes"]
+    print(
+        f"Uploaded {summary['uploaded_files']} files "
+        f"({summary['uploaded_bytes']:,} bytes), skipped "
+        f"{summary['skipped_files']} unchanged files "
+        f"({summary['skipped_bytes']:,} bytes)"
+    )
+    return summary
+
+
+def read_published_manifest(client, key, bucket=TRANSITSCOPE_BUCKET):
+    """
+    Reads the manifest last uploaded to S3, which describes the files as of
+    that upload.
+
+    Parameters:
+        client (botocore.client.S3): The S3 client.
+        key (str): The manifest's object key.
+        bucket (str): The bucket.
+
+    Returns:
+        dict: The entry of each published file, keyed by its path, or an empty dict if no manifest has been uploaded.
+    """
+    try:
+        body = client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        return {}
+    return json.loads(body)
+
+
+class S3UploadStream(io.RawIOBase):
+    """
+    A writable file object that uploads what is written to it to an S3
+    object, holding at most one part in memory.
+
+    Writes are buffered and uploaded as parts of a multipart upload once
+    `part_size` bytes have accumulated; an object smaller than one part is
+    uploaded with a single PUT when the stream is closed. The SHA-256 of the
+    content, stored in the object's metadata as `upload_file_if_changed`
+    does, is only known once the last byte is written, so a multipart
+    object gets it from a server-side copy onto itself.
+
+    The object appears when the stream is closed. If the `with` block the
+    stream is used in raises, the multipart upload is aborted and no object
+    is written.
+
+    Parameters:
+        client (botocore.client.S3): The S3 client.
+        bucket (str): The bucket.
+        key (str): The object key.
+        part_size (int): The size of each part in bytes, at least 5 MiB.
+        local_copy (str or Path, optional): Also write the content to this file, which is renamed into place when the upload completes.
+
+    Examples:
+        >>> with S3UploadStream(client, TRANSITSCOPE_BUCKET, key) as stream:
+        ...     table.to_parquet(stream)
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket,
+        key,
+        part_size=DEFAULT_MULTIPART_CHUNKSIZE,
+        local_copy=None,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.local_copy = Path(local_copy) if local_copy else None
+        self.bytes = 0
+        self._buffer = bytearray()
+        self._digest = hashlib.sha256()
+        self._upload_id = None
+        self._parts = []
+        self._local = None
+        if self.local_copy is not None:
+            self.local_copy.parent.mkdir(parents=True, exist_ok=True)
+            self._local_temporary = self.local_copy.with_name(
+                f".{self.local_copy.name}.{os.getpid()}.tmp"
+            )
+            self._local = open(self._local_temporary, "wb")
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed S3UploadStream")
+        data = bytes(data)
+        self._buffer += data
+        self._digest.update(data)
+        self.bytes += len(data)
+        if self._local is not None:
+            self._local.write(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(self._buffer[: self.part_size])
+            del self._buffer[: self.part_size]
+        return len(data)
+
+    @property
+    def content_hash(self):
+        """The hex SHA-256 of the content written so far."""
+        return self._digest.hexdigest()
+
+    def close(self):
+        """Finishes the upload, and the local copy if there is one."""
+        if self.closed:
+            return
+        metadata = {CONTENT_HASH_METADATA_KEY: self.content_hash}
+        try:
+            if self._upload_id is None:
+                self.client.put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=bytes(self._buffer),
+                    Metadata=metadata,
+                )
+            else:
+                if self._buffer:
+                    self._upload_part(self._buffer)
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={"Parts": self._parts},
+                )
+                self._upload_id = None
+                self.client.copy_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    CopySource={"Bucket": self.bucket, "Key": self.key},
+                    Metadata=metadata,
+                    MetadataDirective="REPLACE",
+                )
+            self._buffer.clear()
+            if self._local is not None:
+                self._local.close()
+                os.replace(self._local_temporary, self.local_copy)
+        except BaseException:
+            self.abort()
+            raise
+        super().close()
+
+    def abort(self):
+        """Abandons the upload and the local copy without writing either."""
+        if self._upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+            )
+            self._upload_id = None
+        if self._local is not None:
+            self._local.close()
+            self._local_temporary.unlink(missing_ok=True)
+        self._buffer.clear()
+        super().close()
+
+    def __del__(self):
+        # Never publish a partial object from a stream left unclosed
+        if not self.closed:
+            self.abort()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _upload_part(self, data):
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key
+            )["UploadId"]
+        number = len(self._parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=number,
+            Body=bytes(data),
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": number})
+
+
+def stream_parquet_to_s3(
+    frame,
+    client,
+    key,
+    bucket=TRANSITSCOPE_BUCKET,
+    profile=None,
+    index=None,
+    local_copy=None,
+    part_size=DEFAULT_MULTIPART_CHUNKSIZE,
+):
+    """
+    Writes a DataFrame, or a GeoDataFrame as GeoParquet, with an output
+    profile straight to an S3 object, without a file on local disk, and
+    prints its size and write time.
+
+    The parquet bytes are uploaded in parts as they are written, with the
+    content hash `upload_file_if_changed` compares, so a later upload of an
+    identical local copy is skipped.
+
+    Parameters:
+        frame (DataFrame or GeoDataFrame): The data.
+        client (botocore.client.S3): The S3 client.
+        key (str): The object key.
+        bucket (str): The bucket.
+        profile (str or ParquetProfile, optional): The output profile. Defaults to `DEFAULT_PARQUET_PROFILE`.
+        index (bool, optional): Whether to write the index, as in `DataFrame.to_parquet`.
+        local_copy (str or Path, optional): Also write the file here.
+        part_size (int): The size of each uploaded part in bytes, at least 5 MiB.
+
+    Returns:
+        dict: The 'profile', 'bytes', 'write_seconds' and 'content_hash' of the object.
+
+    Examples:
+        >>> stream_parquet_to_s3(stops, s3.meta.client, "data/mta_bus_stops.parquet")
+        Streamed s3://transitscope-baltimore/data/mta_bus_stops.parquet with the interactive profile: 412,339 bytes in 0.31s
+    """
+    profile = get_parquet_profile(profile)
+    start = time.perf_counter()
+    with S3UploadStream(client, bucket, key, part_size, local_copy) as stream:
+        report = write_parquet(frame, stream, profile, index, quiet=True)
+    report["write_seconds"] = time.perf_counter() - start
+    report["content_hash"] = stream.content_hash
+    print(
+        f"Streamed s3://{bucket}/{key} with the {profile.name} profile: "
+        f"{report['bytes']:,} bytes in {report['write_seconds']:.2f}s"
+    )
+    return report
@@ -0,0 +1,178 @@
+"""Local DuckDB warehouse the flows load their outputs into"""
+from pathlib import Path
+
+import duckdb
+import geopandas as gpd
+import pandas as pd
+
+# The DuckDB database file
+WAREHOUSE_PATH = Path("data/transitscope.duckdb")
+
+# The key each warehouse table is upserted on
+WAREHOUSE_TABLES = {
+    "mta_bus_ridership": ("route", "date"),
+    "mta_bus_stops": ("stop_id",),
+    "mta_bus_stop_routes": ("stop_id", "route"),
+}
+
+
+def connect(path=None, read_only=False):
+    """
+    Opens the warehouse.
+
+    Parameters:
+        path (str or Path, optional): The database file. Defaults to `WAREHOUSE_PATH`.
+        read_only (bool): Open the database for reading only.
+
+    Returns:
+        duckdb.DuckDBPyConnection: The connection.
+    """
+    path = Path(path or WAREHOUSE_PATH)
+    if not read_only:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    return duckdb.connect(str(path), read_only=read_only)
+
+
+def load_table(frame, table, path=None, delete_missing=False):
+    """
+    Upserts a frame into a warehouse table on the table's key, creating the
+    table, or adding columns to it, as needed. Columns whose type differs
+    from the table's, and rows sharing a key, are rejected rather than
+    cast or silently collapsed into one row.
+
+    Loading is idempotent: loading the same rows again replaces them with
+    themselves. Rows are inserted in key order, so DuckDB's zone maps (the
+    min/max of each column per row group) let queries filtering on the key
+    skip most of the table. GeoDataFrame geometries are stored as WKB.
+
+    Parameters:
+        frame (DataFrame or GeoDataFrame): The rows, unique on the table's key.
+        table (str): The table, one of `WAREHOUSE_TABLES`.
+        path (str or Path, optional): The database file. Defaults to `WAREHOUSE_PATH`.
+        delete_missing (bool): Delete the rows whose key is not in `frame`, for tables loaded in full.
+
+    Returns:
+        dict: The number of rows 'upserted' and 'deleted'.
+
+    Raises:
+        ValueError: If the table is unknown, `frame` holds rows sharing a key, or a column's type differs from the table's.
+
+    Examples:
+        >>> load_table(bus_ridership_data, "mta_bus_ridership")
+        Loaded mta_bus_ridership: 13542 rows upserted, 0 deleted
+    """
+    if table not in WAREHOUSE_TABLES:
+        raise ValueError(
+            f"Unknown warehouse table {table!r}; "
+            f"expected one of {list(WAREHOUSE_TABLES)}"
+        )
+    key = WAREHOUSE_TABLES[table]
+    if frame.empty:
+        print(f"No rows to load into {table}")
+        return {"upserted": 0, "deleted": 0}
+    incoming = _to_warehouse_frame(frame).sort_values(list(key))
+    # INSERT OR REPLACE would keep one row per key and count them all
+    duplicated = incoming.duplicated(list(key), keep=False)
+    if duplicated.any():
+        raise ValueError(
+            f"{duplicated.sum()} rows loaded into {table} share a key on "
+            f"{list(key)}, such as "
+            f"{incoming.loc[duplicated, list(key)].iloc[0].tolist()}"
+        )
+    with connect(path) as connection:
+        connection.register("incoming", incoming)
+        columns = connection.execute(
+            "DESCRIBE SELECT * FROM incoming"
+        ).fetchall()
+        existing = dict(
+            connection.execute(
+                "SELECT column_name, data_type "
+                "FROM information_schema.columns WHERE table_name = ?",
+                [table],
+            ).fetchall()
+        )
+        # DuckDB would cast the values to the table's types, or fail partway,
+        # so a changed type is rejected before anything is written. Columns
+        # holding only nulls fit any type.
+        drifted = [
+            f"{name} ({existing[name]}, loading {type_})"
+            for name, type_, *_ in columns
+            if name in existing
+            and type_ != existing[name]
+            and incoming[name].notna().any()
+        ]
+        if drifted:
+            raise ValueError(
+                f"Column types differ from the {table} table's: "
+                + ", ".join(drifted)
+            )
+        connection.execute("BEGIN TRANSACTION")
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            + ", ".join(f'"{name}" {type_}' for name, type_, *_ in columns)
+            + f", PRIMARY KEY ({_column_list(key)}))"
+        )
+        for name, type_, *_ in columns:
+            # A table created just now already has every column
+            if existing and name not in existing:
+                connection.execute(
+                    f'ALTER TABLE {table} ADD COLUMN "{name}" {type_}'
+                )
+        deleted = 0
+        if delete_missing:
+            match = " AND ".join(
+                f'incoming."{name}" = {table}."{name}"' for name in key
+            )
+            (deleted,) = connection.execute(
+                f"DELETE FROM {table} WHERE NOT EXISTS "
+                f"(SELECT 1 FROM incoming WHERE {match})"
+            ).fetchone()
+        connection.execute(
+            f"INSERT OR REPLACE INTO {table} BY NAME SELECT * FROM incoming"
+        )
+        connection.execute("COMMIT")
+    counts = {"upserted": len(incoming), "deleted": deleted}
+    print(
+        f"Loaded {table}: {counts['upserted']} rows upserted, "
+        f"{counts['deleted']} deleted"
+    )
+    return counts
+
+
+def query(sql, parameters=None, path=None):
+    """
+    Runs a SQL query against the warehouse.
+
+    Parameters:
+        sql (str): The query.
+        parameters (list, optional): Values for the query's `?` placeholders.
+        path (str or Path, optional): The database file. Defaults to `WAREHOUSE_PATH`.
+
+    Returns:
+        DataFrame: The result.
+
+    Examples:
+        >>> query(
+        ...     "SELECT route, sum(ridership) AS ridership "
+        ...     "FROM mta_bus_ridership WHERE date >= ? "
+        ...     "GROUP BY route ORDER BY ridership DESC",
+        ...     ["2023-01-01"],
+        ... )
+    """
+    with connect(path, read_only=True) as connection:
+        return connection.execute(sql, parameters).df()
+
+
+def _to_warehouse_frame(frame):
+    frame = pd.DataFrame(frame)
+    for name, column in frame.items():
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # DuckDB would store categories as an ENUM, which rejects new ones
+            frame[name] = column.astype(column.cat.categories.dtype)
+        elif isinstance(column.dtype, gpd.array.GeometryDtype):
+            frame[name] = gpd.GeoSeries(column).to_wkb()
+    return frame.reset_index(drop=True)
+
+
+def _column_list(names):
+    return ", ".join(f'"{name}"' for name in names)
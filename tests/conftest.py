@@ -1,3 +1,11 @@
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import pandas as pd
 import pytest
 from prefect.testing.utilities import prefect_test_harness
 
@@ -11,6 +19,67 @@ def prefect_db():
         yield
 
 
+@pytest.fixture(autouse=True)
+def http_cache_dir(tmp_path, monkeypatch):
+    """
+    Keeps each test's HTTP response cache in its own temporary directory.
+    """
+    from prefect_transitscope_baltimore_pipeline import http_client
+
+    cache_dir = tmp_path / "http_cache"
+    monkeypatch.setattr(http_client, "HTTP_CACHE_DIR", cache_dir)
+    return cache_dir
+
+
+@pytest.fixture(autouse=True)
+def task_cache_ledger(tmp_path, monkeypatch):
+    """
+    Keeps each test's record of cached task run times in its own file.
+    """
+    from prefect_transitscope_baltimore_pipeline import caching
+
+    path = tmp_path / "task_cache_ledger.json"
+    monkeypatch.setattr(caching, "TASK_CACHE_LEDGER_PATH", path)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def data_store_dir(tmp_path, monkeypatch):
+    """
+    Keeps the frames each test passes between tasks in its own directory.
+    """
+    from prefect_transitscope_baltimore_pipeline import datastore
+
+    store_dir = tmp_path / "store"
+    monkeypatch.setattr(datastore, "DATA_STORE_DIR", store_dir)
+    return store_dir
+
+
+@pytest.fixture(autouse=True)
+def warehouse_path(tmp_path, monkeypatch):
+    """
+    Keeps each test's DuckDB warehouse in its own file.
+    """
+    from prefect_transitscope_baltimore_pipeline import warehouse
+
+    path = tmp_path / "transitscope.duckdb"
+    monkeypatch.setattr(warehouse, "WAREHOUSE_PATH", path)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def manifest_path(tmp_path, monkeypatch):
+    """
+    Keeps each test's manifest of written files in its own file.
+    """
+    from prefect_transitscope_baltimore_pipeline import flows, manifest
+
+    path = tmp_path / "manifest.json"
+    monkeypatch.setattr(manifest, "MANIFEST_PATH", path)
+    monkeypatch.setattr(flows, "MANIFEST_PATH", path)
+    return path
+
+
 @pytest.fixture(autouse=True)
 def reset_object_registry():
     """
@@ -20,3 +89,184 @@ def reset_object_registry():
 
     with PrefectObjectRegistry():
         yield
+
+
+class FakeFeatureServer:
+    """
+    A local stand-in for an ArcGIS FeatureServer layer.
+
+    Serves the layer metadata, object-ID queries and GeoJSON feature queries
+    filtered by object-ID range and limited to `outFields`, and truncates
+    responses at `maxRecordCount` like the real server does. Every response
+    carries an `ETag`, and a matching `If-None-Match` is answered
+    `304 Not Modified`.
+    """
+
+    def __init__(self, features, metadata):
+        self.features = features
+        self.metadata = metadata
+        self.metadata_status = 200
+        self.requests = []
+        self.not_modified = 0
+
+    def handle(self, path, params):
+        self.requests.append((path, params))
+        if not path.endswith("/query"):
+            if self.metadata_status != 200:
+                return self.metadata_status, {}
+            return 200, self.metadata
+        features = self.query(params.get("where", "1=1"))
+        if params.get("returnIdsOnly") == "true":
+            return 200, {
+                "objectIdFieldName": "objectid",
+                "objectIds": [f["properties"]["objectid"] for f in features],
+            }
+        limit = self.metadata.get("maxRecordCount", 1000)
+        exceeded = len(features) > limit
+        features = features[:limit]
+        out_fields = params.get("outFields", "*")
+        if out_fields != "*":
+            # Field names are matched case-insensitively, like the server
+            fields = {name.strip().lower() for name in out_fields.split(",")}
+            features = [
+                {
+                    **f,
+                    "properties": {
+                        name: value
+                        for name, value in f["properties"].items()
+                        if name.lower() in fields
+                    },
+                }
+                for f in features
+            ]
+        if params.get("f") == "json":
+            return 200, self.esri_json(features, params, exceeded)
+        return 200, {
+            "type": "FeatureCollection",
+            "features": features,
+            "exceededTransferLimit": exceeded,
+        }
+
+    def esri_json(self, features, params, exceeded):
+        quantization = json.loads(params.get("quantizationParameters", "{}"))
+        tolerance = quantization.get("tolerance")
+
+        def geometry(feature):
+            x, y = feature["geometry"]["coordinates"]
+            if tolerance:
+                # Quantize with the origin at the upper left of the world
+                return {
+                    "x": round((x + 180) / tolerance),
+                    "y": round((90 - y) / tolerance),
+                }
+            return {"x": x, "y": y}
+
+        payload = {
+            "objectIdFieldName": "objectid",
+            "features": [
+                {"attributes": f["properties"], "geometry": geometry(f)}
+                for f in features
+            ],
+            "exceededTransferLimit": exceeded,
+        }
+        if tolerance:
+            payload["transform"] = {
+                "originPosition": "upperLeft",
+                "scale": [tolerance, tolerance, 0, 0],
+                "translate": [-180, 90, 0, 0],
+            }
+        return payload
+
+    def query(self, where):
+        features = self.features
+        match = re.search(
+            r"objectid >= (\d+) AND objectid <= (\d+)", where, re.IGNORECASE
+        )
+        if match:
+            first, last = int(match.group(1)), int(match.group(2))
+            features = [
+                f
+                for f in features
+                if first <= f["properties"]["objectid"] <= last
+            ]
+        match = re.search(r"(\w+) > TIMESTAMP '([^']+)'", where)
+        if match:
+            field = match.group(1)
+            since = pd.Timestamp(match.group(2)).value // 10**6
+            features = [f for f in features if f["properties"][field] > since]
+        return features
+
+
+def make_stop_features(count):
+    """Returns `count` GeoJSON bus stop features around Baltimore."""
+    return [
+        {
+            "type": "Feature",
+            "id": i,
+            "geometry": {
+                "type": "Point",
+                "coordinates": [-76.6 + i * 1e-4, 39.3 + i * 1e-4],
+            },
+            "properties": {
+                "objectid": i,
+                "stop_id": 1000 + i,
+                "stop_name": f"Stop {i}",
+                "routes_served": "BL, 22" if i % 2 else "LM",
+                # 2023-12-01
+                "last_edited_date": 1701388800000,
+            },
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+@pytest.fixture
+def feature_server():
+    """
+    Runs a `FakeFeatureServer` on a local port and yields it with its layer
+    URL set as `feature_server.url`.
+    """
+    server = FakeFeatureServer(
+        features=make_stop_features(25),
+        metadata={
+            "name": "Bus Stops",
+            "description": "MTA bus stops",
+            "objectIdField": "objectid",
+            "maxRecordCount": 10,
+            "editingInfo": {"lastEditDate": 1704067200000},
+            "editFieldsInfo": {"editDateField": "last_edited_date"},
+        },
+    )
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            status, payload = server.handle(
+                url.path, dict(parse_qsl(url.query))
+            )
+            body = json.dumps(payload).encode()
+            etag = f'"{hashlib.sha256(body).hexdigest()}"'
+            if status == 200 and self.headers.get("If-None-Match") == etag:
+                server.not_modified += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 200:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{httpd.server_port}/FeatureServer/9"
+    yield server
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,119 @@
+import pandas as pd
+import pytest
+
+from prefect_transitscope_baltimore_pipeline.arcgis import (
+    FeatureLayer,
+    FeatureServerError,
+    esri_json_to_geodataframe,
+)
+from prefect_transitscope_baltimore_pipeline.geojson_stream import (
+    parse_feature_collection,
+)
+
+
+def test_feature_layer_download_pages_concurrently(feature_server):
+    layer = FeatureLayer(feature_server.url, max_workers=4)
+    stops = layer.download()
+    assert layer.max_record_count == 10
+    assert stops["objectid"].tolist() == list(range(1, 26))
+    assert stops.columns[-1] == "geometry"
+    assert stops.geometry.x.iloc[0] == pytest.approx(-76.5999)
+    assert stops.crs == "EPSG:4326"
+
+
+def test_feature_layer_splits_truncated_pages(feature_server):
+    # The layer reports a larger page size than the server actually serves
+    layer = FeatureLayer(
+        feature_server.url,
+        metadata={"objectIdField": "objectid", "maxRecordCount": 25},
+    )
+    stops = layer.download()
+    assert stops["objectid"].tolist() == list(range(1, 26))
+
+
+def test_feature_layer_download_with_filter(feature_server):
+    layer = FeatureLayer(feature_server.url)
+    stops = layer.download(object_ids=[3, 4, 5])
+    assert stops["objectid"].tolist() == [3, 4, 5]
+
+
+def test_feature_layer_download_empty(feature_server):
+    feature_server.features = []
+    stops = FeatureLayer(feature_server.url).download()
+    assert stops.empty
+
+
+def test_feature_layer_raises_on_error_payload(feature_server):
+    feature_server.metadata = {"error": {"code": 400, "message": "Invalid"}}
+    with pytest.raises(FeatureServerError):
+        FeatureLayer(feature_server.url).metadata()
+
+
+def test_feature_layer_edited_since_filter(feature_server):
+    layer = FeatureLayer(feature_server.url)
+    assert layer.edited_since_filter("2024-01-01T05:00:00-05:00") == (
+        "last_edited_date > TIMESTAMP '2024-01-01 10:00:00'"
+    )
+    layer = FeatureLayer(feature_server.url, metadata={})
+    assert layer.edited_since_filter("2024-01-01") is None
+
+
+def test_feature_layer_quantized_download_matches_geojson(feature_server):
+    geojson = FeatureLayer(feature_server.url).download()
+    quantized = FeatureLayer(feature_server.url).download(
+        transfer_format="quantized"
+    )
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(quantized.drop(columns="geometry")),
+        pd.DataFrame(geojson.drop(columns="geometry")),
+    )
+    assert quantized.geometry.distance(geojson.geometry).max() < 1e-6
+
+
+@pytest.mark.parametrize(
+    "transfer_format, streamed_pages", [("geojson", 3), ("quantized", 0)]
+)
+def test_feature_layer_streams_only_geojson_pages(
+    feature_server, monkeypatch, transfer_format, streamed_pages
+):
+    parsed = []
+
+    def parse(chunks):
+        parsed.append(True)
+        return parse_feature_collection(chunks)
+
+    monkeypatch.setattr(
+        "prefect_transitscope_baltimore_pipeline.arcgis.parse_feature_collection",
+        parse,
+    )
+    stops = FeatureLayer(feature_server.url).download(
+        transfer_format=transfer_format
+    )
+    assert len(stops) == 25
+    assert len(parsed) == streamed_pages
+
+
+def test_feature_layer_rejects_unknown_transfer_format(feature_server):
+    with pytest.raises(
+        ValueError, match=r"expected one of \['geojson', 'quantized'\]"
+    ):
+        FeatureLayer(feature_server.url).download(transfer_format="pbf")
+
+
+def test_esri_json_to_geodataframe():
+    gdf = esri_json_to_geodataframe(
+        {
+            "features": [
+                {"attributes": {"objectid": 1}, "geometry": {"x": 10, "y": 5}},
+                {"attributes": {"objectid": 2}},
+            ],
+            "transform": {
+                "originPosition": "upperLeft",
+                "scale": [0.5, 0.5, 0, 0],
+                "translate": [-77, 40, 0, 0],
+            },
+        }
+    )
+    assert gdf.columns.tolist() == ["objectid", "geometry"]
+    assert (gdf.geometry.x.iloc[0], gdf.geometry.y.iloc[0]) == (-72, 37.5)
+    assert gdf.geometry.iloc[1] is None
@@ -0,0 +1,74 @@
+import boto3
+from moto import mock_aws
+
+from prefect_transitscope_baltimore_pipeline.benchmarks import (
+    benchmark_geojson_ingestion,
+    compare_parquet_profiles,
+    compare_result_serializers,
+    compare_transfer_formats,
+    compare_upload_configs,
+    compare_viewport_reads,
+    make_synthetic_stops,
+)
+
+
+def test_compare_transfer_formats(feature_server):
+    report = compare_transfer_formats(feature_server.url)
+    assert report["transfer_format"].tolist() == ["geojson", "quantized"]
+    assert report["features"].tolist() == [25, 25]
+    geojson_bytes, quantized_bytes = report["bytes"].tolist()
+    assert quantized_bytes < geojson_bytes
+
+
+def test_benchmark_geojson_ingestion():
+    report = benchmark_geojson_ingestion(n_features=2_000, batch_size=500)
+    assert report["features"] == 2_000
+    assert report["peak_bytes"] > 0
+
+
+def test_compare_result_serializers():
+    report = compare_result_serializers(make_synthetic_stops(5_000))
+    assert report["serializer"].tolist() == ["pickle", "frame (zstd)"]
+    pickle_bytes, frame_bytes = report["bytes"].tolist()
+    assert frame_bytes < pickle_bytes / 2
+
+
+def test_compare_parquet_profiles():
+    report = compare_parquet_profiles(make_synthetic_stops(30_000))
+    assert report["profile"].tolist() == ["archive", "interactive"]
+    assert report["row_groups"].tolist() == [1, 30]
+    archive_bytes, interactive_bytes = report["bytes"].tolist()
+    assert archive_bytes < interactive_bytes
+
+
+def test_compare_viewport_reads():
+    report = compare_viewport_reads(make_synthetic_stops(5_000), n_viewports=5)
+    assert report["format"].tolist() == ["geoparquet", "flatgeobuf", "geojson"]
+    # Every format returns the same stops
+    assert report["features"].nunique() == 1
+    assert report["features"].iloc[0] > 0
+
+
+def test_compare_upload_configs():
+    report = compare_upload_configs(file_sizes=(6 << 20, 1024, 2048))
+    assert report["config"].tolist() == ["serial", "defaults", "tuned"]
+    assert report["files"].tolist() == [3, 3, 3]
+    assert (report["bytes"] == (6 << 20) + 3072).all()
+    assert (report["mb_per_second"] > 0).all()
+
+
+def test_compare_upload_configs_cleans_up_its_buckets(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="transitscope-baltimore")
+        keys = []
+        client.meta.events.register(
+            "provide-client-params.s3.HeadObject",
+            lambda params, **kwargs: keys.append(params["Key"]),
+        )
+        compare_upload_configs(file_sizes=(1024, 2048), client=client)
+        buckets = [item["Name"] for item in client.list_buckets()["Buckets"]]
+    assert buckets == ["transitscope-baltimore"]
+    assert sorted(set(keys)) == ["part-0.bin", "part-1.bin"]
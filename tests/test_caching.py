@@ -0,0 +1,118 @@
+import importlib.util
+import os
+import sys
+
+import geopandas as gpd
+import pandas as pd
+from prefect import flow
+from shapely.geometry import Point
+
+from prefect_transitscope_baltimore_pipeline.caching import (
+    code_fingerprint,
+    fingerprint,
+    read_task_cache_ledger,
+    record_task_run_time,
+    transform_task,
+)
+
+
+def test_fingerprint_data_frames():
+    frame = pd.DataFrame({"route": ["22", "BL"], "ridership": [10, 20]})
+    assert fingerprint(frame) == fingerprint(frame.copy())
+    assert fingerprint(frame) != fingerprint(frame.assign(ridership=[10, 21]))
+    assert fingerprint(frame) != fingerprint(
+        frame.rename(columns={"route": "line"})
+    )
+    assert fingerprint(frame) != fingerprint(
+        frame.astype({"ridership": float})
+    )
+    assert fingerprint(frame) != fingerprint(frame.iloc[::-1])
+    assert fingerprint(frame["route"]) == fingerprint(frame[["route"]])
+
+
+def test_fingerprint_geodata_frames_and_objects():
+    stops = gpd.GeoDataFrame(
+        {"routes": [["22", "BL"], None]},
+        geometry=[Point(0, 0), Point(1, 1)],
+        crs="EPSG:4326",
+    )
+    moved = stops.copy()
+    moved.geometry = [Point(0, 0), Point(1, 2)]
+    assert fingerprint(stops) == fingerprint(stops.copy())
+    assert fingerprint(stops) != fingerprint(moved)
+    assert fingerprint(stops) != fingerprint(stops.to_crs("EPSG:26985"))
+    assert fingerprint("objectid") == fingerprint("objectid")
+    assert fingerprint([1, 2]) != fingerprint([1, 3])
+
+
+def test_transform_task_is_cached(capsys, task_cache_ledger):
+    calls = []
+
+    @transform_task
+    def double_ridership(data_frame):
+        calls.append(len(data_frame))
+        return data_frame.assign(ridership=data_frame["ridership"] * 2)
+
+    @flow
+    def double_ridership_flow(data_frame):
+        return double_ridership(data_frame)
+
+    frame = pd.DataFrame({"ridership": [1, 2, 3]})
+    first = double_ridership_flow(frame)
+    second = double_ridership_flow(frame.copy())
+    pd.testing.assert_frame_equal(first, second)
+    assert calls == [3]
+    assert len(read_task_cache_ledger()) == 1
+    assert "Cache hit for double_ridership, saved" in capsys.readouterr().out
+
+    # Changed inputs are transformed again
+    third = double_ridership_flow(frame.iloc[:2])
+    assert third["ridership"].tolist() == [2, 4]
+    assert calls == [3, 2]
+    assert len(read_task_cache_ledger()) == 2
+
+
+def test_record_task_run_time_drops_expired_entries(task_cache_ledger):
+    record_task_run_time("old", 1.0, pd.Timedelta(-1, "s"))
+    record_task_run_time("new", 2.0, pd.Timedelta(1, "d"))
+    record_task_run_time("forever", 3.0, None)
+    assert set(read_task_cache_ledger()) == {"new", "forever"}
+    assert read_task_cache_ledger(task_cache_ledger)["new"]["seconds"] == 2.0
+
+
+def test_code_fingerprint_changes_with_constants_and_helpers(
+    tmp_path, monkeypatch
+):
+    path = tmp_path / "transforms.py"
+
+    def load(source, mtime):
+        path.write_text(source)
+        os.utime(path, (mtime, mtime))
+        spec = importlib.util.spec_from_file_location("transforms", path)
+        module = importlib.util.module_from_spec(spec)
+        monkeypatch.setitem(sys.modules, "transforms", module)
+        spec.loader.exec_module(module)
+        return module.transform
+
+    transform = (
+        "def transform(frame):\n"
+        "    return helper(frame, {column!r})\n\n\n"
+        "def helper(frame, column):\n"
+        "    return frame.drop(columns={dropped!r})\n"
+    )
+    # Each version is fingerprinted while it is the one on disk
+    first = load(transform.format(column="route", dropped="a"), 1)
+    fingerprints = {code_fingerprint(first)}
+    renamed = load(transform.format(column="line", dropped="a"), 2)
+    fingerprints.add(code_fingerprint(renamed))
+    # Renaming a column leaves the bytecode as it was
+    assert first.__code__.co_code == renamed.__code__.co_code
+    helper_changed = load(transform.format(column="route", dropped="b"), 3)
+    fingerprints.add(code_fingerprint(helper_changed))
+    assert len(fingerprints) == 3
+
+    # Without a source file, the compiled constants are hashed
+    namespace = {}
+    exec("def a():\n    return 'route'\n", namespace)
+    exec("def b():\n    return 'line'\n", namespace)
+    assert code_fingerprint(namespace["a"]) != code_fingerprint(namespace["b"])
@@ -0,0 +1,96 @@
+import os
+import pickle
+import time
+from datetime import timedelta
+
+import geopandas as gpd
+import pandas as pd
+from prefect import flow
+from shapely.geometry import Point
+
+from prefect_transitscope_baltimore_pipeline.caching import (
+    fingerprint,
+    transform_task,
+)
+from prefect_transitscope_baltimore_pipeline.datastore import (
+    DataHandle,
+    accepts_handles,
+    load_frame,
+    prune_data_store,
+)
+
+
+def make_ridership():
+    return pd.DataFrame(
+        {
+            "route": pd.Categorical(["22", "BL", "22"]),
+            "date": pd.to_datetime(["2023-01-01", "2023-01-01", "2023-02-01"]),
+            "ridership": [100, 200, 300],
+        },
+        index=[10, 11, 12],
+    )
+
+
+def test_data_handle_round_trip(data_store_dir):
+    ridership = make_ridership()
+    handle = DataHandle.from_frame(ridership)
+    assert handle.path.parent == data_store_dir
+    assert len(handle) == 3
+    assert handle.fingerprint == fingerprint(ridership)
+    pd.testing.assert_frame_equal(handle.load(), ridership)
+    assert handle.load(columns=["ridership"]).columns.tolist() == ["ridership"]
+    # Handles are small, and equal when their frames are
+    assert len(pickle.dumps(handle)) < 500
+    assert DataHandle.from_frame(ridership.copy()) == handle
+    assert len(list(data_store_dir.glob("*.arrow"))) == 1
+
+
+def test_data_handle_round_trip_geodata_frame():
+    stops = gpd.GeoDataFrame(
+        {"stop_id": [1, 2]},
+        geometry=[Point(-76.6, 39.3), None],
+        crs="EPSG:4326",
+    )
+    loaded = DataHandle.from_frame(stops).load()
+    assert isinstance(loaded, gpd.GeoDataFrame)
+    assert loaded.crs == "EPSG:4326"
+    pd.testing.assert_frame_equal(loaded, stops)
+
+
+def test_accepts_handles():
+    @accepts_handles
+    def drop_first(data_frame):
+        return data_frame.iloc[1:]
+
+    ridership = make_ridership()
+    assert isinstance(drop_first(ridership), pd.DataFrame)
+    result = drop_first(DataHandle.from_frame(ridership))
+    assert isinstance(result, DataHandle)
+    assert load_frame(result)["ridership"].tolist() == [200, 300]
+    assert accepts_handles(drop_first) is drop_first
+
+
+def test_transform_task_passes_handles():
+    @transform_task
+    def total_ridership(data_frame):
+        return data_frame.groupby("route", observed=True, as_index=False)[
+            "ridership"
+        ].sum()
+
+    @flow
+    def total_ridership_flow(ridership):
+        return total_ridership(DataHandle.from_frame(ridership))
+
+    result = total_ridership_flow(make_ridership())
+    assert isinstance(result, DataHandle)
+    assert result.load()["ridership"].tolist() == [400, 200]
+
+
+def test_prune_data_store(data_store_dir):
+    old = DataHandle.from_frame(make_ridership())
+    new = DataHandle.from_frame(make_ridership().iloc[:1])
+    week_ago = time.time() - timedelta(days=9).total_seconds()
+    os.utime(old.path, (week_ago, week_ago))
+    assert prune_data_store() == 1
+    assert not old.path.exists() and new.path.exists()
+    assert prune_data_store(store_dir=data_store_dir / "missing") == 0
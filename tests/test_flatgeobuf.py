@@ -0,0 +1,39 @@
+import geopandas as gpd
+import pandas as pd
+
+from prefect_transitscope_baltimore_pipeline.benchmarks import (
+    make_synthetic_stops,
+)
+from prefect_transitscope_baltimore_pipeline.flatgeobuf import (
+    read_flatgeobuf,
+    write_flatgeobuf,
+)
+
+
+def test_write_and_read_flatgeobuf(tmp_path):
+    stops = make_synthetic_stops(2_000)
+    path = tmp_path / "stops.fgb"
+    size = write_flatgeobuf(stops, path)
+    assert size == path.stat().st_size
+    assert [p.name for p in tmp_path.iterdir()] == ["stops.fgb"]
+
+    read = read_flatgeobuf(path)
+    assert read.crs == stops.crs
+    pd.testing.assert_frame_equal(
+        read.sort_values("objectid", ignore_index=True),
+        stops,
+        check_dtype=False,
+    )
+
+
+def test_read_flatgeobuf_bbox(tmp_path):
+    stops = make_synthetic_stops(2_000)
+    path = tmp_path / "stops.fgb"
+    write_flatgeobuf(stops, path, quiet=True)
+    read = read_flatgeobuf(
+        path, bbox=(-76.9, 39.1, -76.85, 39.1), columns=["stop_id"]
+    )
+    expected = stops.cx[-76.9:-76.85, 39.1:39.1]
+    assert sorted(read["stop_id"]) == sorted(expected["stop_id"])
+    assert list(read.columns) == ["stop_id", "geometry"]
+    assert isinstance(read, gpd.GeoDataFrame)
@@ -1,13 +1,46 @@
 import asyncio
-from unittest.mock import MagicMock, patch
+import hashlib
+import inspect
+import io
+import json
+import time
+from pathlib import Path
+from unittest.mock import patch
 
+import boto3
+import geopandas as gpd
 import pandas as pd
 import pytest
+import yaml
+from moto import mock_aws
+from prefect.blocks.system import Secret
 
+from prefect_transitscope_baltimore_pipeline.flatgeobuf import (
+    read_flatgeobuf,
+)
 from prefect_transitscope_baltimore_pipeline.flows import (
+    LEGACY_MTA_BUS_RIDERSHIP_KEY,
+    MTA_BUS_STOP_ROUTES_PATH,
+    MTA_BUS_STOPS_PATH,
+    compact_mta_bus_ridership_dataset,
     mta_bus_stops_flow,
+    mta_bus_stops_flow_async,
+    record_mta_bus_ridership_outputs,
+    run_all_prefect_transitscope_baltimore_pipeline_flows,
     scrape_and_transform_bus_route_ridership,
+    upload_mta_bus_ridership_to_s3,
+    upload_mta_bus_stops_to_s3,
+)
+from prefect_transitscope_baltimore_pipeline.manifest import read_manifest
+from prefect_transitscope_baltimore_pipeline.partitioned_dataset import (
+    MTA_BUS_RIDERSHIP_DATASET_PATH,
+    write_partitioned_dataset,
 )
+from prefect_transitscope_baltimore_pipeline.tasks import (
+    read_layer_state,
+    write_layer_state,
+)
+from prefect_transitscope_baltimore_pipeline.warehouse import query
 
 
 @patch("prefect_transitscope_baltimore_pipeline.flows.scrape")
@@ -56,39 +89,577 @@ def test_scrape_and_transform_bus_route_ridership(
 # -------------------------------------------------------- #
 
 
-# Mock function returning a simple DataFrame
-def mock_df(*args, **kwargs):
-    return pd.DataFrame({"mock_column": ["mock_data"]})
+def test_mta_bus_stops_flow(feature_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
 
+    # Run the flow against the local stand-in for the FeatureServer
+    result = mta_bus_stops_flow(layer_url=feature_server.url)
+
+    # Test assertions
+    assert isinstance(
+        result, pd.DataFrame
+    ), "The flow did not return a DataFrame."
+    assert not result.empty, "The returned DataFrame is empty."
+
+
+def test_mta_bus_stops_flow_reuses_cached_transform(
+    feature_server, tmp_path, monkeypatch, capsys
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+
+    first = mta_bus_stops_flow(layer_url=feature_server.url)
+    capsys.readouterr()
+    # The same stops downloaded again at a later time
+    second = mta_bus_stops_flow(
+        layer_url=feature_server.url, force_download=True
+    )
+    assert "Cache hit for transform_mta_bus_stops" in capsys.readouterr().out
+    assert second.columns.tolist() == first.columns.tolist()
+    assert second["download_date"].notna().all()
+
+
+def test_mta_bus_stops_flow_skips_unchanged_layer(
+    feature_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+
+    result = mta_bus_stops_flow(layer_url=feature_server.url)
+    assert len(result) == 25
+    assert (tmp_path / "data" / "mta_bus_stops.parquet").exists()
+    assert (tmp_path / "data" / "mta_bus_stops_state.json").exists()
+
+    # The layer has not been edited since, so nothing is downloaded
+    requests_before = len(feature_server.requests)
+    assert mta_bus_stops_flow(layer_url=feature_server.url) is None
+    assert len(feature_server.requests) == requests_before + 1
+
+    # Unless the download is forced
+    result = mta_bus_stops_flow(
+        layer_url=feature_server.url, force_download=True
+    )
+    assert len(result) == 25
+
+
+def test_mta_bus_stops_flow_applies_incremental_changes(
+    feature_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    mta_bus_stops_flow(layer_url=feature_server.url)
+
+    # Edit stop 3, delete stop 5 and add stop 26 after the first run
+    edited = 1706745600000  # 2024-02-01
+    features = {
+        f["properties"]["objectid"]: f for f in feature_server.features
+    }
+    features[3]["properties"].update(
+        routes_served="CityLink Red", last_edited_date=edited
+    )
+    del features[5]
+    new_stop = dict(features[4], id=26)
+    new_stop["properties"] = dict(
+        features[4]["properties"],
+        objectid=26,
+        stop_id=1026,
+        last_edited_date=edited,
+    )
+    features[26] = new_stop
+    feature_server.features = list(features.values())
+    feature_server.metadata["editingInfo"]["lastEditDate"] = edited
+    feature_server.requests.clear()
+
+    result = mta_bus_stops_flow(layer_url=feature_server.url)
+
+    feature_requests = [
+        params
+        for _, params in feature_server.requests
+        if "outFields" in params
+    ]
+    assert len(feature_requests) == 1
+    assert "last_edited_date > TIMESTAMP '2024-01-01 00:00:00'" in (
+        feature_requests[0]["where"]
+    )
+    assert result["objectid"].tolist() == [i for i in range(1, 27) if i != 5]
+    assert (
+        result.loc[result["objectid"] == 3, "routes_served"].iloc[0]
+        == "CityLink Red"
+    )
+    stop_routes = pd.read_parquet("data/mta_bus_stop_routes.parquet")
+    assert stop_routes.loc[
+        stop_routes["route"] == "CityLink Red", "stop_id"
+    ].tolist() == [1003]
+    assert 1005 not in stop_routes["stop_id"].tolist()
+
+
+async def test_mta_bus_stops_flow_async(feature_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+
+    result = await mta_bus_stops_flow_async(layer_url=feature_server.url)
+    assert result["objectid"].tolist() == list(range(1, 26))
+    assert (tmp_path / "data" / "mta_bus_stop_routes.parquet").exists()
+    assert await mta_bus_stops_flow_async(layer_url=feature_server.url) is None
+
+    # Delete a stop; the edits and the object IDs are downloaded together
+    feature_server.features = feature_server.features[1:]
+    feature_server.metadata["editingInfo"]["lastEditDate"] = 1706745600000
+    result = await mta_bus_stops_flow_async(layer_url=feature_server.url)
+    assert result["objectid"].tolist() == list(range(2, 26))
+    # No stop was edited, but the deletion still advances the layer state
+    assert read_layer_state()["last_edit_date"] == "2024-02-01T00:00:00+00:00"
+    assert await mta_bus_stops_flow_async(layer_url=feature_server.url) is None
+    pd.testing.assert_frame_equal(
+        result.drop(columns="download_date"),
+        gpd.read_parquet("data/mta_bus_stops.parquet").drop(
+            columns="download_date"
+        ),
+    )
+
+
+async def test_mta_bus_stops_flow_async_skips_unchanged_layer(
+    feature_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    await mta_bus_stops_flow_async(layer_url=feature_server.url)
+
+    # Only the metadata is requested; no object-ID or feature query
+    feature_server.requests.clear()
+    assert await mta_bus_stops_flow_async(layer_url=feature_server.url) is None
+    assert [path for path, _ in feature_server.requests] == [
+        "/FeatureServer/9"
+    ]
+
+
+async def test_mta_bus_stops_flow_async_writes_off_the_event_loop(
+    feature_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+
+    def slow_write(*args, **kwargs):
+        time.sleep(0.5)
+        return "stops"
 
-@pytest.fixture
-def mock_download_mta_bus_stops(monkeypatch):
-    mock = MagicMock(side_effect=mock_df)
     monkeypatch.setattr(
-        "prefect_transitscope_baltimore_pipeline.tasks.download_mta_bus_stops",
-        mock,
+        "prefect_transitscope_baltimore_pipeline.flows.write_mta_bus_stops",
+        slow_write,
     )
-    return mock
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.05)
+
+    ticker = asyncio.create_task(tick())
+    try:
+        assert (
+            await mta_bus_stops_flow_async(layer_url=feature_server.url)
+            == "stops"
+        )
+    finally:
+        ticker.cancel()
+    # The loop kept running while the stops were written
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.4
+
+
+def test_mta_bus_stops_flow_exports_flatgeobuf(
+    feature_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+
+    result = mta_bus_stops_flow(
+        layer_url=feature_server.url, export_flatgeobuf=True
+    )
+    exported = read_flatgeobuf("data/mta_bus_stops.fgb")
+    assert sorted(exported["objectid"]) == result["objectid"].tolist()
+    assert "data/mta_bus_stops.fgb" in read_manifest()
+
+    # Turning the export off removes the stale file, so it is not uploaded
+    mta_bus_stops_flow(layer_url=feature_server.url, force_download=True)
+    assert not (tmp_path / "data" / "mta_bus_stops.fgb").exists()
+    assert "data/mta_bus_stops.fgb" not in read_manifest()
+
+
+def test_mta_bus_stops_flow_loads_warehouse(
+    feature_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    mta_bus_stops_flow(layer_url=feature_server.url)
+
+    # Delete a stop; the warehouse drops it along with its routes
+    feature_server.features = feature_server.features[1:]
+    feature_server.metadata["editingInfo"]["lastEditDate"] = 1706745600000
+    result = mta_bus_stops_flow(layer_url=feature_server.url)
+
+    stops = query("SELECT stop_id FROM mta_bus_stops ORDER BY stop_id")
+    assert stops["stop_id"].tolist() == sorted(result["stop_id"])
+    stop_routes = query("SELECT DISTINCT stop_id FROM mta_bus_stop_routes")
+    assert 1001 not in stop_routes["stop_id"].tolist()
+
+
+def test_mta_bus_stops_flow_records_manifest(
+    feature_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    result = mta_bus_stops_flow(layer_url=feature_server.url)
+
+    manifest = read_manifest()
+    entry = manifest["data/mta_bus_stops.parquet"]
+    assert entry["rows"] == len(result)
+    assert entry["run_id"] is not None
+    assert entry["max_date"] is not None
+    assert manifest["data/mta_bus_stop_routes.parquet"]["rows"] > 0
+
+
+def test_compact_mta_bus_ridership_dataset_updates_manifest(
+    tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    for dates in [["2023-01-01"], ["2023-01-01", "2023-01-02"]]:
+        write_partitioned_dataset(
+            pd.DataFrame(
+                {"date": pd.to_datetime(dates), "route": "22", "ridership": 1}
+            ).assign(ridership=lambda frame: range(len(frame))),
+            MTA_BUS_RIDERSHIP_DATASET_PATH,
+        )
+    record_mta_bus_ridership_outputs()
+    assert len(read_manifest()) == 2
+
+    assert compact_mta_bus_ridership_dataset() == 1
+    manifest = read_manifest()
+    assert list(manifest) == [
+        "data/mta_bus_ridership/year=2023/month=1/part-0.parquet"
+    ]
+    assert manifest[list(manifest)[0]]["rows"] == 2
+    assert manifest[list(manifest)[0]]["max_date"] == "2023-01-02T00:00:00"
 
 
 @pytest.fixture
-def mock_transform_mta_bus_stops(monkeypatch):
-    mock = MagicMock(side_effect=mock_df)
+async def ridership_bucket(tmp_path, monkeypatch, manifest_path):
+    """
+    A moto bucket holding a published ridership dataset of two files, both
+    listed in the published manifest, and one object the manifest does not
+    list.
+    """
+    monkeypatch.chdir(tmp_path)
+    for name in ["aws-access-key-id", "aws-secret-access-key"]:
+        await Secret(value="testing").save(name, overwrite=True)
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    published = [
+        "data/mta_bus_ridership/year=2023/month=1/part-0.parquet",
+        "data/mta_bus_ridership/year=2023/month=1/part-1.parquet",
+    ]
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="transitscope-baltimore")
+        for key in [*published, "data/mta_bus_ridership/README.txt"]:
+            client.put_object(
+                Bucket="transitscope-baltimore", Key=key, Body=b"old"
+            )
+        client.put_object(
+            Bucket="transitscope-baltimore",
+            Key=manifest_path.as_posix(),
+            Body=json.dumps({key: {} for key in published}).encode(),
+        )
+        yield client
+
+
+def list_keys(client):
+    return {
+        item["Key"]
+        for item in client.list_objects_v2(Bucket="transitscope-baltimore")[
+            "Contents"
+        ]
+    }
+
+
+async def test_upload_mta_bus_ridership_to_s3_deletes_removed(
+    ridership_bucket, tmp_path
+):
+    # Compaction merged month 1 into its base file
+    month = tmp_path / "data" / "mta_bus_ridership" / "year=2023" / "month=1"
+    month.mkdir(parents=True)
+    (month / "part-0.parquet").write_bytes(b"compacted")
+
+    await upload_mta_bus_ridership_to_s3()
+    assert list_keys(ridership_bucket) >= {
+        "data/mta_bus_ridership/year=2023/month=1/part-0.parquet",
+        # Never listed in a manifest, so never deleted
+        "data/mta_bus_ridership/README.txt",
+    }
+    assert (
+        "data/mta_bus_ridership/year=2023/month=1/part-1.parquet"
+        not in list_keys(ridership_bucket)
+    )
+
+
+async def test_upload_mta_bus_ridership_to_s3_without_local_files(
+    ridership_bucket, tmp_path, manifest_path
+):
+    keys = list_keys(ridership_bucket)
+    # A fresh worker has no local dataset
+    await upload_mta_bus_ridership_to_s3()
+    assert list_keys(ridership_bucket) == keys
+    published = ridership_bucket.get_object(
+        Bucket="transitscope-baltimore", Key=manifest_path.as_posix()
+    )["Body"].read()
+    assert len(json.loads(published)) == 2
+
+
+async def test_upload_mta_bus_stops_to_s3_skips_unchanged_files(
+    feature_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    await mta_bus_stops_flow_async(layer_url=feature_server.url)
+    for name in ["aws-access-key-id", "aws-secret-access-key"]:
+        await Secret(value="testing").save(name, overwrite=True)
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket="transitscope-baltimore")
+        first = await upload_mta_bus_stops_to_s3()
+        # The stops, the bridge table and the manifest
+        assert first["uploaded_files"] == 3
+        assert first["skipped_files"] == 0
+        second = await upload_mta_bus_stops_to_s3()
+        assert second["uploaded_files"] == 0
+        assert second["skipped_bytes"] == first["uploaded_bytes"]
+    state = read_layer_state()
+    assert state["uploaded_last_edit_date"] == state["last_edit_date"]
+
+
+@pytest.fixture
+def sleeping_flows(monkeypatch):
+    """Replaces the run-all flow's subflows with ones that sleep and log."""
+    calls = []
+
+    def sleeping(name, seconds, result=None):
+        async def subflow(**kwargs):
+            calls.append(f"{name} started")
+            await asyncio.sleep(seconds)
+            calls.append(f"{name} finished")
+            return result
+
+        monkeypatch.setattr(
+            f"prefect_transitscope_baltimore_pipeline.flows.{name}", subflow
+        )
+
+    sleeping("scrape_and_transform_bus_route_ridership", 0.3)
+    sleeping("upload_mta_bus_ridership_to_s3", 0.1)
+    sleeping("mta_bus_stops_flow_async", 0.2, result="stops")
+    sleeping("upload_mta_bus_stops_to_s3", 0.1)
+    sleeping("upload_manifest_to_s3", 0.05)
+    return calls
+
+
+def test_run_all_deployment_lists_every_parameter():
+    deployment = yaml.safe_load(
+        (
+            Path(__file__).parent.parent
+            / "run_all_prefect_transitscope_baltimore_pipeline_flows"
+            "-deployment.yaml"
+        ).read_text()
+    )
+    properties = deployment["parameter_openapi_schema"]["properties"]
+    parameters = inspect.signature(
+        run_all_prefect_transitscope_baltimore_pipeline_flows.fn
+    ).parameters
+    assert list(properties) == list(parameters)
+    for name, parameter in parameters.items():
+        assert properties[name]["default"] == parameter.default
+
+
+async def test_run_all_runs_branches_concurrently(sleeping_flows):
+    durations = await run_all_prefect_transitscope_baltimore_pipeline_flows()
+    assert set(durations) == {"ridership", "bus stops"}
+    assert durations["ridership"] > durations["bus stops"]
+    # Both branches started before either finished
+    assert sleeping_flows[:2] == [
+        "scrape_and_transform_bus_route_ridership started",
+        "mta_bus_stops_flow_async started",
+    ]
+    # Each upload waits for its own branch's flow
+    for flow_name, upload_name in [
+        (
+            "scrape_and_transform_bus_route_ridership",
+            "upload_mta_bus_ridership_to_s3",
+        ),
+        ("mta_bus_stops_flow_async", "upload_mta_bus_stops_to_s3"),
+    ]:
+        assert sleeping_flows.index(
+            f"{flow_name} finished"
+        ) < sleeping_flows.index(f"{upload_name} started")
+    # The shared manifest is uploaded once, after both uploads
+    assert sleeping_flows[-2:] == [
+        "upload_manifest_to_s3 started",
+        "upload_manifest_to_s3 finished",
+    ]
+
+
+async def test_run_all_respects_max_concurrency(sleeping_flows):
+    await run_all_prefect_transitscope_baltimore_pipeline_flows(
+        max_concurrency=1
+    )
+    assert sleeping_flows[:4] == [
+        "scrape_and_transform_bus_route_ridership started",
+        "scrape_and_transform_bus_route_ridership finished",
+        "upload_mta_bus_ridership_to_s3 started",
+        "upload_mta_bus_ridership_to_s3 finished",
+    ]
+
+
+async def test_run_all_skips_unchanged_bus_stops_upload(
+    sleeping_flows, monkeypatch
+):
+    async def unchanged(**kwargs):
+        return None
+
     monkeypatch.setattr(
-        "prefect_transitscope_baltimore_pipeline.tasks.transform_mta_bus_stops",
-        mock,
+        "prefect_transitscope_baltimore_pipeline.flows.mta_bus_stops_flow_async",
+        unchanged,
     )
-    return mock
+    await run_all_prefect_transitscope_baltimore_pipeline_flows()
+    assert "upload_mta_bus_stops_to_s3 started" not in sleeping_flows
 
 
-def test_mta_bus_stops_flow(
-    mock_download_mta_bus_stops, mock_transform_mta_bus_stops
+async def test_run_all_retries_failed_bus_stops_upload(
+    sleeping_flows, tmp_path, monkeypatch
 ):
-    # Run the flow
-    result = mta_bus_stops_flow()
+    async def unchanged(**kwargs):
+        return None
 
-    # Test assertions
-    assert isinstance(
-        result, pd.DataFrame
-    ), "The flow did not return a DataFrame."
-    assert not result.empty, "The returned DataFrame is empty."
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        "prefect_transitscope_baltimore_pipeline.flows.mta_bus_stops_flow_async",
+        unchanged,
+    )
+    # The stops of the last run were written but never uploaded
+    write_layer_state(
+        {"layer_url": "layer", "last_edit_date": "2024-01-01T00:00:00+00:00"}
+    )
+    await run_all_prefect_transitscope_baltimore_pipeline_flows()
+    assert "upload_mta_bus_stops_to_s3 started" in sleeping_flows
+
+
+async def test_mta_bus_stops_flow_streams_to_s3(
+    feature_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    for name in ["aws-access-key-id", "aws-secret-access-key"]:
+        await Secret(value="testing").save(name, overwrite=True)
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="transitscope-baltimore")
+        stops = await mta_bus_stops_flow_async(
+            layer_url=feature_server.url,
+            stream_to_s3=True,
+            keep_local_copy=False,
+        )
+        body = client.get_object(
+            Bucket="transitscope-baltimore", Key=MTA_BUS_STOPS_PATH
+        )["Body"].read()
+        streamed = gpd.read_parquet(io.BytesIO(body))
+        assert sorted(streamed["stop_id"]) == sorted(stops["stop_id"])
+        assert not (tmp_path / MTA_BUS_STOPS_PATH).exists()
+        assert not (tmp_path / MTA_BUS_STOP_ROUTES_PATH).exists()
+        # The manifest records the streamed objects from their reports
+        entry = read_manifest()[MTA_BUS_STOPS_PATH]
+        assert entry["content_hash"] == hashlib.sha256(body).hexdigest()
+        assert entry["bytes"] == len(body)
+        assert entry["rows"] == len(stops)
+        assert MTA_BUS_STOP_ROUTES_PATH in read_manifest()
+
+        # Uploading afterwards sends only the manifest
+        summary = await upload_mta_bus_stops_to_s3()
+        assert summary["uploaded_files"] == 1
+
+
+async def test_run_all_finishes_other_branch_when_one_fails(
+    sleeping_flows, monkeypatch
+):
+    async def failing(**kwargs):
+        sleeping_flows.append(
+            "scrape_and_transform_bus_route_ridership failed"
+        )
+        raise RuntimeError("scrape failed")
+
+    pruned = []
+    monkeypatch.setattr(
+        "prefect_transitscope_baltimore_pipeline.flows.scrape_and_transform_bus_route_ridership",
+        failing,
+    )
+    monkeypatch.setattr(
+        "prefect_transitscope_baltimore_pipeline.flows.prune_data_store",
+        lambda: pruned.append(True),
+    )
+    with pytest.raises(RuntimeError, match="scrape failed"):
+        await run_all_prefect_transitscope_baltimore_pipeline_flows()
+    # The bus stops branch still ran to the end, and the store was pruned
+    assert "upload_mta_bus_stops_to_s3 finished" in sleeping_flows
+    assert "upload_mta_bus_ridership_to_s3 started" not in sleeping_flows
+    assert "upload_manifest_to_s3 started" not in sleeping_flows
+    assert pruned == [True]
+
+
+async def test_run_all(feature_server, tmp_path, monkeypatch, manifest_path):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    for name in ["aws-access-key-id", "aws-secret-access-key"]:
+        await Secret(value="testing").save(name, overwrite=True)
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    async def scrape():
+        return pd.DataFrame(
+            {
+                "Date": ["01/2023", "01/2023", "02/2023"],
+                "Route": ["103", "CityLink BLUE", "103"],
+                "Ridership": [3916, 10250, 0],
+            }
+        )
+
+    monkeypatch.setattr(
+        "prefect_transitscope_baltimore_pipeline.flows.scrape", scrape
+    )
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="transitscope-baltimore")
+        # Published before the ridership dataset was partitioned
+        client.put_object(
+            Bucket="transitscope-baltimore",
+            Key=LEGACY_MTA_BUS_RIDERSHIP_KEY,
+            Body=b"stale",
+        )
+        durations = (
+            await run_all_prefect_transitscope_baltimore_pipeline_flows(
+                layer_url=feature_server.url
+            )
+        )
+        keys = {
+            item["Key"]
+            for item in client.list_objects_v2(
+                Bucket="transitscope-baltimore"
+            )["Contents"]
+        }
+    assert set(durations) == {"ridership", "bus stops"}
+    assert {
+        MTA_BUS_STOPS_PATH,
+        MTA_BUS_STOP_ROUTES_PATH,
+        "data/mta_bus_ridership/year=2023/month=1/part-0.parquet",
+        "data/mta_bus_ridership_rollups/systemwide_monthly.parquet",
+    } <= keys
+    assert LEGACY_MTA_BUS_RIDERSHIP_KEY not in keys
+    assert manifest_path.as_posix() in keys
+    state = read_layer_state()
+    assert state["uploaded_last_edit_date"] == state["last_edit_date"]
@@ -0,0 +1,109 @@
+import io
+import json
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import Point, Polygon
+
+from prefect_transitscope_baltimore_pipeline.geojson_stream import (
+    parse_feature_collection,
+    read_geojson,
+)
+
+FEATURE_COLLECTION = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [-76.61, 39.29]},
+            "properties": {"stop_id": 1, "stop_name": "Charles St & Côte"},
+        },
+        {
+            "type": "Feature",
+            "geometry": None,
+            "properties": {"stop_id": 2, "shelter": "Yes"},
+        },
+        {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]],
+            },
+            "properties": {"stop_id": 123456789, "stop_name": None},
+        },
+    ],
+    "properties": {"exceededTransferLimit": False},
+}
+
+
+@pytest.fixture
+def geojson_path(tmp_path):
+    path = tmp_path / "stops.geojson"
+    path.write_text(json.dumps(FEATURE_COLLECTION, ensure_ascii=False))
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_read_geojson(geojson_path, chunk_size):
+    gdf = read_geojson(geojson_path, batch_size=2, chunk_size=chunk_size)
+    assert gdf.columns.tolist() == [
+        "stop_id",
+        "stop_name",
+        "shelter",
+        "geometry",
+    ]
+    assert gdf["stop_id"].tolist() == [1, 2, 123456789]
+    assert gdf["stop_name"].iloc[0] == "Charles St & Côte"
+    assert gdf["shelter"].tolist()[1] == "Yes"
+    assert gdf.geometry.iloc[0] == Point(-76.61, 39.29)
+    assert gdf.geometry.iloc[1] is None
+    assert isinstance(gdf.geometry.iloc[2], Polygon)
+    assert gdf.crs == "EPSG:4326"
+
+
+def test_read_geojson_matches_read_file(geojson_path):
+    expected = gpd.read_file(geojson_path)
+    gdf = read_geojson(io.BytesIO(geojson_path.read_bytes()))
+    assert gdf["stop_id"].tolist() == expected["stop_id"].tolist()
+    assert gdf.geometry.equals(expected.geometry)
+
+
+def test_parse_feature_collection_returns_other_members():
+    text = json.dumps(FEATURE_COLLECTION)
+    _, members = parse_feature_collection(
+        text[i : i + 5] for i in range(0, len(text), 5)
+    )
+    assert members == {
+        "type": "FeatureCollection",
+        "properties": {"exceededTransferLimit": False},
+    }
+
+
+def test_parse_feature_collection_in_many_batches():
+    def chunks(count):
+        yield b'{"type": "FeatureCollection", "features": ['
+        for i in range(count):
+            separator = b"," if i else b""
+            feature = {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [i, -i]},
+                "properties": {"objectid": i},
+            }
+            yield separator + json.dumps(feature).encode()
+        yield b"]}"
+
+    gdf, _ = parse_feature_collection(chunks(20_000), batch_size=3_000)
+    assert len(gdf) == 20_000
+    assert gdf["objectid"].tolist() == list(range(20_000))
+    assert gdf.geometry.x.iloc[-1] == 19_999
+    assert gdf.index.is_unique
+
+
+def test_parse_feature_collection_empty():
+    gdf, _ = parse_feature_collection(['{"features": []}'])
+    assert gdf.empty
+
+
+def test_parse_feature_collection_truncated():
+    with pytest.raises(ValueError):
+        parse_feature_collection(['{"features": [{"type": "Feature"'])
@@ -0,0 +1,90 @@
+import os
+import time
+from datetime import timedelta
+
+import pandas as pd
+
+from prefect_transitscope_baltimore_pipeline.arcgis import FeatureLayer
+from prefect_transitscope_baltimore_pipeline.http_client import (
+    create_session,
+    get_session,
+    prune_http_cache,
+)
+
+
+def test_get_session_is_shared(http_cache_dir):
+    assert get_session() is get_session(http_cache_dir)
+    assert get_session() is not get_session(http_cache_dir / "other")
+
+
+def test_repeat_download_is_revalidated(feature_server, http_cache_dir):
+    first = FeatureLayer(feature_server.url).download(
+        transfer_format="quantized"
+    )
+    requests_made = len(feature_server.requests)
+    assert feature_server.not_modified == 0
+    assert any(http_cache_dir.glob("*.body"))
+
+    layer = FeatureLayer(feature_server.url)
+    second = layer.download(transfer_format="quantized")
+    # Every request was answered 304 and served from the cache
+    assert feature_server.not_modified == requests_made
+    assert layer.bytes_received > 0
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_changed_response_is_downloaded_again(feature_server):
+    FeatureLayer(feature_server.url).download()
+    feature_server.features = feature_server.features[:5]
+    stops = FeatureLayer(feature_server.url).download()
+    assert stops["objectid"].tolist() == [1, 2, 3, 4, 5]
+
+
+def test_cached_response_is_marked(feature_server, http_cache_dir):
+    session = get_session()
+    url = f"{feature_server.url}?f=pjson"
+    assert session.get(url).from_cache is False
+    response = session.get(url)
+    assert response.from_cache is True
+    assert response.status_code == 200
+    assert response.json()["name"] == "Bus Stops"
+
+
+def test_session_without_cache_dir(feature_server, http_cache_dir):
+    session = create_session()
+    session.get(f"{feature_server.url}?f=pjson").raise_for_status()
+    session.get(f"{feature_server.url}?f=pjson").raise_for_status()
+    assert feature_server.not_modified == 0
+    assert not http_cache_dir.exists()
+
+
+def test_streamed_responses_are_not_cached(feature_server, http_cache_dir):
+    layer = FeatureLayer(feature_server.url)
+    layer.metadata()
+    layer.object_ids()
+    cached = sorted(http_cache_dir.glob("*.body"))
+    layer.download(transfer_format="geojson")
+    assert sorted(http_cache_dir.glob("*.body")) == cached
+
+
+def test_prune_http_cache(feature_server, http_cache_dir):
+    session = get_session()
+    for name in ["a", "b", "c"]:
+        session.get(f"{feature_server.url}?f=pjson&name={name}")
+    entries = sorted(
+        http_cache_dir.glob("*.json"), key=lambda path: path.read_text()
+    )
+    old = time.time() - timedelta(days=60).total_seconds()
+    os.utime(entries[0], (old, old))
+    # Using a response keeps it
+    session.get(f"{feature_server.url}?f=pjson&name=c")
+
+    assert prune_http_cache(cache_dir=http_cache_dir) == 1
+    assert len(list(http_cache_dir.glob("*.body"))) == 2
+    size = entries[1].with_suffix(".body").stat().st_size
+    assert prune_http_cache(max_bytes=size, cache_dir=http_cache_dir) == 1
+    remaining = list(http_cache_dir.glob("*.json"))
+    assert len(remaining) == 1
+    assert "name=c" in remaining[0].read_text()
+    assert prune_http_cache(max_bytes=0, cache_dir=http_cache_dir) == 1
+    assert list(http_cache_dir.iterdir()) == []
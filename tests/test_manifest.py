@@ -0,0 +1,120 @@
+import os
+
+import pandas as pd
+from prefect import flow
+
+from prefect_transitscope_baltimore_pipeline.manifest import (
+    describe_file,
+    describe_stream,
+    is_current,
+    read_manifest,
+    update_manifest,
+)
+from prefect_transitscope_baltimore_pipeline.parquet_profiles import (
+    ParquetProfile,
+    write_parquet,
+)
+
+
+def write_ridership(path, dates, profile="archive"):
+    ridership = pd.DataFrame(
+        {
+            "route": ["22"] * len(dates),
+            "date": pd.to_datetime(dates),
+            "ridership": range(len(dates)),
+        }
+    )
+    write_parquet(ridership, path, profile, index=False, quiet=True)
+
+
+def test_describe_file(tmp_path):
+    path = tmp_path / "ridership.parquet"
+    write_ridership(
+        path,
+        ["2023-03-01", "2023-01-01", "2023-02-01"],
+        ParquetProfile("small", row_group_size=2),
+    )
+    entry = describe_file(path, date_column="date")
+    assert entry["rows"] == 3
+    assert entry["bytes"] == path.stat().st_size
+    assert (entry["min_date"], entry["max_date"]) == (
+        "2023-01-01T00:00:00",
+        "2023-03-01T00:00:00",
+    )
+    assert entry["run_id"] is None
+
+    # The schema hash changes with the schema, not the data
+    other = tmp_path / "other.parquet"
+    write_ridership(other, ["2024-01-01"])
+    assert describe_file(other)["schema_hash"] == entry["schema_hash"]
+    assert describe_file(other)["content_hash"] != entry["content_hash"]
+
+
+def test_update_manifest(tmp_path, manifest_path):
+    dataset = tmp_path / "dataset"
+    dataset.mkdir()
+    first, second = dataset / "a.parquet", dataset / "b.parquet"
+    write_ridership(first, ["2023-01-01"])
+    write_ridership(second, ["2023-02-01"])
+
+    @flow
+    def record(paths):
+        return update_manifest(paths, date_column="date", root=dataset)
+
+    changed = record([first, second])
+    assert changed == [first.as_posix(), second.as_posix()]
+    manifest = read_manifest()
+    assert manifest[first.as_posix()]["run_id"] is not None
+
+    # Unchanged files are neither hashed again nor reported
+    assert update_manifest([first, second], root=dataset) == []
+    assert read_manifest() == manifest
+
+    # Rewriting a file with the same content is not a change either
+    write_ridership(first, ["2023-01-01"])
+    assert update_manifest([first]) == []
+    assert read_manifest()[first.as_posix()]["mtime_ns"] == (
+        first.stat().st_mtime_ns
+    )
+
+    # Deleted files under the root are dropped
+    second.unlink()
+    write_ridership(first, ["2023-01-01", "2023-01-02"])
+    assert update_manifest([first], root=dataset) == [first.as_posix()]
+    assert list(read_manifest()) == [first.as_posix()]
+    assert read_manifest()[first.as_posix()]["rows"] == 2
+    assert not any(
+        name.startswith(".") for name in os.listdir(manifest_path.parent)
+    )
+
+
+def test_update_manifest_records_streamed_objects(tmp_path, manifest_path):
+    dataset = tmp_path / "dataset"
+    dataset.mkdir()
+    frame = pd.DataFrame(
+        {"date": pd.to_datetime(["2023-01-01", "2023-03-01"])}
+    )
+    key = (dataset / "streamed.parquet").as_posix()
+    entry = describe_stream(
+        {"content_hash": "abc", "bytes": 10}, frame, date_column="date"
+    )
+    assert entry["rows"] == 2
+    assert (entry["min_date"], entry["max_date"]) == (
+        "2023-01-01T00:00:00",
+        "2023-03-01T00:00:00",
+    )
+    assert update_manifest([], root=dataset, streamed={key: entry}) == [key]
+    # The object has no local file, but its entry is kept
+    assert update_manifest([], root=dataset, streamed={key: entry}) == []
+    assert read_manifest()[key] == entry
+
+
+def test_is_current(tmp_path):
+    path = tmp_path / "ridership.parquet"
+    write_ridership(path, ["2023-01-01"])
+    entry = describe_file(path)
+    assert is_current(path, entry)
+    write_ridership(path, ["2023-01-01", "2023-02-01"])
+    assert not is_current(path, entry)
+    path.unlink()
+    assert not is_current(path, entry)
@@ -0,0 +1,146 @@
+import json
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from shapely.geometry import Point
+
+from prefect_transitscope_baltimore_pipeline.benchmarks import (
+    make_synthetic_stops,
+)
+from prefect_transitscope_baltimore_pipeline.parquet_profiles import (
+    PARQUET_PROFILES,
+    ParquetProfile,
+    bbox_row_groups,
+    get_parquet_profile,
+    hilbert_sort,
+    write_parquet,
+)
+
+
+@pytest.fixture
+def ridership():
+    return pd.DataFrame(
+        {
+            "date": pd.to_datetime(
+                ["2023-02-01", "2023-01-01", "2023-01-01", "2023-02-01"]
+            ),
+            "route": ["BL", "BL", "22", "22"],
+            "ridership": [210, 200, 100, 110],
+        }
+    )
+
+
+def test_get_parquet_profile():
+    assert get_parquet_profile("archive") is PARQUET_PROFILES["archive"]
+    profile = ParquetProfile("custom", compression="gzip")
+    assert get_parquet_profile(profile) is profile
+    with pytest.raises(ValueError, match="Unknown parquet profile"):
+        get_parquet_profile("fast")
+
+
+def test_write_parquet_archive_profile(tmp_path, ridership):
+    path = tmp_path / "ridership.parquet"
+    report = write_parquet(ridership, path, "archive", index=False)
+    assert report["profile"] == "archive"
+    assert report["bytes"] == path.stat().st_size
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_row_groups == 1
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+    # The archive profile keeps the row order
+    pd.testing.assert_frame_equal(pd.read_parquet(path), ridership)
+
+
+def test_write_parquet_reports_read_time(tmp_path, ridership, capsys):
+    path = tmp_path / "ridership.parquet"
+    report = write_parquet(ridership, path, index=False)
+    assert "read_seconds" not in report
+    report = write_parquet(ridership, path, index=False, measure_read=True)
+    assert report["read_seconds"] >= 0
+    assert "read back in" in capsys.readouterr().out.splitlines()[-1]
+
+
+def test_write_parquet_interactive_profile_sorts_by_route_and_date(
+    tmp_path, ridership
+):
+    path = tmp_path / "ridership.parquet"
+    profile = ParquetProfile(
+        "small", row_group_size=2, sort_by=("route", "date", "stop_id")
+    )
+    write_parquet(ridership, path, profile, index=False)
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.metadata.num_row_groups == 2
+    column = parquet_file.metadata.row_group(0).column(1)
+    assert column.compression == "SNAPPY"
+    assert (column.statistics.min, column.statistics.max) == ("22", "22")
+    written = pd.read_parquet(path)
+    assert written["route"].tolist() == ["22", "22", "BL", "BL"]
+    assert written["ridership"].tolist() == [100, 110, 200, 210]
+
+
+def test_write_parquet_geodata_frame_as_geoparquet(tmp_path):
+    stops = gpd.GeoDataFrame(
+        {"stop_id": [1, 2, 3]},
+        geometry=[Point(-76.6, 39.3), None, Point(-76.5, 39.2)],
+        crs="EPSG:4326",
+    )
+    path = tmp_path / "stops.parquet"
+    write_parquet(stops, path, "interactive")
+    metadata = pq.ParquetFile(path).metadata
+    geo = json.loads(metadata.metadata[b"geo"])
+    assert geo["version"] == "1.1.0"
+    assert geo["columns"]["geometry"]["covering"]["bbox"]["xmin"] == [
+        "bbox",
+        "xmin",
+    ]
+    written = gpd.read_parquet(path)
+    assert "bbox" not in written.columns
+    # Sorting keeps each stop's index, and stops without a location go last
+    assert written.index.tolist()[-1] == 1
+    assert written.crs == stops.crs
+    pd.testing.assert_frame_equal(written.sort_index(), stops, check_like=True)
+
+
+def test_write_parquet_spatial_sort_is_per_profile(tmp_path):
+    stops = make_synthetic_stops(2_000).sample(frac=1, random_state=0)
+    path = tmp_path / "stops.parquet"
+    write_parquet(stops, path, "archive")
+    # The archive profile keeps the row order
+    assert gpd.read_parquet(path).index.tolist() == stops.index.tolist()
+    # Without a spatial sort, GeoDataFrames are sorted by sort_by
+    profile = ParquetProfile("by_stop", sort_by=("stop_id",))
+    write_parquet(stops, path, profile)
+    assert gpd.read_parquet(path)["stop_id"].is_monotonic_increasing
+    write_parquet(stops, path, "interactive")
+    assert gpd.read_parquet(path).index.tolist() == (
+        hilbert_sort(stops).index.tolist()
+    )
+
+
+def test_hilbert_sort_keeps_nearby_stops_together():
+    stops = make_synthetic_stops(2_000).sample(frac=1, random_state=0)
+    stops = hilbert_sort(stops)
+    steps = stops.geometry.distance(stops.geometry.shift())
+    assert steps.median() < 1e-3
+
+
+def test_bbox_row_groups(tmp_path):
+    stops = make_synthetic_stops(20_000).sample(frac=1, random_state=0)
+    path = tmp_path / "stops.parquet"
+    write_parquet(stops, path, "interactive")
+    viewport = (-76.75, 39.1, -76.7, 39.105)
+    row_groups = bbox_row_groups(path, viewport)
+    assert 0 < len(row_groups) <= 4
+    in_viewport = gpd.read_parquet(path).cx[-76.75:-76.7, 39.1:39.105]
+    read = pq.ParquetFile(path).read_row_groups(
+        row_groups, columns=["stop_id"]
+    )
+    assert set(in_viewport["stop_id"]) <= set(read["stop_id"].to_pylist())
+    assert len(bbox_row_groups(path, (0, 0, 1, 1))) == 0
+
+
+def test_bbox_row_groups_without_covering(tmp_path, ridership):
+    path = tmp_path / "ridership.parquet"
+    write_parquet(ridership, path, "interactive")
+    assert bbox_row_groups(path, (0, 0, 1, 1)) == [0]
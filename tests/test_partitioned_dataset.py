@@ -0,0 +1,116 @@
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from prefect_transitscope_baltimore_pipeline.partitioned_dataset import (
+    BASE_FILE_NAME,
+    compact_partitioned_dataset,
+    partition_path,
+    read_partitioned_dataset,
+    write_partitioned_dataset,
+)
+
+
+def make_ridership(rows):
+    return pd.DataFrame(rows, columns=["date", "route", "ridership"]).assign(
+        date=lambda frame: pd.to_datetime(frame["date"])
+    )
+
+
+@pytest.fixture
+def ridership():
+    return make_ridership(
+        [
+            ("2023-01-01", "22", 100),
+            ("2023-01-01", "BL", 200),
+            ("2023-02-01", "22", 110),
+            ("2024-01-01", "22", 120),
+        ]
+    )
+
+
+def test_write_partitioned_dataset(tmp_path, ridership):
+    counts = write_partitioned_dataset(ridership, tmp_path)
+    assert counts["added"] == 3
+    assert (partition_path(tmp_path, 2023, 1) / BASE_FILE_NAME).exists()
+    pd.testing.assert_frame_equal(
+        read_partitioned_dataset(tmp_path), ridership
+    )
+
+
+def test_write_partitioned_dataset_touches_changed_partitions(
+    tmp_path, ridership
+):
+    write_partitioned_dataset(ridership, tmp_path)
+    january = partition_path(tmp_path, 2023, 1) / BASE_FILE_NAME
+    february = partition_path(tmp_path, 2023, 2) / BASE_FILE_NAME
+    january_mtime = january.stat().st_mtime_ns
+
+    updated = pd.concat(
+        [
+            ridership,
+            # A new route in January 2023 and a new month
+            make_ridership(
+                [("2023-01-01", "85", 50), ("2024-02-01", "22", 130)]
+            ),
+        ],
+        ignore_index=True,
+    )
+    # A correction to February 2023
+    updated.loc[2, "ridership"] = 111
+    counts = write_partitioned_dataset(updated, tmp_path)
+    assert counts == {
+        "added": 1,
+        "appended": 1,
+        "replaced": 1,
+        "unchanged": 1,
+    }
+    assert january.stat().st_mtime_ns == january_mtime
+    assert len(list(january.parent.glob("part-*.parquet"))) == 2
+    assert pd.read_parquet(february)["ridership"].tolist() == [111]
+
+    result = read_partitioned_dataset(tmp_path)
+    assert sorted(result["ridership"]) == sorted(updated["ridership"])
+    assert not list(tmp_path.rglob(".*"))
+
+    # Writing the same data again changes nothing
+    counts = write_partitioned_dataset(updated, tmp_path)
+    assert counts["unchanged"] == 4
+
+
+def test_read_partitioned_dataset_filters_dates(tmp_path, ridership):
+    write_partitioned_dataset(ridership, tmp_path)
+    result = read_partitioned_dataset(
+        tmp_path, start="2023-02-01", end="2023-12-31", columns=["ridership"]
+    )
+    assert result.columns.tolist() == ["ridership"]
+    assert result["ridership"].tolist() == [110]
+
+
+def test_compact_partitioned_dataset(tmp_path, ridership):
+    write_partitioned_dataset(ridership.iloc[:1], tmp_path)
+    write_partitioned_dataset(ridership, tmp_path)
+    january = partition_path(tmp_path, 2023, 1)
+    assert len(list(january.glob("part-*.parquet"))) == 2
+
+    assert compact_partitioned_dataset(tmp_path) == 1
+    assert [path.name for path in january.glob("part-*.parquet")] == [
+        BASE_FILE_NAME
+    ]
+    pd.testing.assert_frame_equal(
+        read_partitioned_dataset(tmp_path), ridership
+    )
+    assert compact_partitioned_dataset(tmp_path) == 0
+
+
+def test_write_partitioned_dataset_empty(tmp_path):
+    counts = write_partitioned_dataset(pd.DataFrame(), tmp_path)
+    assert sum(counts.values()) == 0
+    assert not list(tmp_path.iterdir())
+
+
+def test_write_partitioned_dataset_with_profile(tmp_path, ridership):
+    write_partitioned_dataset(ridership, tmp_path, profile="archive")
+    path = partition_path(tmp_path, 2023, 1) / BASE_FILE_NAME
+    column = pq.ParquetFile(path).metadata.row_group(0).column(0)
+    assert column.compression == "ZSTD"
@@ -0,0 +1,89 @@
+import pandas as pd
+import pytest
+
+from prefect_transitscope_baltimore_pipeline.rollups import (
+    ROLLUP_FILES,
+    month_fingerprints,
+    read_ridership_rollups,
+    update_ridership_rollups,
+)
+
+
+def make_ridership(months, routes=("22", "BL", "CityLink Red")):
+    dates = pd.date_range("2021-01-01", periods=months, freq="MS")
+    ridership = pd.DataFrame(
+        [
+            (route, date, 1000 + 10 * i + 100 * j)
+            for i, date in enumerate(dates)
+            for j, route in enumerate(routes)
+        ],
+        columns=["route", "date", "ridership"],
+    )
+    ridership["days_in_month"] = ridership["date"].dt.days_in_month
+    ridership["daily_ridership"] = (
+        ridership["ridership"] / ridership["days_in_month"]
+    )
+    return ridership
+
+
+def test_update_ridership_rollups(tmp_path):
+    rollups = update_ridership_rollups(make_ridership(14), tmp_path)
+    monthly = rollups["systemwide_monthly"]
+    assert monthly["ridership"].tolist()[:2] == [3300, 3330]
+    assert monthly["routes"].unique().tolist() == [3]
+    assert monthly["ridership_3_month_avg"].isna().sum() == 2
+    assert monthly["ridership_3_month_avg"].iloc[2] == 3330
+    assert monthly["ridership_12_month_avg"].iloc[11] == pytest.approx(3465)
+    # January 2022 against January 2021
+    assert monthly["ridership_yoy_change"].iloc[12] == 360
+    assert monthly["ridership_yoy_pct"].iloc[12] == pytest.approx(
+        360 / 3300 * 100
+    )
+
+    annual = rollups["route_annual"].set_index(["route", "year"])
+    assert annual.loc[("22", 2021), "ridership"] == 12_660
+    assert annual.loc[("22", 2022), "months"] == 2
+    assert pd.isna(annual.loc[("22", 2021), "ridership_yoy_change"])
+    assert annual.loc[("22", 2022), "ridership_yoy_change"] == 2250 - 12_660
+
+    written = read_ridership_rollups(tmp_path)
+    pd.testing.assert_frame_equal(written["systemwide_monthly"], monthly)
+
+
+def test_update_ridership_rollups_is_incremental(tmp_path):
+    update_ridership_rollups(make_ridership(30), tmp_path)
+
+    # Two new months, and a revised figure for June 2021
+    ridership = make_ridership(32)
+    ridership.loc[15, "ridership"] = 1
+    incremental = update_ridership_rollups(ridership, tmp_path)
+    full = update_ridership_rollups(ridership, tmp_path / "full")
+    for name in ROLLUP_FILES:
+        pd.testing.assert_frame_equal(incremental[name], full[name])
+
+
+def test_update_ridership_rollups_skips_unchanged_months(tmp_path):
+    ridership = make_ridership(14)
+    update_ridership_rollups(ridership, tmp_path)
+    path = tmp_path / ROLLUP_FILES["systemwide_monthly"]
+    modified = path.stat().st_mtime_ns
+
+    # The same rows in another order
+    update_ridership_rollups(
+        ridership.sample(frac=1, random_state=0), tmp_path
+    )
+    assert path.stat().st_mtime_ns == modified
+
+    # No data leaves the rollups alone
+    assert update_ridership_rollups(ridership.iloc[:0], tmp_path) is not None
+    assert path.stat().st_mtime_ns == modified
+
+
+def test_month_fingerprints():
+    ridership = make_ridership(2)
+    fingerprints = month_fingerprints(ridership)
+    assert list(fingerprints) == ["2021-01-01", "2021-02-01"]
+    ridership.loc[0, "ridership"] += 1
+    changed = month_fingerprints(ridership)
+    assert changed["2021-01-01"] != fingerprints["2021-01-01"]
+    assert changed["2021-02-01"] == fingerprints["2021-02-01"]
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+from prefect_transitscope_baltimore_pipeline.route_index import (
+    RouteStopIndex,
+)
+
+
+@pytest.fixture
+def route_stop_index():
+    stops = pd.DataFrame(
+        {
+            "stop_id": [30, 10, 20, 40],
+            "routes_served": ["BL, 22", "22", "BL; LM, 22", None],
+        }
+    )
+    return RouteStopIndex.from_stops(stops)
+
+
+def test_stops_for_route(route_stop_index):
+    assert route_stop_index.stops_for_route("22").tolist() == [10, 20, 30]
+    assert route_stop_index.stops_for_route("CityLink Lime").tolist() == [20]
+    assert route_stop_index.stops_for_route("missing").tolist() == []
+
+
+def test_routes_for_stop(route_stop_index):
+    assert route_stop_index.routes_for_stop(20) == [
+        "22",
+        "CityLink Blue",
+        "CityLink Lime",
+    ]
+    assert route_stop_index.routes_for_stop(40) == []
+
+
+def test_transfer_stops(route_stop_index):
+    assert route_stop_index.transfer_stops("CityLink Blue", "22").tolist() == [
+        20,
+        30,
+    ]
+    assert route_stop_index.transfer_stops("22", "missing").tolist() == []
+
+
+def test_save_and_load(route_stop_index, tmp_path):
+    path = tmp_path / "route_stop_index.npz"
+    route_stop_index.save(path)
+    loaded = RouteStopIndex.load(path)
+    assert loaded.stops_for_route("CityLink Blue").tolist() == [20, 30]
+    assert loaded.routes_for_stop(10) == ["22"]
+    assert len(loaded) == len(route_stop_index) == 6
+
+
+def test_save_and_load_string_stop_ids(tmp_path):
+    stops = pd.DataFrame(
+        {"stop_id": ["B30", "A10", "A20"], "routes_served": ["BL", "22", "22"]}
+    )
+    path = tmp_path / "route_stop_index.npz"
+    RouteStopIndex.from_stops(stops).save(path)
+    loaded = RouteStopIndex.load(path)
+    assert loaded.stop_ids.dtype.kind == "U"
+    assert loaded.stops_for_route("22").tolist() == ["A10", "A20"]
+    assert loaded.routes_for_stop("B30") == ["CityLink Blue"]
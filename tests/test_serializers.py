@@ -0,0 +1,112 @@
+import geopandas as gpd
+import pandas as pd
+from prefect import flow
+from prefect.serializers import Serializer
+from shapely.geometry import Point
+
+from prefect_transitscope_baltimore_pipeline.caching import transform_task
+from prefect_transitscope_baltimore_pipeline.datastore import DataHandle
+from prefect_transitscope_baltimore_pipeline.flows import (
+    mta_bus_stops_flow,
+    mta_bus_stops_flow_async,
+    scrape_and_transform_bus_route_ridership,
+)
+from prefect_transitscope_baltimore_pipeline.serializers import (
+    RESULT_SERIALIZER,
+    FrameSerializer,
+)
+from prefect_transitscope_baltimore_pipeline.tasks import (
+    download_mta_bus_stops,
+    download_mta_bus_stops_async,
+    scrape,
+)
+
+
+def test_frame_serializer_round_trips_data_frames():
+    ridership = pd.DataFrame(
+        {
+            "route": pd.Categorical(["22", "BL"]),
+            "date": pd.to_datetime(["2023-01-01", "2023-02-01"]),
+            "ridership": [100, 200],
+        },
+        index=[4, 5],
+    )
+    blob = RESULT_SERIALIZER.dumps(ridership)
+    assert blob.startswith(b"parquet:")
+    pd.testing.assert_frame_equal(RESULT_SERIALIZER.loads(blob), ridership)
+
+
+def test_frame_serializer_round_trips_geodata_frames():
+    stops = gpd.GeoDataFrame(
+        {"stop_id": [1, 2]},
+        geometry=[Point(-76.6, 39.3), None],
+        crs="EPSG:4326",
+    )
+    serializer = FrameSerializer(compression="snappy")
+    loaded = serializer.loads(serializer.dumps(stops))
+    assert isinstance(loaded, gpd.GeoDataFrame)
+    assert loaded.crs == "EPSG:4326"
+    pd.testing.assert_frame_equal(loaded, stops)
+
+
+def test_frame_serializer_pickles_other_results(tmp_path):
+    handle = DataHandle(tmp_path / "frame.arrow", "abc", 3)
+    assert RESULT_SERIALIZER.loads(RESULT_SERIALIZER.dumps(handle)) == handle
+    assert RESULT_SERIALIZER.loads(RESULT_SERIALIZER.dumps([1, 2])) == [1, 2]
+
+
+def test_frame_serializer_pickles_frames_parquet_cannot_store():
+    mixed = pd.DataFrame({"stop_code": ["A12", 14, 3.5]})
+    blob = RESULT_SERIALIZER.dumps(mixed)
+    assert blob.startswith(b"pickle:")
+    pd.testing.assert_frame_equal(RESULT_SERIALIZER.loads(blob), mixed)
+
+
+def test_frame_serializer_pickles_frames_with_nested_values():
+    stops = pd.DataFrame(
+        {
+            "stop_id": [1, 2, 3],
+            "routes_served": [["22", "BL"], [], None],
+            "attributes": [{"shelter": True}, {"bench": False}, None],
+        }
+    )
+    blob = RESULT_SERIALIZER.dumps(stops)
+    assert blob.startswith(b"pickle:")
+    loaded = RESULT_SERIALIZER.loads(blob)
+    pd.testing.assert_frame_equal(loaded, stops)
+    assert loaded["routes_served"][0] == ["22", "BL"]
+    assert loaded["attributes"][1] == {"bench": False}
+
+
+def test_frame_serializer_is_registered():
+    serializer = Serializer(type="transitscope-frame", compression="none")
+    assert isinstance(serializer, FrameSerializer)
+
+
+def test_transform_tasks_use_frame_serializer():
+    @transform_task
+    def add_one(data_frame):
+        return data_frame + 1
+
+    assert isinstance(add_one.result_serializer, FrameSerializer)
+
+    @flow
+    def add_one_flow(data_frame):
+        state = add_one(data_frame, return_state=True)
+        return state.data.serializer_type, state.result()
+
+    serializer_type, result = add_one_flow(pd.DataFrame({"a": [1]}))
+    assert serializer_type == "transitscope-frame"
+    assert result["a"].tolist() == [2]
+
+
+def test_frame_returning_tasks_and_flows_use_frame_serializer():
+    for task_or_flow in [
+        scrape,
+        download_mta_bus_stops,
+        download_mta_bus_stops_async,
+        scrape_and_transform_bus_route_ridership,
+        mta_bus_stops_flow,
+        mta_bus_stops_flow_async,
+    ]:
+        assert task_or_flow.result_serializer is RESULT_SERIALIZER
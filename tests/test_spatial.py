@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from prefect_transitscope_baltimore_pipeline.spatial import StopSpatialIndex
+
+
+@pytest.fixture
+def stop_spatial_index():
+    # Stops roughly 100 m, 1 km and 10 km north of the query point
+    stops = pd.DataFrame(
+        {
+            "stop_id": [3, 1, 2, 4],
+            "latitude": [39.3904, 39.2913, 39.2994, None],
+            "longitude": [-76.6122, -76.6122, -76.6122, -76.6122],
+        }
+    )
+    return StopSpatialIndex.from_stops(stops)
+
+
+def test_nearest(stop_spatial_index):
+    distances, stop_ids = stop_spatial_index.nearest(
+        [-76.6122, -76.6122], [39.2904, 39.3904], k=2
+    )
+    assert stop_ids.tolist() == [[1, 2], [3, 2]]
+    assert distances.shape == (2, 2)
+    np.testing.assert_allclose(distances[0], [100, 1000], rtol=0.01)
+
+
+def test_nearest_with_k_larger_than_stops(stop_spatial_index):
+    _, stop_ids = stop_spatial_index.nearest([-76.6122], [39.2904], k=10)
+    assert stop_ids.tolist() == [[1, 2, 3]]
+
+
+def test_within_radius(stop_spatial_index):
+    matches = stop_spatial_index.within_radius(
+        [-76.6122, -76.7], [39.2904, 39.2904], radius=1500
+    )
+    assert [m.tolist() for m in matches] == [[1, 2], []]
+
+
+def test_save_and_load(stop_spatial_index, tmp_path):
+    path = tmp_path / "stop_spatial_index.pkl"
+    stop_spatial_index.save(path)
+    loaded = StopSpatialIndex.load(path)
+    _, stop_ids = loaded.nearest([-76.6122], [39.2904])
+    assert stop_ids.tolist() == [[1]]
+    assert len(loaded) == 3
+
+
+def test_from_stops_uses_stored_state_plane_coordinates():
+    stops = pd.DataFrame(
+        {
+            "stop_id": [1, 2],
+            "latitude": [39.29, 39.30],
+            "longitude": [-76.61, -76.61],
+            "state_plane_x": [0.0, 10.0],
+            "state_plane_y": [0.0, 0.0],
+        }
+    )
+    index = StopSpatialIndex.from_stops(stops)
+    assert index.tree.data.tolist() == [[0.0, 0.0], [10.0, 0.0]]
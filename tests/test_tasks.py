@@ -4,18 +4,25 @@ from datetime import datetime
 from unittest.mock import Mock
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import pytest
 from shapely.geometry import Point
 
 from prefect_transitscope_baltimore_pipeline.tasks import (
     EVALUATION_STRING,
+    apply_mta_bus_stop_changes,
     calculate_days_and_daily_ridership,
     calculate_days_in_month,
     computeCsvStringFromTable,
     convert_date_and_calculate_end_of_month,
+    create_stop_route_bridge,
+    download_mta_bus_stop_object_ids_async,
     download_mta_bus_stops,
+    download_mta_bus_stops_async,
     exclude_zero_ridership,
+    explode_routes_served,
+    extract_point_coordinates,
     format_bus_routes,
     format_bus_routes_task,
     standardize_column_names,
@@ -87,32 +94,6 @@ async def test_computeCsvStringFromTable_without_headers():
     assert result == r"row1col1,row1col2\nrow2col1,row2col2\n"
 
 
-# Mocks
-class MockResponse:
-    def __init__(self, json_data, status_code):
-        self.json_data = json_data
-        self.status_code = status_code
-
-    def json(self):
-        return self.json_data
-
-
-@pytest.fixture
-def mock_requests_get(monkeypatch):
-    def mock_get(*args, **kwargs):
-        return MockResponse({"description": "Successful description"}, 200)
-
-    monkeypatch.setattr("requests.get", mock_get)
-
-
-@pytest.fixture
-def mock_requests_get_failure(monkeypatch):
-    def mock_get(*args, **kwargs):
-        return MockResponse(None, 404)
-
-    monkeypatch.setattr("requests.get", mock_get)
-
-
 # ------ #SECTION: Test route transformation tasks ------ #
 # Test for standardize_column_names function
 def test_standardize_column_names():
@@ -222,17 +203,148 @@ def test_calculate_days_and_daily_ridership():
 # -------------------------------------------------------- #
 
 
-def test_download_mta_bus_stops_success(mock_requests_get):
+def test_download_mta_bus_stops_success(feature_server):
     # Remember to add .fn
-    result = download_mta_bus_stops.fn()
+    result = download_mta_bus_stops.fn(layer_url=feature_server.url)
     first_description = result["data_source_description"].values[0]
-    assert first_description != "No description available"
+    assert first_description == "MTA bus stops"
+    # 25 stops in pages of at most 10
+    assert result["objectid"].tolist() == list(range(1, 26))
+    assert result.crs == "EPSG:4326"
+    assert result.columns[-4:].tolist() == [
+        "geometry",
+        "data_source_description",
+        "layer_last_edit_date",
+        "download_date",
+    ]
+    feature_pages = [
+        params
+        for path, params in feature_server.requests
+        if "outFields" in params
+    ]
+    assert len(feature_pages) == 3
+    # GeoJSON pages with only the fields the transforms use
+    assert all(page["f"] == "geojson" for page in feature_pages)
+    assert all(
+        page["outFields"] == "objectid,stop_id,routes_served"
+        for page in feature_pages
+    )
+    assert result.columns[:3].tolist() == [
+        "objectid",
+        "stop_id",
+        "routes_served",
+    ]
+    assert result.geometry.x.iloc[0] == pytest.approx(-76.5999)
+
+
+def test_download_mta_bus_stops_skips_unchanged_layer(feature_server):
+    result = download_mta_bus_stops.fn(
+        layer_url=feature_server.url,
+        last_edit_date="2024-01-01T00:00:00+00:00",
+    )
+    assert result is None
+    # Only the metadata was requested
+    assert len(feature_server.requests) == 1
 
 
-def test_download_mta_bus_stops_failure(mock_requests_get_failure):
-    result = download_mta_bus_stops.fn()
+def test_download_mta_bus_stops_records_last_edit_date(feature_server):
+    result = download_mta_bus_stops.fn(
+        layer_url=feature_server.url,
+        last_edit_date="2023-12-01T00:00:00+00:00",
+    )
+    assert result["layer_last_edit_date"].iloc[0] == pd.Timestamp(
+        "2024-01-01", tz="UTC"
+    )
+
+
+def test_download_mta_bus_stops_edited_since(feature_server):
+    feature_server.features[0]["properties"][
+        "last_edited_date"
+    ] = 1706745600000
+    result = download_mta_bus_stops.fn(
+        layer_url=feature_server.url, edited_since="2024-01-01"
+    )
+    assert result["objectid"].tolist() == [1]
+
+
+async def test_download_mta_bus_stops_async(feature_server):
+    result = await download_mta_bus_stops_async.fn(
+        layer_url=feature_server.url
+    )
+    expected = download_mta_bus_stops.fn(layer_url=feature_server.url)
+    pd.testing.assert_frame_equal(
+        result.drop(columns="download_date"),
+        expected.drop(columns="download_date"),
+    )
+    # The metadata and object IDs were requested together, once each
+    paths = [path for path, _ in feature_server.requests]
+    assert paths[:2].count("/FeatureServer/9") == 1
+
+
+async def test_download_mta_bus_stops_async_edited_since(feature_server):
+    feature_server.features[0]["properties"][
+        "last_edited_date"
+    ] = 1706745600000
+    result = await download_mta_bus_stops_async.fn(
+        layer_url=feature_server.url,
+        last_edit_date="2023-12-01",
+        edited_since="2024-01-01",
+    )
+    assert result["objectid"].tolist() == [1]
+    assert await download_mta_bus_stop_object_ids_async.fn(
+        feature_server.url
+    ) == list(range(1, 26))
+
+
+async def test_download_mta_bus_stops_async_skips_unchanged_layer(
+    feature_server,
+):
+    result = await download_mta_bus_stops_async.fn(
+        layer_url=feature_server.url,
+        last_edit_date="2024-01-01T00:00:00+00:00",
+        edited_since="2024-01-01T00:00:00+00:00",
+    )
+    assert result is None
+    assert len(feature_server.requests) == 1
+
+
+async def test_download_mta_bus_stops_async_failure(feature_server):
+    feature_server.metadata_status = 404
+    result = await download_mta_bus_stops_async.fn(
+        layer_url=feature_server.url
+    )
+    first_description = result["data_source_description"].values[0]
+    assert first_description == "No description available"
+    assert result["objectid"].tolist() == list(range(1, 26))
+
+
+def test_apply_mta_bus_stop_changes():
+    stored = gpd.GeoDataFrame(
+        {"objectid": [1, 2, 3], "stop_name": ["a", "b", "c"]},
+        geometry=[Point(0, 0)] * 3,
+        crs="EPSG:4326",
+    )
+    changed = gpd.GeoDataFrame(
+        {"objectid": [4, 2], "stop_name": ["d", "B"]},
+        geometry=[Point(0, 0)] * 2,
+        crs="EPSG:4326",
+    )
+    result = apply_mta_bus_stop_changes.fn(stored, changed, [1, 2, 4])
+    assert result["objectid"].tolist() == [1, 2, 4]
+    assert result["stop_name"].tolist() == ["a", "B", "d"]
+    assert result.crs == "EPSG:4326"
+
+    # Deletions only
+    result = apply_mta_bus_stop_changes.fn(stored, changed.iloc[:0], [1])
+    assert result["objectid"].tolist() == [1]
+
+
+def test_download_mta_bus_stops_failure(feature_server):
+    feature_server.metadata_status = 404
+    result = download_mta_bus_stops.fn(layer_url=feature_server.url)
     first_description = result["data_source_description"].values[0]
     assert first_description == "No description available"
+    assert len(result) == 25
 
 
 # Tests for transform_mta_bus_stops function
@@ -258,3 +370,47 @@ def test_transform_mta_bus_stops():
     assert all(
         x in result.columns for x in ["latitude", "longitude", "routes_served"]
     )
+    assert result["latitude"].iloc[0] == 2
+    assert result["longitude"].iloc[0] == 1
+    assert {"state_plane_x", "state_plane_y"} <= set(result.columns)
+    assert result["routes_served"].iloc[0] == (
+        "CityLink Gold, CityLink Blue, 100"
+    )
+
+
+def test_extract_point_coordinates():
+    geometry = gpd.GeoSeries([Point(-76.6, 39.3), None, Point()])
+    coordinates = extract_point_coordinates(geometry)
+    assert coordinates.shape == (3, 2)
+    assert coordinates[0].tolist() == [-76.6, 39.3]
+    assert np.isnan(coordinates[1:]).all()
+
+
+def test_explode_routes_served():
+    stops = pd.DataFrame(
+        {"stop_id": [1, 2, 3], "routes_served": ["BL, 22;LM", "", None]}
+    )
+    result = explode_routes_served(stops)
+    assert result.to_dict("list") == {
+        "stop_id": [1, 1, 1],
+        "route": ["CityLink Blue", "22", "CityLink Lime"],
+    }
+
+
+def test_create_stop_route_bridge():
+    stops = pd.DataFrame(
+        {
+            "stop_id": [2, 1, 3],
+            "routes_served": ["22, BL", "CityLink Blue, 22, 22", "LM"],
+        }
+    )
+    bridge = create_stop_route_bridge.fn(stops)
+    assert list(bridge.columns) == ["stop_id", "route"]
+    assert isinstance(bridge["route"].dtype, pd.CategoricalDtype)
+    assert list(zip(bridge["stop_id"], bridge["route"])) == [
+        (1, "22"),
+        (2, "22"),
+        (1, "CityLink Blue"),
+        (2, "CityLink Blue"),
+        (3, "CityLink Lime"),
+    ]
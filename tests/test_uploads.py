@@ -0,0 +1,265 @@
+import hashlib
+import io
+
+import boto3
+import numpy as np
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from moto import mock_aws
+
+from prefect_transitscope_baltimore_pipeline.manifest import (
+    read_manifest,
+    update_manifest,
+)
+from prefect_transitscope_baltimore_pipeline.uploads import (
+    CONTENT_HASH_METADATA_KEY,
+    S3UploadStream,
+    client_config,
+    stream_parquet_to_s3,
+    transfer_config,
+    upload_file_if_changed,
+    upload_files_if_changed,
+)
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    """Yields an S3 client for a moto stand-in with one empty bucket."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="transitscope-baltimore")
+        yield client
+
+
+def count_puts(client):
+    """Counts the PutObject requests the client sends."""
+    puts = []
+    client.meta.events.register(
+        "provide-client-params.s3.PutObject", lambda **kwargs: puts.append(1)
+    )
+    return puts
+
+
+def test_upload_file_if_changed(tmp_path, s3_client):
+    path = tmp_path / "stops.parquet"
+    path.write_bytes(b"stops v1")
+    puts = count_puts(s3_client)
+
+    result = upload_file_if_changed(
+        s3_client, path, "transitscope-baltimore", key="data/stops.parquet"
+    )
+    assert result == {
+        "key": "data/stops.parquet",
+        "bytes": 8,
+        "uploaded": True,
+    }
+    head = s3_client.head_object(
+        Bucket="transitscope-baltimore", Key="data/stops.parquet"
+    )
+    assert CONTENT_HASH_METADATA_KEY in head["Metadata"]
+
+    # The same content is not uploaded again
+    result = upload_file_if_changed(
+        s3_client, path, "transitscope-baltimore", key="data/stops.parquet"
+    )
+    assert not result["uploaded"]
+    assert len(puts) == 1
+
+    path.write_bytes(b"stops v2")
+    assert upload_file_if_changed(
+        s3_client, path, "transitscope-baltimore", key="data/stops.parquet"
+    )["uploaded"]
+    body = s3_client.get_object(
+        Bucket="transitscope-baltimore", Key="data/stops.parquet"
+    )["Body"].read()
+    assert body == b"stops v2"
+
+
+def test_upload_files_if_changed_uses_manifest_hashes(
+    tmp_path, s3_client, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    paths = [tmp_path / "data" / name for name in ["a.bin", "b.bin"]]
+    for path in paths:
+        path.write_bytes(path.name.encode() * 100)
+    update_manifest(paths)
+
+    summary = upload_files_if_changed(s3_client, paths)
+    assert summary == {
+        "uploaded_files": 2,
+        "uploaded_bytes": 1000,
+        "skipped_files": 0,
+        "skipped_bytes": 0,
+    }
+    head = s3_client.head_object(
+        Bucket="transitscope-baltimore", Key=paths[0].as_posix()
+    )
+    assert (
+        head["Metadata"][CONTENT_HASH_METADATA_KEY]
+        == read_manifest()[paths[0].as_posix()]["content_hash"]
+    )
+
+    paths[1].write_bytes(b"changed")
+    summary = upload_files_if_changed(s3_client, paths)
+    assert summary == {
+        "uploaded_files": 1,
+        "uploaded_bytes": 7,
+        "skipped_files": 1,
+        "skipped_bytes": 500,
+    }
+
+
+def test_upload_files_if_changed_relative_to_root(tmp_path, s3_client):
+    paths = [tmp_path / "part-0.bin", tmp_path / "nested" / "part-1.bin"]
+    paths[1].parent.mkdir()
+    for path in paths:
+        path.write_bytes(b"part")
+
+    upload_files_if_changed(s3_client, paths, root=tmp_path)
+    listing = s3_client.list_objects_v2(Bucket="transitscope-baltimore")
+    assert sorted(item["Key"] for item in listing["Contents"]) == [
+        "nested/part-1.bin",
+        "part-0.bin",
+    ]
+
+
+def test_client_config_pools_a_connection_per_part():
+    # 8 files at once, each in up to 8 parts at once
+    assert client_config().max_pool_connections == 64
+    client = boto3.client(
+        "s3", region_name="us-east-1", config=client_config(4, 2)
+    )
+    assert client.meta.config.max_pool_connections == 8
+
+
+def test_upload_file_if_changed_raises_other_errors(tmp_path, s3_client):
+    path = tmp_path / "stops.parquet"
+    path.write_bytes(b"stops")
+    with Stubber(s3_client) as stubber:
+        stubber.add_client_error(
+            "head_object",
+            service_error_code="AccessDenied",
+            http_status_code=403,
+        )
+        with pytest.raises(ClientError, match="AccessDenied"):
+            upload_file_if_changed(s3_client, path, "transitscope-baltimore")
+
+
+def test_upload_file_if_changed_in_parts(tmp_path, s3_client):
+    path = tmp_path / "ridership.parquet"
+    path.write_bytes(bytes(range(256)) * (6 << 12))
+    config = transfer_config(
+        multipart_threshold=5 << 20, multipart_chunksize=5 << 20
+    )
+    upload_file_if_changed(
+        s3_client, path, "transitscope-baltimore", config=config
+    )
+    head = s3_client.head_object(
+        Bucket="transitscope-baltimore", Key=path.as_posix()
+    )
+    # Multipart uploads have an ETag suffixed with their number of parts
+    assert head["ETag"].strip('"').endswith("-2")
+    assert head["ContentLength"] == path.stat().st_size
+
+
+def test_upload_files_if_changed_uploads_last_files_after_others(
+    tmp_path, s3_client
+):
+    paths = []
+    for i in range(8):
+        paths.append(tmp_path / f"part-{i}.parquet")
+        paths[-1].write_bytes(b"x" * (i + 1))
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text("{}")
+    keys = []
+    s3_client.meta.events.register(
+        "provide-client-params.s3.PutObject",
+        lambda params, **kwargs: keys.append(params["Key"]),
+    )
+
+    summary = upload_files_if_changed(
+        s3_client, paths, last=[manifest], max_workers=4
+    )
+    assert summary["uploaded_files"] == 9
+    assert sorted(keys[:-1]) == sorted(path.as_posix() for path in paths)
+    assert keys[-1] == manifest.as_posix()
+
+
+def test_stream_parquet_to_s3(tmp_path, s3_client):
+    frame = pd.DataFrame({"route": ["22", "CityLink Blue"], "stops": [5, 3]})
+    local_copy = tmp_path / "data" / "routes.parquet"
+
+    report = stream_parquet_to_s3(
+        frame, s3_client, "data/routes.parquet", local_copy=local_copy
+    )
+    response = s3_client.get_object(
+        Bucket="transitscope-baltimore", Key="data/routes.parquet"
+    )
+    body = response["Body"].read()
+    pd.testing.assert_frame_equal(pd.read_parquet(io.BytesIO(body)), frame)
+    assert report["bytes"] == len(body)
+    assert report["content_hash"] == hashlib.sha256(body).hexdigest()
+    assert response["Metadata"] == {
+        CONTENT_HASH_METADATA_KEY: report["content_hash"]
+    }
+    # The local copy is identical, so uploading it is skipped
+    assert local_copy.read_bytes() == body
+    result = upload_file_if_changed(
+        s3_client,
+        local_copy,
+        "transitscope-baltimore",
+        key="data/routes.parquet",
+    )
+    assert not result["uploaded"]
+
+
+def test_stream_parquet_to_s3_in_parts(s3_client):
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({"ridership": rng.random(1_000_000)})
+    parts = []
+    s3_client.meta.events.register(
+        "provide-client-params.s3.UploadPart",
+        lambda params, **kwargs: parts.append(len(params["Body"])),
+    )
+
+    report = stream_parquet_to_s3(
+        frame, s3_client, "data/ridership.parquet", part_size=5 << 20
+    )
+    assert len(parts) > 1
+    assert sum(parts) == report["bytes"]
+    assert max(parts) == 5 << 20
+    response = s3_client.get_object(
+        Bucket="transitscope-baltimore", Key="data/ridership.parquet"
+    )
+    body = response["Body"].read()
+    assert hashlib.sha256(body).hexdigest() == report["content_hash"]
+    assert response["Metadata"][CONTENT_HASH_METADATA_KEY] == (
+        report["content_hash"]
+    )
+    pd.testing.assert_frame_equal(pd.read_parquet(io.BytesIO(body)), frame)
+
+
+def test_s3_upload_stream_aborts_on_error(tmp_path, s3_client):
+    local_copy = tmp_path / "ridership.parquet"
+    with pytest.raises(RuntimeError):
+        with S3UploadStream(
+            s3_client,
+            "transitscope-baltimore",
+            "data/ridership.parquet",
+            part_size=5 << 20,
+            local_copy=local_copy,
+        ) as stream:
+            stream.write(b"x" * (6 << 20))
+            raise RuntimeError("write failed")
+
+    uploads = s3_client.list_multipart_uploads(Bucket="transitscope-baltimore")
+    assert not uploads.get("Uploads")
+    objects = s3_client.list_objects_v2(Bucket="transitscope-baltimore")
+    assert objects["KeyCount"] == 0
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,101 @@
+import geopandas as gpd
+import pandas as pd
+import pytest
+import shapely
+from shapely.geometry import Point
+
+from prefect_transitscope_baltimore_pipeline.warehouse import (
+    load_table,
+    query,
+)
+
+
+@pytest.fixture
+def ridership():
+    return pd.DataFrame(
+        {
+            "route": pd.Categorical(["22", "BL", "22"]),
+            "date": pd.to_datetime(["2023-01-01", "2023-01-01", "2023-02-01"]),
+            "ridership": [100, 200, 110],
+        }
+    )
+
+
+def test_load_table_upserts_on_key(ridership):
+    assert load_table(ridership, "mta_bus_ridership") == {
+        "upserted": 3,
+        "deleted": 0,
+    }
+    # Loading again is idempotent
+    load_table(ridership, "mta_bus_ridership")
+    assert query("SELECT count(*) AS n FROM mta_bus_ridership")["n"][0] == 3
+
+    # Changed rows are replaced, and new routes and columns are added
+    update = pd.DataFrame(
+        {
+            "route": pd.Categorical(["22", "CityLink Red"]),
+            "date": pd.to_datetime(["2023-02-01", "2023-02-01"]),
+            "ridership": [150, 300],
+            "days": [28, 28],
+        }
+    )
+    load_table(update, "mta_bus_ridership")
+    result = query(
+        "SELECT route, date, ridership, days FROM mta_bus_ridership "
+        "WHERE date >= ? ORDER BY route",
+        ["2023-02-01"],
+    )
+    assert result["route"].tolist() == ["22", "CityLink Red"]
+    assert result["ridership"].tolist() == [150, 300]
+    assert result["days"].tolist() == [28, 28]
+    assert query("SELECT count(*) AS n FROM mta_bus_ridership")["n"][0] == 4
+
+
+def test_load_table_deletes_missing_rows():
+    stops = gpd.GeoDataFrame(
+        {"stop_id": [1, 2, 3], "stop_name": ["A", "B", "C"]},
+        geometry=[Point(0, 0), Point(1, 1), Point(2, 2)],
+        crs="EPSG:4326",
+    )
+    load_table(stops, "mta_bus_stops", delete_missing=True)
+    counts = load_table(
+        stops.iloc[[0, 2]], "mta_bus_stops", delete_missing=True
+    )
+    assert counts == {"upserted": 2, "deleted": 1}
+    result = query("SELECT * FROM mta_bus_stops ORDER BY stop_id")
+    assert result["stop_id"].tolist() == [1, 3]
+    assert shapely.from_wkb(result["geometry"].map(bytes)).tolist() == [
+        Point(0, 0),
+        Point(2, 2),
+    ]
+
+
+def test_load_table_skips_empty_frames(warehouse_path):
+    assert load_table(pd.DataFrame(), "mta_bus_ridership") == {
+        "upserted": 0,
+        "deleted": 0,
+    }
+    assert not warehouse_path.exists()
+
+
+def test_load_table_rejects_unknown_tables(ridership):
+    with pytest.raises(ValueError, match="Unknown warehouse table"):
+        load_table(ridership, "ridership")
+
+
+def test_load_table_rejects_duplicate_keys(ridership):
+    duplicated = pd.concat([ridership, ridership.iloc[[0]]])
+    with pytest.raises(ValueError, match="2 rows loaded into"):
+        load_table(duplicated, "mta_bus_ridership")
+
+
+def test_load_table_rejects_changed_column_types(ridership):
+    load_table(ridership, "mta_bus_ridership")
+    drifted = ridership.assign(ridership=["100", "200", "n/a"])
+    with pytest.raises(ValueError, match="ridership \\(BIGINT, loading"):
+        load_table(drifted, "mta_bus_ridership")
+    # Nothing was written, and columns holding only nulls still load
+    assert query(
+        "SELECT ridership FROM mta_bus_ridership ORDER BY route, date"
+    )["ridership"].tolist() == [100, 110, 200]
+    load_table(ridership.assign(ridership=None), "mta_bus_ridership")